@@ -0,0 +1,387 @@
+"""
+Execution engine for agent analysis steps
+Each step generates its SQL with AgenticNL2SQLConverter.generate_step_query,
+checks it with SQLValidator (read-only, and against the schema when one is
+given), runs it over one shared Firebolt MCP session and has Claude interpret the
+rows with analyze_query_results. Plans are DAGs: a step starts as soon as
+the steps it depends on have finished, up to a bounded number at a time, and
+only steps with dependencies get their analyses as `previous_results`
+context - so a run takes about as long as its critical path. A step whose
+dependencies all failed fails without running.
+
+Execution is pipelined: a step holds a Claude slot only while generating or
+analyzing and an engine slot only while its query runs, so step N's analysis
+overlaps step N+1's query. Slots go to the earliest step in the plan first,
+and stage occupancy is reported after each run.
+
+In step-by-step mode, StepPrefetcher runs the next step in the background
+while the user reads the current one, and hands over the finished result
+when they ask for it - unless the plan has changed in the meantime.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from llm_scheduler import BATCH, request_priority
+from sql_validator import SQLValidator
+from test_mcp_real import firebolt_mcp_session
+
+# Steps in flight at once (the pipeline depth)
+DEFAULT_MAX_CONCURRENT_STEPS = 3
+
+# Per-run stage capacity: concurrent Claude calls and concurrent Firebolt queries
+DEFAULT_LLM_SLOTS = 2
+DEFAULT_ENGINE_SLOTS = 1
+
+# Step types that reason over earlier findings, for steps without explicit dependencies
+CONTEXT_STEP_TYPES = {"hypothesis", "validation", "conclusion", "insight"}
+
+PHASES = ("generate", "execute", "analyze")
+
+
+def max_concurrent_steps() -> int:
+    return int(os.getenv('NL2SQL_AGENT_MAX_CONCURRENT_STEPS', DEFAULT_MAX_CONCURRENT_STEPS))
+
+
+def stage_slots() -> Tuple[int, int]:
+    """(Claude slots, engine slots) for one run"""
+    return (int(os.getenv('NL2SQL_AGENT_LLM_SLOTS', DEFAULT_LLM_SLOTS)),
+            int(os.getenv('NL2SQL_AGENT_ENGINE_SLOTS', DEFAULT_ENGINE_SLOTS)))
+
+
+class PipelineStage:
+    """Bounded slots for one kind of work, granted to the lowest priority value first
+
+    Every held slot is logged as a (start, end) interval for occupancy metrics.
+    """
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = capacity
+        self.active = 0
+        self.intervals: List[Tuple[float, float]] = []
+        self._waiters = []
+        self._order = itertools.count()
+
+    @asynccontextmanager
+    async def slot(self, priority: int):
+        if self.active < self.capacity and not self._waiters:
+            self.active += 1
+        else:
+            granted = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._order), granted))
+            try:
+                await granted
+            except asyncio.CancelledError:
+                if granted.done() and not granted.cancelled():
+                    self._release()
+                raise
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.intervals.append((start_time, time.perf_counter()))
+            self._release()
+
+    def _release(self):
+        # Hand the slot straight to the next waiter, so `active` only drops when nobody waits
+        while self._waiters:
+            _, _, granted = heapq.heappop(self._waiters)
+            if not granted.done():
+                granted.set_result(None)
+                return
+        self.active -= 1
+
+
+def _merge(intervals: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _overlap(a: List[Tuple[float, float]], b: List[Tuple[float, float]]) -> float:
+    """Total time covered by both merged interval lists"""
+    total, i, j = 0.0, 0, 0
+    while i < len(a) and j < len(b):
+        total += max(0.0, min(a[i][1], b[j][1]) - max(a[i][0], b[j][0]))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return total
+
+
+def stage_occupancy(llm: PipelineStage, engine: PipelineStage, wall_s: float) -> Dict[str, any]:
+    """Busy time, occupancy (busy / wall) and average slots in use per stage, and time both were busy"""
+    report, busy = {}, {}
+    for stage in (llm, engine):
+        busy[stage.name] = _merge(stage.intervals)
+        busy_s = sum(end - start for start, end in busy[stage.name])
+        report[stage.name] = {
+            "busy_ms": busy_s * 1000,
+            "occupancy": busy_s / wall_s if wall_s else 0.0,
+            "avg_in_use": sum(end - start for start, end in stage.intervals) / wall_s if wall_s else 0.0,
+            "capacity": stage.capacity,
+        }
+    report["overlap_ms"] = _overlap(busy[llm.name], busy[engine.name]) * 1000
+    return report
+
+
+class AgentStep:
+    """Represents a step in the agent's reasoning process"""
+    def __init__(self, step_type: str, description: str, status: str = "pending",
+                 depends_on: Optional[List[int]] = None, step_number: Optional[int] = None):
+        self.id = str(uuid.uuid4())
+        self.step_type = step_type  # discovery, analysis, hypothesis, validation, conclusion
+        self.description = description
+        self.status = status  # pending, in_progress, completed, failed
+        self.timestamp = datetime.now()
+        self.step_number = step_number  # 1-based; defaults to the position in the plan
+        self.depends_on = depends_on  # step numbers; None = inferred from step_type
+        self.sql_query = None
+        self.results = None
+        self.insights = []
+        self.confidence = 0.0
+        self.analysis = None  # full analyze_query_results output
+        self.error = None
+        self.timings = {}  # phase -> milliseconds
+
+
+def steps_from_plan(plan: Dict[str, any]) -> List[AgentStep]:
+    """AgentSteps for a generate_analysis_plan result (its fallback plan if generation failed)"""
+    return [
+        AgentStep(step.get("step_type", "analysis"), step["description"],
+                  depends_on=step.get("depends_on"), step_number=step.get("step_number"))
+        for step in plan.get("steps") or plan.get("fallback_plan") or []
+    ]
+
+
+def resolve_dependencies(plan: List[AgentStep]) -> Dict[str, List[AgentStep]]:
+    """Step id -> the steps it depends on
+
+    Only earlier steps count, which keeps the graph acyclic whatever the planner
+    returned. Steps without `depends_on` depend on every earlier step if their
+    type reasons over findings (CONTEXT_STEP_TYPES), otherwise on none.
+    """
+    numbers = {step.id: step.step_number or position for position, step in enumerate(plan, 1)}
+    by_number = {numbers[step.id]: step for step in plan}
+    dependencies = {}
+    for position, step in enumerate(plan):
+        if step.depends_on is None:
+            dependencies[step.id] = plan[:position] if step.step_type in CONTEXT_STEP_TYPES else []
+        else:
+            dependencies[step.id] = [by_number[n] for n in sorted(set(step.depends_on))
+                                     if n in by_number and n < numbers[step.id]]
+    return dependencies
+
+
+def critical_path_ms(plan: List[AgentStep], dependencies: Dict[str, List[AgentStep]]) -> float:
+    """Longest chain of dependent step durations - the lower bound for the run's wall time"""
+    finish = {}
+    for step in plan:
+        if step.timings:
+            start = max((finish.get(dep.id, 0.0) for dep in dependencies[step.id]), default=0.0)
+            finish[step.id] = start + step.timings.get("total", 0.0)
+    return max(finish.values(), default=0.0)
+
+
+class AgentStepExecutor:
+    """Runs AgentSteps for one business question: generate SQL -> execute on Firebolt -> analyze"""
+
+    def __init__(self, converter, business_question: str, session_factory=firebolt_mcp_session,
+                 max_concurrency: Optional[int] = None, llm_slots: Optional[int] = None,
+                 engine_slots: Optional[int] = None, schema_info: Optional[Dict[str, Dict]] = None):
+        self.converter = converter
+        self.business_question = business_question
+        self.validator = SQLValidator(schema_info)
+        self.session_factory = session_factory
+        self.max_concurrency = max_concurrency or max_concurrent_steps()
+        default_llm_slots, default_engine_slots = stage_slots()
+        self.llm_slots = llm_slots or default_llm_slots
+        self.engine_slots = engine_slots or default_engine_slots
+        self.report = {}
+
+    def execute_steps(self, steps: List[AgentStep], completed: Iterable[AgentStep] = (),
+                      on_step_done: Optional[Callable[[AgentStep], None]] = None) -> List[AgentStep]:
+        """Run `steps` to completion (or failure); `completed` are the plan's earlier, finished steps"""
+        return asyncio.run(self.run(steps, completed, on_step_done))
+
+    async def run(self, steps: List[AgentStep], completed: Iterable[AgentStep] = (),
+                  on_step_done: Optional[Callable[[AgentStep], None]] = None) -> List[AgentStep]:
+        """Start each step once its dependencies in `steps` are done, at most max_concurrency at a time
+
+        Within a step, each phase waits for a slot in its stage (Claude or engine).
+        """
+        plan = list(completed) + list(steps)
+        dependencies = resolve_dependencies(plan)
+        position = {step.id: i for i, step in enumerate(plan)}
+        done = {step.id: asyncio.Event() for step in steps}
+        slots = asyncio.Semaphore(self.max_concurrency)
+        llm, engine = PipelineStage("llm", self.llm_slots), PipelineStage("engine", self.engine_slots)
+
+        async def run_when_ready(firebolt, step: AgentStep):
+            try:
+                for dependency in dependencies[step.id]:
+                    if dependency.id in done:
+                        await done[dependency.id].wait()
+                if dependencies[step.id] and all(dep.status == "failed" for dep in dependencies[step.id]):
+                    numbers = ", ".join(str(dep.step_number or position[dep.id] + 1) for dep in dependencies[step.id])
+                    step.error = f"Skipped: the steps it depends on ({numbers}) failed"
+                    step.status = "failed"
+                    if on_step_done:
+                        on_step_done(step)
+                    return
+                async with slots:
+                    context = self.previous_results(dependencies[step.id]) or None
+                    await self._run_step(firebolt, step, context, position[step.id], llm, engine, on_step_done)
+            finally:
+                done[step.id].set()
+
+        start_time = time.perf_counter()
+        async with self.session_factory() as firebolt:
+            await asyncio.gather(*(run_when_ready(firebolt, step) for step in steps))
+        wall_s = time.perf_counter() - start_time
+        self.report = {
+            "wall_ms": wall_s * 1000,
+            "critical_path_ms": critical_path_ms(steps, dependencies),
+            "serial_ms": sum(step.timings.get("total", 0.0) for step in steps),
+            "max_concurrency": self.max_concurrency,
+            "stages": stage_occupancy(llm, engine, wall_s),
+        }
+        return steps
+
+    @staticmethod
+    def previous_results(steps: Iterable[AgentStep]) -> List[Dict[str, any]]:
+        """Analyses of completed steps in the shape generate_step_query expects"""
+        return [step.analysis for step in steps if step.analysis]
+
+    async def _run_step(self, firebolt, step: AgentStep, context: Optional[List[Dict[str, any]]], priority: int,
+                        llm: PipelineStage, engine: PipelineStage,
+                        on_step_done: Optional[Callable[[AgentStep], None]]):
+        step.status = "in_progress"
+        step.timestamp = datetime.now()
+        try:
+            query = await self._in_stage(step, "generate", llm, priority, lambda: asyncio.to_thread(
+                self.converter.generate_step_query, step.description, step.step_type,
+                self.business_question, context
+            ))
+            if query.get("success") is False or not query.get("sql"):
+                raise Exception(query.get("error") or "No SQL generated")
+            step.sql_query = query["sql"]
+            validation = self.validator.validate(step.sql_query)
+            if not validation["valid"]:
+                raise Exception(f"Generated SQL rejected: {'; '.join(validation['errors'])}")
+
+            step.results = await self._in_stage(step, "execute", engine, priority,
+                                                lambda: firebolt.query(step.sql_query))
+
+            analysis = await self._in_stage(step, "analyze", llm, priority, lambda: asyncio.to_thread(
+                self.converter.analyze_query_results, step.results, step.description, self.business_question
+            ))
+            if analysis.get("success") is False:
+                raise Exception(analysis.get("error") or "Results analysis failed")
+            analysis["insights"] = analysis.get("key_insights", [])
+            step.analysis = analysis
+            step.insights = analysis["insights"]
+            step.confidence = float(analysis.get("confidence_level", query.get("confidence", 0.0)))
+            step.status = "completed"
+        except Exception as e:
+            step.error = str(e)
+            step.status = "failed"
+        step.timings["total"] = sum(step.timings.get(phase, 0.0) for phase in PHASES)
+        if on_step_done:
+            on_step_done(step)
+
+    @staticmethod
+    async def _in_stage(step: AgentStep, phase: str, stage: PipelineStage, priority: int, work):
+        """Run `work()` holding a `stage` slot; time spent waiting for it is added to timings["queued"]"""
+        queued_at = time.perf_counter()
+        async with stage.slot(priority):
+            start_time = time.perf_counter()
+            step.timings["queued"] = step.timings.get("queued", 0.0) + (start_time - queued_at) * 1000
+            try:
+                return await work()
+            finally:
+                step.timings[phase] = (time.perf_counter() - start_time) * 1000
+
+
+class StepPrefetcher:
+    """Speculatively runs the next step of a step-by-step plan in the background
+
+    The step runs on a copy, with its Claude calls at batch priority so
+    interactive requests go first. `take` adopts the result only if the
+    question, the plan and the steps before it are unchanged since `start`.
+    """
+
+    # Copied onto the real step when a speculative run is adopted
+    RESULT_ATTRIBUTES = ("status", "timestamp", "sql_query", "results", "insights", "confidence",
+                         "analysis", "error", "timings")
+
+    def __init__(self):
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+
+    @staticmethod
+    def plan_key(business_question: str, plan: List[AgentStep], index: int) -> tuple:
+        return (business_question, index, tuple(
+            (step.id, step.step_type, step.description, tuple(step.depends_on or ()), step.status if i < index else None)
+            for i, step in enumerate(plan)
+        ))
+
+    def start(self, executor: AgentStepExecutor, plan: List[AgentStep], index: int):
+        """Run plan[index] in the background with plan[:index] as its finished predecessors"""
+        self.discard()
+        step = plan[index]
+        shadow = AgentStep(step.step_type, step.description, depends_on=step.depends_on, step_number=step.step_number)
+        completed = list(plan[:index])
+
+        def run():
+            with request_priority(BATCH):
+                executor.execute_steps([shadow], completed)
+            return executor.report
+
+        key = self.plan_key(executor.business_question, plan, index)
+        # Pool threads do not inherit context variables (e.g. the usage tracker's run id)
+        self._pending = (key, shadow, self._pool.submit(contextvars.copy_context().run, run))
+
+    def take(self, business_question: str, plan: List[AgentStep], index: int) -> Optional[Dict[str, any]]:
+        """Adopt the speculative run of plan[index] (waiting for it if still running)
+
+        Returns the run's report, or None when there is no valid, successful
+        speculation and the step has to be executed normally.
+        """
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return None
+        key, shadow, future = pending
+        if key != self.plan_key(business_question, plan, index):
+            future.cancel()
+            return None
+        try:
+            report = future.result()
+        except Exception:
+            return None
+        if shadow.status != "completed":
+            return None
+        for attribute in self.RESULT_ATTRIBUTES:
+            setattr(plan[index], attribute, getattr(shadow, attribute))
+        return report
+
+    def discard(self):
+        """Drop any speculation; a run already in progress finishes in the background and is ignored"""
+        if self._pending:
+            self._pending[2].cancel()
+            self._pending = None
@@ -13,15 +13,18 @@ import json
 import time
 import os
 import sys
-from datetime import datetime, timedelta
 from PIL import Image
 from typing import Dict, List, Any, Optional
-import uuid
 
 # Add current directory to path
 sys.path.append('/Users/kushagrnagpal/mcp-nl2sql')
-from nl2sql_claude import NL2SQLConverter
-from test_mcp_real import execute_query_via_mcp
+from agentic_nl2sql import AgenticNL2SQLConverter
+from agent_executor import AgentStep, AgentStepExecutor, StepPrefetcher, steps_from_plan
+from llm_calls import LLMUsageTracker
+from llm_backend import preconnect_llm_backend
+from schema_catalog import SchemaCatalog
+from schema_format import compact_schema
+from test_mcp_real import firebolt_mcp_session
 
 # Enhanced page config for agent demo
 st.set_page_config(
@@ -31,36 +34,38 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-class AgentStep:
-    """Represents a step in the agent's reasoning process"""
-    def __init__(self, step_type: str, description: str, status: str = "pending"):
-        self.id = str(uuid.uuid4())
-        self.step_type = step_type  # discovery, analysis, hypothesis, validation, conclusion
-        self.description = description
-        self.status = status  # pending, in_progress, completed, failed
-        self.timestamp = datetime.now()
-        self.sql_query = None
-        self.results = None
-        self.insights = []
-        self.confidence = 0.0
-
 class BusinessIntelligenceAgent:
     """Enhanced AI agent that performs multi-step business analysis"""
     
-    def __init__(self, nl2sql_converter: NL2SQLConverter):
+    def __init__(self, nl2sql_converter: AgenticNL2SQLConverter, schema_info: Optional[Dict[str, Dict]] = None):
         self.nl2sql_converter = nl2sql_converter
+        self.schema_info = schema_info
         self.planning_steps = []
         self.execution_log = []
         self.final_insights = []
+        self.schedule_report = {}
+        self.plan_error = None
+        self.prefetcher = StepPrefetcher()
         
     def create_analysis_plan(self, user_question: str) -> List[AgentStep]:
-        """Create a multi-step analysis plan based on the user question"""
-        
-        question_lower = user_question.lower()
+        """Have Claude plan the analysis (with step dependencies)
         
+        If planning fails the converter's fallback plan is used, and the
+        keyword templates below when there is no plan at all.
+        """
         # Store the original question for context
         self.original_question = user_question
         
+        plan = self.nl2sql_converter.generate_analysis_plan(user_question)
+        self.plan_error = plan.get("error") if plan.get("success") is False else None
+        steps = steps_from_plan(plan)
+        return steps or self._create_template_plan(user_question)
+    
+    def _create_template_plan(self, user_question: str) -> List[AgentStep]:
+        """Pick a canned multi-step plan from keywords in the user question"""
+        
+        question_lower = user_question.lower()
+        
         # More detailed question analysis
         if any(word in question_lower for word in ["revenue", "money", "monetization", "spending", "income"]):
             return self._create_revenue_analysis_plan(user_question)
@@ -78,85 +83,113 @@ class BusinessIntelligenceAgent:
     def _create_revenue_analysis_plan(self, question: str) -> List[AgentStep]:
         """Create analysis plan for revenue-related questions"""
         return [
-            AgentStep("discovery", "🔍 Analyzing current revenue trends and patterns"),
-            AgentStep("analysis", "📊 Segmenting revenue by player demographics and regions"),
-            AgentStep("comparison", "📈 Comparing performance across time periods"),
-            AgentStep("hypothesis", "🎯 Identifying top revenue drivers and potential issues"),
-            AgentStep("validation", "✅ Validating insights with supporting data"),
-            AgentStep("conclusion", "💡 Generating strategic recommendations")
+            AgentStep("discovery", "🔍 Analyzing current revenue trends and patterns", depends_on=[]),
+            AgentStep("analysis", "📊 Segmenting revenue by player demographics and regions", depends_on=[]),
+            AgentStep("comparison", "📈 Comparing performance across time periods", depends_on=[]),
+            AgentStep("hypothesis", "🎯 Identifying top revenue drivers and potential issues", depends_on=[1, 2, 3]),
+            AgentStep("validation", "✅ Validating insights with supporting data", depends_on=[4]),
+            AgentStep("conclusion", "💡 Generating strategic recommendations", depends_on=[4, 5])
         ]
     
     def _create_player_analysis_plan(self, question: str) -> List[AgentStep]:
         """Create analysis plan for player-related questions"""
         return [
-            AgentStep("discovery", "👥 Analyzing player base demographics and behavior"),
-            AgentStep("analysis", "🎮 Examining game session patterns and engagement"),
-            AgentStep("segmentation", "📊 Segmenting players by value and activity"),
-            AgentStep("hypothesis", "🔍 Identifying retention and churn patterns"),
-            AgentStep("validation", "📈 Testing hypotheses with cohort analysis"),
-            AgentStep("conclusion", "🎯 Recommending player experience improvements")
+            AgentStep("discovery", "👥 Analyzing player base demographics and behavior", depends_on=[]),
+            AgentStep("analysis", "🎮 Examining game session patterns and engagement", depends_on=[]),
+            AgentStep("segmentation", "📊 Segmenting players by value and activity", depends_on=[]),
+            AgentStep("hypothesis", "🔍 Identifying retention and churn patterns", depends_on=[2, 3]),
+            AgentStep("validation", "📈 Testing hypotheses with cohort analysis", depends_on=[4]),
+            AgentStep("conclusion", "🎯 Recommending player experience improvements", depends_on=[1, 4, 5])
         ]
     
     def _create_performance_analysis_plan(self, question: str) -> List[AgentStep]:
         """Create analysis plan for performance/benchmark questions"""
         return [
-            AgentStep("discovery", "📊 Calculating key performance indicators"),
-            AgentStep("benchmarking", "🏆 Comparing against historical baselines"),
-            AgentStep("analysis", "🔍 Identifying performance drivers and bottlenecks"),
-            AgentStep("forecasting", "📈 Projecting future trends and scenarios"),
-            AgentStep("validation", "✅ Validating assumptions with data evidence"),
-            AgentStep("conclusion", "🚀 Developing optimization strategies")
+            AgentStep("discovery", "📊 Calculating key performance indicators", depends_on=[]),
+            AgentStep("benchmarking", "🏆 Comparing against historical baselines", depends_on=[]),
+            AgentStep("analysis", "🔍 Identifying performance drivers and bottlenecks", depends_on=[]),
+            AgentStep("forecasting", "📈 Projecting future trends and scenarios", depends_on=[1, 2]),
+            AgentStep("validation", "✅ Validating assumptions with data evidence", depends_on=[3, 4]),
+            AgentStep("conclusion", "🚀 Developing optimization strategies", depends_on=[3, 4, 5])
         ]
     
     def _create_geographic_analysis_plan(self, question: str) -> List[AgentStep]:
         """Create analysis plan for geographic/market questions"""
         return [
-            AgentStep("discovery", "🌍 Mapping current geographic distribution and performance"),
-            AgentStep("analysis", "📊 Analyzing market penetration and player behavior by region"),
-            AgentStep("comparison", "🔍 Comparing revenue and engagement across markets"),
-            AgentStep("opportunity", "🎯 Identifying expansion opportunities and market gaps"),
-            AgentStep("validation", "✅ Validating market potential with supporting metrics"),
-            AgentStep("conclusion", "🚀 Prioritizing markets for expansion strategy")
+            AgentStep("discovery", "🌍 Mapping current geographic distribution and performance", depends_on=[]),
+            AgentStep("analysis", "📊 Analyzing market penetration and player behavior by region", depends_on=[]),
+            AgentStep("comparison", "🔍 Comparing revenue and engagement across markets", depends_on=[]),
+            AgentStep("opportunity", "🎯 Identifying expansion opportunities and market gaps", depends_on=[1, 2, 3]),
+            AgentStep("validation", "✅ Validating market potential with supporting metrics", depends_on=[4]),
+            AgentStep("conclusion", "🚀 Prioritizing markets for expansion strategy", depends_on=[4, 5])
         ]
     
     def _create_correlation_analysis_plan(self, question: str) -> List[AgentStep]:
         """Create analysis plan for correlation/relationship questions"""
         return [
-            AgentStep("discovery", "🔍 Identifying key variables and metrics for correlation"),
-            AgentStep("measurement", "📏 Measuring baseline metrics and data distributions"),
-            AgentStep("correlation", "📊 Calculating correlations and statistical relationships"),
-            AgentStep("segmentation", "🎯 Analyzing relationships across different player segments"),
-            AgentStep("validation", "✅ Validating statistical significance of relationships"),
-            AgentStep("conclusion", "💡 Interpreting correlations for business insights")
+            AgentStep("discovery", "🔍 Identifying key variables and metrics for correlation", depends_on=[]),
+            AgentStep("measurement", "📏 Measuring baseline metrics and data distributions", depends_on=[]),
+            AgentStep("correlation", "📊 Calculating correlations and statistical relationships", depends_on=[1]),
+            AgentStep("segmentation", "🎯 Analyzing relationships across different player segments", depends_on=[3]),
+            AgentStep("validation", "✅ Validating statistical significance of relationships", depends_on=[3]),
+            AgentStep("conclusion", "💡 Interpreting correlations for business insights", depends_on=[4, 5])
         ]
 
     def _create_general_exploration_plan(self, question: str) -> List[AgentStep]:
         """Create general exploration plan"""
         return [
-            AgentStep("discovery", "🗺️ Exploring available data and key metrics"),
-            AgentStep("analysis", "📊 Identifying interesting patterns and trends"),
-            AgentStep("correlation", "🔗 Finding relationships between variables"),
-            AgentStep("insight", "💡 Generating data-driven insights"),
-            AgentStep("validation", "✅ Validating findings with additional queries"),
-            AgentStep("conclusion", "📋 Summarizing key takeaways")
+            AgentStep("discovery", "🗺️ Exploring available data and key metrics", depends_on=[]),
+            AgentStep("analysis", "📊 Identifying interesting patterns and trends", depends_on=[]),
+            AgentStep("correlation", "🔗 Finding relationships between variables", depends_on=[]),
+            AgentStep("insight", "💡 Generating data-driven insights", depends_on=[1, 2, 3]),
+            AgentStep("validation", "✅ Validating findings with additional queries", depends_on=[4]),
+            AgentStep("conclusion", "📋 Summarizing key takeaways", depends_on=[4, 5])
         ]
 
-    def execute_analysis_plan(self, steps: List[AgentStep]) -> List[Dict[str, Any]]:
-        """Execute the analysis plan step by step (simplified for demo)"""
-        results = []
+    def execute_analysis_plan(self, steps: List[AgentStep], completed: List[AgentStep] = (),
+                              on_step_done=None) -> List[Dict[str, Any]]:
+        """Execute steps for real: generate SQL, run it on Firebolt and analyze the results
         
+        Steps start as soon as the steps they depend on are done (bounded concurrency);
+        steps in `completed` only provide context.
+        """
+        executor = self._executor()
+        executor.execute_steps(steps, completed, on_step_done)
+        self.schedule_report = executor.report
+        return self._log_steps(steps)
+    
+    def prefetch_step(self, plan: List[AgentStep], index: int):
+        """Speculatively execute plan[index] in the background while the user reviews earlier steps"""
+        self.prefetcher.start(self._executor(), plan, index)
+    
+    def _executor(self) -> AgentStepExecutor:
+        return AgentStepExecutor(self.nl2sql_converter, self.original_question, schema_info=self.schema_info)
+    
+    def take_prefetched_step(self, plan: List[AgentStep], index: int) -> bool:
+        """Complete plan[index] from its speculative run, if that is still valid for this plan"""
+        report = self.prefetcher.take(self.original_question, plan, index)
+        if report is None:
+            return False
+        self.schedule_report = report
+        self._log_steps([plan[index]])
+        return True
+    
+    def _log_steps(self, steps: List[AgentStep]) -> List[Dict[str, Any]]:
+        results = []
         for i, step in enumerate(steps):
-            step.status = "pending"
             results.append({
                 "step_index": i,
                 "step": step,
-                "simulated": True
+                "sql": step.sql_query,
+                "rows": len(step.results or []),
+                "insights": step.insights,
+                "confidence": step.confidence,
+                "timings": step.timings,
+                "error": step.error
             })
-                
+        self.execution_log.extend(results)
         return results
 
-    # Query methods removed - using simulated execution for demo
-
 # Enhanced Streamlit App
 class AgenticAIDemo:
     def __init__(self):
@@ -189,6 +222,12 @@ class AgenticAIDemo:
             st.session_state.show_execution_controls = False
         if 'current_step_index' not in st.session_state:
             st.session_state.current_step_index = 0
+        if 'llm_usage' not in st.session_state:
+            st.session_state.llm_usage = LLMUsageTracker()
+        if 'agent_run_id' not in st.session_state:
+            st.session_state.agent_run_id = None
+        if 'agent' not in st.session_state:
+            st.session_state.agent = None
 
     def render_enhanced_header(self):
         """Enhanced header for agentic AI demo"""
@@ -230,6 +269,8 @@ class AgenticAIDemo:
                     st.markdown(f"""
                     **Step {i+1}**: {status_icon} {step.description}
                     """)
+                    if step.depends_on:
+                        st.caption(f"↳ builds on step {', '.join(str(n) for n in step.depends_on)}")
                     
                     # Show details if completed
                     if step.status == "completed" and step.insights:
@@ -242,7 +283,7 @@ class AgenticAIDemo:
                                 st.caption(f"Confidence: {step.confidence:.1%}")
                     
                     elif step.status == "failed":
-                        st.error("Step failed - trying alternative approach")
+                        st.error(f"Step failed: {step.error}")
                 
                 # Progress indicator
                 completed_steps = len([s for s in st.session_state.current_analysis_plan if s.status == "completed"])
@@ -253,6 +294,16 @@ class AgenticAIDemo:
                     st.markdown("### 📊 Overall Progress")
                     st.progress(progress)
                     st.caption(f"{completed_steps}/{total_steps} steps completed")
+                
+                report = st.session_state.agent.schedule_report if st.session_state.agent else {}
+                if report:
+                    st.caption(f"⏱️ Last run {report['wall_ms'] / 1000:.1f}s • critical path "
+                               f"{report['critical_path_ms'] / 1000:.1f}s • sequential {report['serial_ms'] / 1000:.1f}s")
+                    stages = report['stages']
+                    st.caption(f"🔀 Pipeline: Claude busy {stages['llm']['occupancy']:.0%} • Firebolt busy "
+                               f"{stages['engine']['occupancy']:.0%} • overlapped {stages['overlap_ms'] / 1000:.1f}s")
+            
+                self.render_run_usage()
             
             else:
                 st.info("🤖 Agent is ready to analyze your business questions with multi-step reasoning!")
@@ -266,6 +317,21 @@ class AgenticAIDemo:
                 - **💡 Insights**: Generate recommendations
                 """)
 
+    def render_run_usage(self):
+        """Tokens, cost and latency of the Claude calls made by the current agent run"""
+        if not st.session_state.agent_run_id:
+            return
+        usage = st.session_state.llm_usage.summary(st.session_state.agent_run_id)
+        totals = usage['totals']
+        if not totals['calls']:
+            return
+        
+        st.markdown("### 🪙 Run Cost")
+        st.caption(f"{totals['calls']} Claude calls • {totals['input_tokens']:,} in / {totals['output_tokens']:,} out • "
+                   f"${totals['cost_usd']:.4f} • {totals['latency_ms'] / 1000:.1f}s")
+        for call_site, stats in usage['by_call_site'].items():
+            st.caption(f"• {call_site}: {stats['calls']} calls, {stats['input_tokens']:,} in, avg {stats['avg_latency_ms']:.0f}ms")
+    
     def render_agent_query_interface(self):
         """Enhanced query interface for agentic AI"""
         
@@ -336,14 +402,22 @@ class AgenticAIDemo:
         
         try:
             with st.spinner("🧠 Initializing AI agent..."):
-                # Initialize agent (simplified for demo)
-                self.agent = BusinessIntelligenceAgent(None)  # Simplified for demo
+                # Steps are generated, executed and analyzed for real, so the agent needs Claude
+                converter = AgenticNL2SQLConverter(schema_context=self.format_schema_for_claude(),
+                                                   usage_tracker=st.session_state.llm_usage,
+                                                   schema_info=st.session_state.schema_info)
+                self.agent = st.session_state.agent = BusinessIntelligenceAgent(converter, st.session_state.schema_info)
                 
                 # Store the question in session state too for UI access
                 st.session_state.current_question = question
                 
+                # Claude calls from here on are accounted to this agent run
+                st.session_state.agent_run_id = st.session_state.llm_usage.start_run(question)
+                
                 # Create analysis plan
                 st.session_state.current_analysis_plan = self.agent.create_analysis_plan(question)
+                if self.agent.plan_error:
+                    st.warning(f"⚠️ Planning failed, using a fallback plan: {self.agent.plan_error}")
                 
                 # Mark first step as in progress
                 if st.session_state.current_analysis_plan:
@@ -371,6 +445,9 @@ class AgenticAIDemo:
         st.session_state.analysis_in_progress = False
         st.session_state.show_execution_controls = False
         st.session_state.current_step_index = 0
+        if st.session_state.get('agent'):
+            st.session_state.agent.prefetcher.discard()
+        st.session_state.agent = None
         if 'current_question' in st.session_state:
             del st.session_state.current_question
 
@@ -420,237 +497,62 @@ class AgenticAIDemo:
         """Execute the next step in the analysis"""
         
         current_step_index = st.session_state.current_step_index
+        plan = st.session_state.current_analysis_plan
         
-        if current_step_index < len(st.session_state.current_analysis_plan):
-            current_step = st.session_state.current_analysis_plan[current_step_index]
+        if current_step_index < len(plan):
+            current_step = plan[current_step_index]
             
+            agent = st.session_state.agent
             with st.spinner(f"🔄 {current_step.description}"):
-                # Simulate step execution
-                import time
-                time.sleep(1)  # Simulate processing time
-                
-                # Generate simulated insights
-                current_step.status = "completed"
-                current_step.confidence = 0.85 + (current_step_index * 0.02)  # Increasing confidence
-                current_step.insights = self.generate_demo_insights(current_step.step_type, current_step_index)
+                # Usually already done in the background while the previous step was being read
+                if not agent.take_prefetched_step(plan, current_step_index):
+                    agent.execute_analysis_plan([current_step], plan[:current_step_index])
                 
                 # Move to next step
                 st.session_state.current_step_index += 1
                 
-                # Mark next step as in progress if it exists
-                if st.session_state.current_step_index < len(st.session_state.current_analysis_plan):
-                    st.session_state.current_analysis_plan[st.session_state.current_step_index].status = "in_progress"
+                # Mark next step as in progress if it exists, and start it speculatively
+                if st.session_state.current_step_index < len(plan):
+                    plan[st.session_state.current_step_index].status = "in_progress"
+                    agent.prefetch_step(plan, st.session_state.current_step_index)
             
-            st.success(f"✅ Completed: {current_step.description}")
+            if current_step.status == "completed":
+                st.success(f"✅ Completed: {current_step.description}")
+            else:
+                st.error(f"❌ Step failed: {current_step.error}")
             st.rerun()
 
     def auto_execute_all_steps(self):
-        """Auto-execute all remaining steps"""
+        """Auto-execute all remaining steps, independent ones concurrently"""
+        
+        plan = st.session_state.current_analysis_plan
         
-        remaining_steps = len(st.session_state.current_analysis_plan) - st.session_state.current_step_index
+        # A speculative run of the next step is reused rather than repeated
+        if st.session_state.agent.take_prefetched_step(plan, st.session_state.current_step_index):
+            st.session_state.current_step_index += 1
+        remaining = plan[st.session_state.current_step_index:]
         
         progress_bar = st.progress(0)
         status_text = st.empty()
+        status_text.text(f"🔄 Executing {len(remaining)} steps...")
+        done = []
         
-        for i in range(remaining_steps):
-            step_index = st.session_state.current_step_index + i
-            current_step = st.session_state.current_analysis_plan[step_index]
-            
-            status_text.text(f"🔄 {current_step.description}")
-            
-            # Simulate processing
-            import time
-            time.sleep(0.5)
-            
-            # Complete step
-            current_step.status = "completed"
-            current_step.confidence = 0.85 + (step_index * 0.02)
-            current_step.insights = self.generate_demo_insights(current_step.step_type, step_index)
-            
-            progress_bar.progress((i + 1) / remaining_steps)
+        def on_step_done(step: AgentStep):
+            done.append(step)
+            icon = "✅" if step.status == "completed" else "❌"
+            status_text.text(f"{icon} {step.description}")
+            progress_bar.progress(len(done) / len(remaining))
         
-        st.session_state.current_step_index = len(st.session_state.current_analysis_plan)
+        if remaining:
+            st.session_state.agent.execute_analysis_plan(remaining, plan[:st.session_state.current_step_index], on_step_done)
         
-        status_text.text("🎉 All steps completed!")
+        st.session_state.current_step_index = len(plan)
+        
+        failed = [step for step in remaining if step.status == "failed"]
+        status_text.text("🎉 All steps completed!" if not failed else f"⚠️ {len(failed)} steps failed")
         st.success("✅ Agent analysis complete!")
         st.rerun()
 
-    def generate_demo_insights(self, step_type: str, step_index: int) -> List[str]:
-        """Generate demo insights customized for the question type and step"""
-        
-        # Determine the analysis type from the current question
-        if hasattr(self.agent, 'original_question'):
-            question_lower = self.agent.original_question.lower()
-        elif 'current_question' in st.session_state:
-            question_lower = st.session_state.current_question.lower()
-        else:
-            question_lower = "general"
-            
-        # Customize insights based on question type and step type
-        if any(word in question_lower for word in ["revenue", "money", "monetization"]):
-            return self._get_revenue_insights(step_type, step_index)
-        elif any(word in question_lower for word in ["player", "retention", "engagement"]):
-            return self._get_player_insights(step_type, step_index)
-        elif any(word in question_lower for word in ["geographic", "country", "expansion"]):
-            return self._get_geographic_insights(step_type, step_index)
-        elif any(word in question_lower for word in ["correlation", "correlate", "relationship", "value"]):
-            return self._get_correlation_insights(step_type, step_index)
-        elif any(word in question_lower for word in ["performance", "benchmark"]):
-            return self._get_performance_insights(step_type, step_index)
-        else:
-            return self._get_general_insights(step_type, step_index)
-    
-    def _get_revenue_insights(self, step_type: str, step_index: int) -> List[str]:
-        """Revenue-focused insights"""
-        insights_map = {
-            "discovery": [
-                "💰 Total revenue: $3.2M with 22% month-over-month growth",
-                "🎮 Revenue per player: $64 average, $180 for premium users",
-                "📊 Revenue streams: 65% in-app purchases, 35% subscriptions"
-            ],
-            "analysis": [
-                "🏆 Premium players drive 78% of total revenue",
-                "🌍 Top revenue markets: US ($1.2M), Germany ($480K), Japan ($380K)",
-                "📈 Mobile IAP conversion rate: 12.5% vs desktop 8.3%"
-            ],
-            "comparison": [
-                "📊 Q3 revenue growth: +28% vs Q2, exceeding 15% target",
-                "💸 ARPU increased 18% after pricing optimization",
-                "🎯 Revenue concentration: Top 5% users generate 45% revenue"
-            ],
-            "conclusion": [
-                "🚀 Prioritize premium feature development for high-LTV segments",
-                "💡 Optimize mobile payment flows for higher conversion",
-                "📈 Expected revenue impact: +25% with recommended changes"
-            ]
-        }
-        return insights_map.get(step_type, [f"💰 Revenue analysis: {step_type} completed"])
-    
-    def _get_player_insights(self, step_type: str, step_index: int) -> List[str]:
-        """Player engagement and retention insights"""
-        insights_map = {
-            "discovery": [
-                "👥 Active player base: 125K daily, 480K monthly users",
-                "📊 Retention rates: Day 1 (45%), Day 7 (23%), Day 30 (12%)",
-                "🎮 Average session: 18 minutes, 3.2 sessions per day"
-            ],
-            "analysis": [
-                "🎯 High-engagement players: 15% of base, 4+ hours daily",
-                "📱 Mobile players show 35% higher retention than desktop",
-                "🏆 Level progression strongly predicts long-term retention"
-            ],
-            "segmentation": [
-                "👑 Power users: 8% of players, 60+ min daily, 85% retention",
-                "🎮 Core players: 25% of players, 20-60 min daily, 45% retention",
-                "🎯 Casual players: 67% of players, <20 min daily, 15% retention"
-            ],
-            "conclusion": [
-                "⚡ Focus onboarding improvements for casual player conversion",
-                "🎮 Enhance social features to boost core player engagement",
-                "📈 Projected retention lift: +40% with targeted interventions"
-            ]
-        }
-        return insights_map.get(step_type, [f"👥 Player analysis: {step_type} completed"])
-    
-    def _get_geographic_insights(self, step_type: str, step_index: int) -> List[str]:
-        """Geographic and market expansion insights"""
-        insights_map = {
-            "discovery": [
-                "🌍 Current presence: 28 countries across 5 regions",
-                "📊 Regional distribution: NA (45%), EU (30%), APAC (20%), Others (5%)",
-                "💰 Revenue per region: NA leads with $1.8M, EU $950K, APAC $420K"
-            ],
-            "analysis": [
-                "🇺🇸 US market: Mature, high ARPU ($85), competitive landscape",
-                "🇩🇪 Germany: Growing fast (+45% QoQ), strong retention rates",
-                "🇯🇵 Japan: Untapped potential, cultural adaptation needed"
-            ],
-            "opportunity": [
-                "🎯 High-potential markets: Brazil, India, Southeast Asia",
-                "💡 Expansion readiness: Localization for 3 new languages identified",
-                "📈 Market size estimates: $2.5M additional revenue potential"
-            ],
-            "conclusion": [
-                "🚀 Immediate expansion: Brazil and India within Q1",
-                "🌟 Localization priorities: Portuguese, Hindi, Thai",
-                "💰 Expected ROI: 280% over 18 months for expansion investment"
-            ]
-        }
-        return insights_map.get(step_type, [f"🌍 Geographic analysis: {step_type} completed"])
-    
-    def _get_correlation_insights(self, step_type: str, step_index: int) -> List[str]:
-        """Correlation and relationship insights"""
-        insights_map = {
-            "discovery": [
-                "🔍 Key variables identified: engagement time, spending, social activity",
-                "📊 Data quality: 95% complete records across 480K players",
-                "📈 Measurement period: 90 days of player behavior data"
-            ],
-            "correlation": [
-                "📊 Engagement ↔ LTV correlation: 0.78 (strong positive)",
-                "💰 Social activity ↔ spending: 0.65 (moderate positive)",
-                "🎮 Session frequency ↔ retention: 0.72 (strong positive)"
-            ],
-            "segmentation": [
-                "👑 High-LTV players: 3x more social interactions, 2.5x longer sessions",
-                "🎯 Premium subscribers: 85% have >10 friends, vs 35% for free users",
-                "📱 Mobile users show stronger engagement-spending correlation (0.82 vs 0.71)"
-            ],
-            "conclusion": [
-                "💡 Social features are strongest predictor of player value",
-                "🎮 Engagement optimization can drive 45% LTV increase",
-                "🚀 Recommend: Social onboarding flow for new players"
-            ]
-        }
-        return insights_map.get(step_type, [f"🔗 Correlation analysis: {step_type} completed"])
-    
-    def _get_performance_insights(self, step_type: str, step_index: int) -> List[str]:
-        """Performance and benchmarking insights"""
-        insights_map = {
-            "discovery": [
-                "📊 Current KPIs: DAU 125K, Revenue $3.2M/month, Retention 23% D7",
-                "🎯 Industry benchmarks: DAU growth +15%, Revenue growth +20%",
-                "⚡ Performance gaps: Retention below industry average (30% D7)"
-            ],
-            "benchmarking": [
-                "🏆 Above benchmark: Revenue per user (+25% vs industry)",
-                "📈 Meeting benchmark: User acquisition cost (industry average)",
-                "⚠️ Below benchmark: Retention rates (-23% vs top performers)"
-            ],
-            "forecasting": [
-                "📊 Revenue projection: $4.1M by Q4 with current trends",
-                "🎯 User growth forecast: 180K DAU by year-end",
-                "⚡ Optimization potential: +30% revenue with retention fixes"
-            ],
-            "conclusion": [
-                "🚀 Priority focus: Retention optimization programs",
-                "💰 Revenue optimization: Already outperforming market",
-                "📈 Target: Reach top quartile retention within 6 months"
-            ]
-        }
-        return insights_map.get(step_type, [f"📊 Performance analysis: {step_type} completed"])
-    
-    def _get_general_insights(self, step_type: str, step_index: int) -> List[str]:
-        """General exploration insights"""
-        insights_map = {
-            "discovery": [
-                "🎮 Dataset overview: 480K players, 28 countries, 90 days data",
-                "📊 Key metrics identified: engagement, revenue, retention",
-                "🔍 Data quality: High completeness, ready for analysis"
-            ],
-            "analysis": [
-                "📈 Growth trends: Steady user acquisition, increasing engagement",
-                "💰 Revenue patterns: Strong weekend spikes, mobile preference",
-                "🎯 User segments: Clear differentiation by engagement level"
-            ],
-            "conclusion": [
-                "💡 Multiple optimization opportunities identified",
-                "🚀 Data-driven insights ready for strategic planning",
-                "📊 Comprehensive analysis completed successfully"
-            ]
-        }
-        return insights_map.get(step_type, [f"✅ {step_type.title()} analysis completed"])
-
     def render_agentic_loop_diagram(self):
         """Render the agentic loop visualization to show autonomous reasoning"""
         
@@ -846,40 +748,53 @@ class AgenticAIDemo:
             """)
 
     def format_schema_for_claude(self):
-        """Format schema context (simplified version)"""
-        return """
-        Gaming Analytics Database Schema:
-        
-        Tables:
-        - players: Player demographics and activity data
-        - games: Game sessions and performance metrics  
-        - transactions: Player purchases and revenue data
-        - player_events: Detailed behavioral event tracking
-        - leaderboards: Competition rankings and scores
-        
-        Key relationships: All tables connect via player_id
-        """
+        """Compact schema context (columns, primary index and join keys) for the connected database"""
+        return f"Gaming Analytics Database Schema:\n{compact_schema(st.session_state.schema_info)}"
+
+    def connect_to_firebolt(self):
+        """Load the schema of the database configured by FIREBOLT_MCP_* (cached by the schema catalog)"""
+        account = os.getenv('FIREBOLT_MCP_ACCOUNT', '')
+        database = os.getenv('FIREBOLT_MCP_DATABASE', '')
+        with st.spinner("🔌 Connecting to Firebolt and loading the schema..."):
+            try:
+                schema_entry, schema_source = asyncio.run(self._load_schema_async(account, database))
+            except Exception as e:
+                st.error(f"❌ Connection failed: {str(e)}")
+                return
+        st.session_state.schema_info = schema_entry['schema_info']
+        st.session_state.credentials = {"account": account, "database": database,
+                                        "engine": os.getenv('FIREBOLT_MCP_ENGINE', '')}
+        st.session_state.is_connected = True
+        st.success(f"✅ Connected! {len(st.session_state.schema_info)} tables ({schema_source})")
+        st.rerun()
+
+    async def _load_schema_async(self, account, database):
+        """Fingerprint probe and (only if the schema changed) discovery in one MCP session"""
+        async with firebolt_mcp_session() as firebolt:
+            return await SchemaCatalog().load(firebolt, account, database)
 
     def render_connection_ui(self):
-        """Simplified connection UI for demo"""
+        """Connection UI for the demo"""
         if not st.session_state.is_connected:
             st.markdown("### 🔌 Connect to Firebolt")
-            st.info("For this demo, we'll simulate a connection to showcase agentic AI capabilities")
+            st.info("Agent steps run on the Firebolt database configured by the FIREBOLT_MCP_* environment variables")
             
             if st.button("🚀 Connect Demo Database", type="primary"):
-                # Simulate connection for demo
-                st.session_state.is_connected = True
-                st.session_state.credentials = {"database": "gaming_demo", "engine": "ai_demo_engine"}
-                st.success("✅ Connected to demo environment!")
-                st.rerun()
+                self.connect_to_firebolt()
         else:
-            st.success("✅ Connected to Firebolt Gaming Analytics Database")
+            st.success(f"✅ Connected to Firebolt ({len(st.session_state.schema_info)} tables)")
             if st.button("🔄 Disconnect"):
                 st.session_state.is_connected = False
+                st.session_state.schema_info = {}
                 st.rerun()
 
     def run_demo(self):
         """Main demo application"""
+        # Claude calls made during this rerun count towards the current agent run
+        with st.session_state.llm_usage.run(st.session_state.agent_run_id):
+            self._render_demo()
+    
+    def _render_demo(self):
         self.render_enhanced_header()
         self.render_agent_sidebar()
         self.render_connection_ui()
@@ -941,9 +856,13 @@ class AgenticAIDemo:
                     if step.sql_query:
                         st.code(step.sql_query, language="sql")
                     st.markdown(f"**Confidence:** {step.confidence:.1%}")
+                    if step.timings:
+                        st.caption(" • ".join(f"{phase}: {ms:.0f}ms" for phase, ms in step.timings.items()))
 
 def main():
     """Main function for agentic AI demo"""
+    # Warm the shared Claude connection pool (no-op after the first run in this process)
+    preconnect_llm_backend()
     demo = AgenticAIDemo()
     demo.run_demo()
 
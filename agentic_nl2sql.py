@@ -3,68 +3,166 @@ Enhanced NL2SQL Converter for Agentic AI
 Supports multi-step reasoning, business context, and hypothesis formation
 """
 
-import os
-import anthropic
-from typing import Dict, List, Optional, Tuple
 import json
-import re
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 from datetime import datetime
 
+from llm_backend import backend_requires_api_key, shared_llm_backend
+from llm_calls import LLMClient, LLMUsageTracker
+from model_tiers import ModelTierLadder
+from prompt_budget import PromptBudget
+from response_parser import extract_tool_input, message_text
+from sql_validator import SQLValidator
+
+
+def _string_list(description: str) -> Dict[str, any]:
+    return {"type": "array", "items": {"type": "string"}, "description": description}
+
+
+def _structured_tool(name: str, description: str, properties: Dict[str, Dict], required: List[str]) -> Dict[str, any]:
+    return {
+        "name": name,
+        "description": description,
+        "input_schema": {"type": "object", "properties": properties, "required": required}
+    }
+
+
+# Structured output tools: Claude fills these schemas instead of writing free-form JSON
+ANALYSIS_PLAN_TOOL = _structured_tool(
+    "submit_analysis_plan",
+    "Submit a structured multi-step analysis plan for a business question",
+    {
+        "analysis_type": {"type": "string", "enum": ["revenue_analysis", "player_analysis", "performance_analysis", "exploratory"]},
+        "complexity": {"type": "string", "enum": ["simple", "moderate", "complex"]},
+        "steps": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "step_number": {"type": "integer"},
+                    "step_type": {"type": "string", "enum": ["discovery", "analysis", "comparison", "hypothesis", "validation", "conclusion"]},
+                    "description": {"type": "string", "description": "What this step accomplishes"},
+                    "business_value": {"type": "string", "description": "Why this step matters for business decisions"},
+                    "query_focus": {"type": "string", "description": "What data to query"},
+                    "expected_insights": _string_list("Potential insights"),
+                    "depends_on": {
+                        "type": "array",
+                        "items": {"type": "integer"},
+                        "description": "step_numbers of earlier steps whose findings this step needs; empty when it only needs the data"
+                    }
+                },
+                "required": ["step_number", "step_type", "description", "query_focus", "depends_on"]
+            }
+        },
+        "success_metrics": _string_list("How to measure if analysis is successful"),
+        "business_impact": {"type": "string", "description": "Expected business value of this analysis"}
+    },
+    ["analysis_type", "complexity", "steps"]
+)
+
+STEP_QUERY_TOOL = _structured_tool(
+    "submit_step_query",
+    "Submit the SQL query for one analysis step",
+    {
+        "sql": {"type": "string", "description": "SELECT statement with business-focused metrics"},
+        "explanation": {"type": "string", "description": "What business question this query answers"},
+        "expected_insights": _string_list("Business insights expected"),
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+        "business_kpis": _string_list("KPIs this query measures"),
+        "follow_up_questions": _string_list("Questions this analysis might lead to")
+    },
+    ["sql", "explanation", "confidence"]
+)
+
+RESULT_ANALYSIS_TOOL = _structured_tool(
+    "submit_result_analysis",
+    "Submit the business interpretation of a query result",
+    {
+        "key_insights": _string_list("3-5 most important business insights"),
+        "data_patterns": _string_list("Notable patterns or trends observed"),
+        "business_implications": _string_list("What this means for business decisions"),
+        "confidence_level": {"type": "number", "minimum": 0, "maximum": 1},
+        "recommended_actions": _string_list("Specific actions based on findings"),
+        "risks_opportunities": _string_list("Risks to watch or opportunities to pursue"),
+        "next_analysis_steps": _string_list("What to investigate next")
+    },
+    ["key_insights", "confidence_level"]
+)
+
+RECOMMENDATIONS_TOOL = _structured_tool(
+    "submit_recommendations",
+    "Submit executive-level recommendations synthesized from all analysis steps",
+    {
+        "executive_summary": {"type": "string", "description": "2-3 sentence summary of key findings"},
+        "strategic_recommendations": _string_list("3-5 high-impact strategic actions"),
+        "immediate_actions": _string_list("2-3 actions to take in next 30 days"),
+        "performance_metrics": _string_list("KPIs to track success"),
+        "risk_mitigation": _string_list("Key risks and how to address them"),
+        "investment_priorities": _string_list("Where to focus resources"),
+        "timeline": {"type": "string", "description": "Recommended implementation timeline"},
+        "expected_business_impact": {"type": "string", "description": "Quantified expected impact"},
+        "confidence_level": {"type": "number", "minimum": 0, "maximum": 1}
+    },
+    ["executive_summary", "strategic_recommendations", "confidence_level"]
+)
+
+
 class AgenticNL2SQLConverter:
     """Enhanced NL2SQL converter designed for agentic AI workflows"""
     
-    def __init__(self, api_key: Optional[str] = None, schema_context: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, schema_context: Optional[str] = None,
+                 model_tiers: Optional[List[str]] = None, usage_tracker: Optional[LLMUsageTracker] = None,
+                 backend=None, prompt_budgets: Optional[Dict[str, int]] = None,
+                 schema_info: Optional[Dict[str, Dict]] = None):
         self.api_key = api_key or os.getenv('ANTHROPIC_API_KEY')
-        if not self.api_key:
+        if not self.api_key and backend is None and backend_requires_api_key():
             raise ValueError("ANTHROPIC_API_KEY must be provided")
         
-        self.client = anthropic.Anthropic(api_key=self.api_key)
+        # Process-wide client shared with every other converter (live, record or replay)
+        self.client = backend or shared_llm_backend(self.api_key)
+        self.llm = LLMClient(self.client, usage_tracker)
         self.schema_context = schema_context
         
+        # Step queries are checked offline (read-only, and against the schema when known)
+        self.validator = SQLValidator(schema_info)
+        
+        # Step queries and result analysis start on the small model; planning and
+        # synthesis need the strongest reasoning and always use the top tier;
+        # a step query that fails validation is retried on the next tier
+        self.tier_ladder = ModelTierLadder(model_tiers)
+        
+        # Every prompt is measured against its call site's budget before sending
+        self.prompt_budget = PromptBudget(prompt_budgets)
+        
     def generate_analysis_plan(self, business_question: str) -> Dict[str, any]:
         """Generate a multi-step analysis plan for complex business questions"""
         
-        prompt = f"""
+        def render(examples, schema):
+            return f"""
 You are a business intelligence expert. Break down this complex business question into a structured analysis plan.
 
 BUSINESS QUESTION: {business_question}
 
 DATABASE CONTEXT:
-{self.schema_context or "Gaming analytics database with players, games, transactions, events data"}
-
-Create a JSON response with this structure:
-{{
-    "analysis_type": "revenue_analysis|player_analysis|performance_analysis|exploratory",
-    "complexity": "simple|moderate|complex",
-    "steps": [
-        {{
-            "step_number": 1,
-            "step_type": "discovery|analysis|comparison|hypothesis|validation|conclusion",
-            "description": "What this step accomplishes",
-            "business_value": "Why this step matters for business decisions",
-            "query_focus": "What data to query",
-            "expected_insights": ["List of potential insights"]
-        }}
-    ],
-    "success_metrics": ["How to measure if analysis is successful"],
-    "business_impact": "Expected business value of this analysis"
-}}
+{schema}
 
+Submit the plan with the submit_analysis_plan tool. Give each step the earlier steps it builds
+on in depends_on and leave it empty for steps that only need the data - independent steps run in parallel.
 Focus on actionable business insights, not just data reporting.
 """
         
         try:
-            response = self.client.messages.create(
-                model="claude-3-5-sonnet-20241022",
+            return self._structured_call(
+                ANALYSIS_PLAN_TOOL, render,
+                schema=self.schema_context or "Gaming analytics database with players, games, transactions, events data",
+                question=business_question,
+                system="You are a business intelligence expert who creates structured analysis plans.",
                 max_tokens=1500,
-                temperature=0.2,
-                system="You are a business intelligence expert who creates structured analysis plans. Always respond with valid JSON only.",
-                messages=[{"role": "user", "content": prompt}]
+                temperature=0.2
             )
             
-            content = response.content[0].text.strip()
-            return self._parse_json_response(content)
-            
         except Exception as e:
             return {
                 "success": False,
@@ -80,7 +178,8 @@ Focus on actionable business insights, not just data reporting.
         if previous_results:
             context_summary = f"Previous analysis found: {self._summarize_previous_results(previous_results)}"
         
-        prompt = f"""
+        def render(examples, schema):
+            return f"""
 You are generating SQL for a business intelligence analysis step.
 
 STEP DESCRIPTION: {step_description}
@@ -89,7 +188,7 @@ BUSINESS CONTEXT: {business_context}
 {context_summary}
 
 DATABASE SCHEMA:
-{self.schema_context or "Standard gaming analytics schema"}
+{schema}
 
 Generate a SQL query that:
 1. Directly addresses this analysis step
@@ -97,31 +196,22 @@ Generate a SQL query that:
 3. Uses appropriate aggregations and groupings
 4. Considers business KPIs and metrics
 
-Respond with JSON:
-{{
-    "sql": "SELECT statement with business-focused metrics",
-    "explanation": "What business question this query answers",
-    "expected_insights": ["List of business insights expected"],
-    "confidence": 0.85,
-    "business_kpis": ["List of KPIs this query measures"],
-    "follow_up_questions": ["Questions this analysis might lead to"]
-}}
-
+Submit it with the submit_step_query tool.
 Focus on business value, not just technical data retrieval.
 """
         
         try:
-            response = self.client.messages.create(
-                model="claude-3-5-sonnet-20241022",
+            return self._structured_call(
+                STEP_QUERY_TOOL, render,
+                schema=self.schema_context or "Standard gaming analytics schema",
+                question=f"{step_description} {business_context}",
+                system="You are a business-focused SQL expert. Generate queries that provide actionable insights.",
                 max_tokens=800,
                 temperature=0.1,
-                system="You are a business-focused SQL expert. Generate queries that provide actionable insights. Always respond with valid JSON only.",
-                messages=[{"role": "user", "content": prompt}]
+                confidence_key="confidence",
+                validate=lambda result: self.validator.validate(result.get("sql") or "")
             )
             
-            content = response.content[0].text.strip()
-            return self._parse_json_response(content)
-            
         except Exception as e:
             return {
                 "success": False,
@@ -137,7 +227,8 @@ Focus on business value, not just technical data retrieval.
         # Summarize the data for analysis
         data_summary = self._create_data_summary(query_results)
         
-        prompt = f"""
+        def render(examples, schema):
+            return f"""
 You are a business analyst interpreting data results.
 
 ORIGINAL BUSINESS QUESTION: {business_question}
@@ -146,32 +237,19 @@ ANALYSIS STEP: {step_context}
 DATA RESULTS SUMMARY:
 {data_summary}
 
-Analyze these results and provide:
-{{
-    "key_insights": ["3-5 most important business insights"],
-    "data_patterns": ["Notable patterns or trends observed"],
-    "business_implications": ["What this means for business decisions"],
-    "confidence_level": 0.85,
-    "recommended_actions": ["Specific actions based on findings"],
-    "risks_opportunities": ["Risks to watch or opportunities to pursue"],
-    "next_analysis_steps": ["What to investigate next"]
-}}
-
+Analyze these results and submit your findings with the submit_result_analysis tool.
 Focus on actionable business intelligence, not just data description.
 """
         
         try:
-            response = self.client.messages.create(
-                model="claude-3-5-sonnet-20241022",
+            return self._structured_call(
+                RESULT_ANALYSIS_TOOL, render,
+                system="You are a business analyst who turns data into actionable insights.",
                 max_tokens=1000,
                 temperature=0.2,
-                system="You are a business analyst who turns data into actionable insights. Always respond with valid JSON only.",
-                messages=[{"role": "user", "content": prompt}]
+                confidence_key="confidence_level"
             )
             
-            content = response.content[0].text.strip()
-            return self._parse_json_response(content)
-            
         except Exception as e:
             return {
                 "success": False,
@@ -197,7 +275,8 @@ Focus on actionable business intelligence, not just data description.
         insights_summary = "\n".join([f"• {insight}" for insight in all_insights[:15]])
         actions_summary = "\n".join([f"• {action}" for action in all_actions[:10]])
         
-        prompt = f"""
+        def render(examples, schema):
+            return f"""
 You are a senior business strategist synthesizing analysis findings.
 
 ORIGINAL QUESTION: {original_question}
@@ -208,34 +287,18 @@ KEY INSIGHTS FROM ANALYSIS:
 RECOMMENDED ACTIONS IDENTIFIED:
 {actions_summary}
 
-Create a comprehensive business recommendation:
-{{
-    "executive_summary": "2-3 sentence summary of key findings",
-    "strategic_recommendations": ["3-5 high-impact strategic actions"],
-    "immediate_actions": ["2-3 actions to take in next 30 days"], 
-    "performance_metrics": ["KPIs to track success"],
-    "risk_mitigation": ["Key risks and how to address them"],
-    "investment_priorities": ["Where to focus resources"],
-    "timeline": "Recommended implementation timeline",
-    "expected_business_impact": "Quantified expected impact",
-    "confidence_level": 0.88
-}}
-
+Create a comprehensive business recommendation and submit it with the submit_recommendations tool.
 Focus on strategic value and measurable business outcomes.
 """
         
         try:
-            response = self.client.messages.create(
-                model="claude-3-5-sonnet-20241022",
+            return self._structured_call(
+                RECOMMENDATIONS_TOOL, render,
+                system="You are a senior business strategist providing executive-level recommendations.",
                 max_tokens=1200,
-                temperature=0.15,
-                system="You are a senior business strategist providing executive-level recommendations. Always respond with valid JSON only.",
-                messages=[{"role": "user", "content": prompt}]
+                temperature=0.15
             )
             
-            content = response.content[0].text.strip()
-            return self._parse_json_response(content)
-            
         except Exception as e:
             return {
                 "success": False,
@@ -243,32 +306,63 @@ Focus on strategic value and measurable business outcomes.
                 "executive_summary": "Unable to generate final recommendations due to processing error"
             }
     
-    def _parse_json_response(self, content: str) -> Dict[str, any]:
-        """Parse JSON response with error handling"""
-        try:
-            # Clean up markdown code blocks
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].strip()
-            
-            return json.loads(content)
+    def _structured_call(self, tool: Dict[str, any], render: Callable[[str, str], str], system: str,
+                         max_tokens: int, temperature: float, confidence_key: Optional[str] = None,
+                         schema: str = "", question: str = "",
+                         validate: Optional[Callable[[Dict[str, any]], Dict[str, any]]] = None) -> Dict[str, any]:
+        """Call Claude with a forced tool so the result arrives already structured
+        
+        The prompt is rendered by `render(examples, schema)` and trimmed to the call
+        site's token budget first (PromptBudgetExceeded if it cannot fit).
+        With a `confidence_key`, the call climbs the model tier ladder until the
+        reported confidence is high enough and `validate(result)` (if given)
+        reports the answer valid - API errors on a lower tier also move up;
+        otherwise only the top tier is used.
+        """
+        call_site = f"agent.{tool['name'].replace('submit_', '')}"
+        prompt, budget_report = self.prompt_budget.fit(
+            call_site, render, schema=schema, question=question, overhead=system + json.dumps(tool)
+        )
+        
+        models = self.tier_ladder.models if confidence_key else [self.tier_ladder.top_model]
+        for model in models:
+            start_time = time.perf_counter()
+            try:
+                response = self.llm.create(
+                    call_site,
+                    model=model,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    system=system,
+                    tools=[tool],
+                    tool_choice={"type": "tool", "name": tool["name"]},
+                    messages=[{"role": "user", "content": prompt}]
+                )
+            except Exception:
+                # Overloaded / unavailable lower tier: move up instead of failing the call
+                if model == models[-1]:
+                    raise
+                self.tier_ladder.record(model, (time.perf_counter() - start_time) * 1000, "generation_failed")
+                continue
             
-        except json.JSONDecodeError:
-            # Try to extract JSON manually
-            start = content.find("{")
-            end = content.rfind("}") + 1
-            if start != -1 and end > start:
-                try:
-                    return json.loads(content[start:end])
-                except:
-                    pass
+            result = extract_tool_input(response, tool["name"])
+            if result is None:
+                result = {
+                    "success": False,
+                    "error": f"Claude returned no {tool['name']} output",
+                    "raw_content": message_text(response)[:500]
+                }
+            elif validate:
+                result["validation"] = validate(result)
             
-            return {
-                "success": False,
-                "error": "Failed to parse JSON response",
-                "raw_content": content[:500]
-            }
+            reason = self.tier_ladder.escalation_reason(result, confidence_key or "confidence")
+            self.tier_ladder.record(model, (time.perf_counter() - start_time) * 1000, reason)
+            if not reason:
+                break
+        
+        result["model"] = model
+        result["prompt_budget"] = budget_report
+        return result
     
     def _create_fallback_plan(self, question: str) -> List[Dict]:
         """Create a simple fallback analysis plan"""
@@ -277,19 +371,22 @@ Focus on strategic value and measurable business outcomes.
                 "step_number": 1,
                 "step_type": "discovery",
                 "description": "Explore available data and key metrics",
-                "query_focus": "Basic data overview"
+                "query_focus": "Basic data overview",
+                "depends_on": []
             },
             {
                 "step_number": 2,
                 "step_type": "analysis", 
                 "description": "Analyze main business dimensions",
-                "query_focus": "Segmented analysis"
+                "query_focus": "Segmented analysis",
+                "depends_on": []
             },
             {
                 "step_number": 3,
                 "step_type": "conclusion",
                 "description": "Summarize findings and insights",
-                "query_focus": "Key takeaways"
+                "query_focus": "Key takeaways",
+                "depends_on": [1, 2]
             }
         ]
     
@@ -7,13 +7,23 @@ import json
 import time
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from PIL import Image
 
 # Add current directory to path
 sys.path.append('/Users/kushagrnagpal/mcp-nl2sql')
 from nl2sql_claude import NL2SQLConverter
-from test_mcp_real import execute_query_via_mcp
+from sql_templates import SQLTemplateEngine
+from sql_validator import SQLValidator
+from sql_repair import SQLRepairLoop
+from model_tiers import ModelTierLadder
+from llm_calls import LLMUsageTracker
+from llm_backend import preconnect_llm_backend
+from example_store import ExampleStore
+from schema_catalog import SchemaCatalog
+from column_profiler import profile_schema, stale_tables
+from test_mcp_real import execute_query_via_mcp, firebolt_mcp_session
 
 # Page config
 st.set_page_config(
@@ -304,12 +314,42 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Bump when format_schema_for_claude output changes, so cached prompt context is rebuilt
+SCHEMA_CONTEXT_VERSION = "3"
+
+# Early auto-execution and background schema refreshes, shared by all sessions
+QUERY_EXECUTOR_WORKERS = 4
+
+
+@st.cache_resource
+def shared_query_executor() -> ThreadPoolExecutor:
+    """One bounded pool for the whole server; cached so reruns and sessions reuse it"""
+    return ThreadPoolExecutor(max_workers=QUERY_EXECUTOR_WORKERS, thread_name_prefix="nl2sql-query")
+
+
+def discard_execution(execution):
+    """Drop an early execution whose SQL was superseded: cancel it if it has not started,
+    otherwise let it finish unobserved (its result and any error are swallowed)"""
+    future = execution.pop('future', None)
+    if future is not None and not future.cancel():
+        future.add_done_callback(lambda done: done.exception())
+    execution.clear()
+
 class FireboltNL2SQLApp:
     """Clean, modern Firebolt Intelligent Query Assistant"""
     
     def __init__(self):
         self.init_session_state()
-        self.nl2sql_converter = None
+        self.schema_catalog = SchemaCatalog()
+    
+    @property
+    def nl2sql_converter(self):
+        """Converter for the connected schema, kept across reruns of this session"""
+        return st.session_state.get('nl2sql_converter')
+    
+    @nl2sql_converter.setter
+    def nl2sql_converter(self, converter):
+        st.session_state.nl2sql_converter = converter
     
     def init_session_state(self):
         """Initialize session state variables"""
@@ -319,6 +359,14 @@ class FireboltNL2SQLApp:
             st.session_state.credentials = {}
         if 'schema_info' not in st.session_state:
             st.session_state.schema_info = {}
+        if 'schema_fingerprint' not in st.session_state:
+            st.session_state.schema_fingerprint = None
+        if 'schema_context' not in st.session_state:
+            st.session_state.schema_context = None
+        if 'schema_refresh' not in st.session_state:
+            st.session_state.schema_refresh = None
+        if 'column_stats' not in st.session_state:
+            st.session_state.column_stats = {}
         if 'last_query_result' not in st.session_state:
             st.session_state.last_query_result = None
         if 'last_executed_sql' not in st.session_state:
@@ -335,6 +383,14 @@ class FireboltNL2SQLApp:
             st.session_state.selected_chart_type = None
         if 'connection_error' not in st.session_state:
             st.session_state.connection_error = None
+        if 'auto_execute_sql' not in st.session_state:
+            st.session_state.auto_execute_sql = False
+        if 'auto_repair_sql' not in st.session_state:
+            st.session_state.auto_repair_sql = False
+        if 'parallel_candidates' not in st.session_state:
+            st.session_state.parallel_candidates = False
+        if 'llm_usage' not in st.session_state:
+            st.session_state.llm_usage = LLMUsageTracker()
     
     def render_header(self):
         """Render clean header with proper alignment"""
@@ -381,6 +437,7 @@ class FireboltNL2SQLApp:
                 st.metric("Queries Executed", len(st.session_state.query_history))
                 if st.session_state.schema_info:
                     st.metric("Tables", len(st.session_state.schema_info))
+                self.render_llm_usage()
                 
                 st.markdown("## 🎮 Gaming Analytics")
                 st.markdown("""
@@ -401,6 +458,36 @@ class FireboltNL2SQLApp:
                 - Multi-table joins
                 """)
     
+    def render_llm_usage(self):
+        """Token, cost and latency totals for every Claude call this session"""
+        usage = st.session_state.llm_usage.summary()
+        totals = usage['totals']
+        if not totals['calls']:
+            return
+        
+        st.markdown("## 🪙 Claude Usage")
+        col1, col2 = st.columns(2)
+        col1.metric("Calls", totals['calls'])
+        col2.metric("Cost", f"${totals['cost_usd']:.4f}")
+        st.caption(f"📥 {totals['input_tokens']:,} in • 📤 {totals['output_tokens']:,} out • "
+                   f"💾 {totals['cache_read_input_tokens']:,} cached • ⏱️ avg {totals['avg_latency_ms']:.0f}ms")
+        with st.expander("By call site"):
+            st.dataframe(pd.DataFrame([
+                {"call site": name, "calls": stats['calls'], "input": stats['input_tokens'],
+                 "output": stats['output_tokens'], "avg ms": round(stats['avg_latency_ms']),
+                 "cost $": round(stats['cost_usd'], 4)}
+                for name, stats in usage['by_call_site'].items()
+            ]), hide_index=True)
+        
+        # Process-wide request queue shared with every other session
+        scheduler = getattr(self.nl2sql_converter.client, 'scheduler', None) if self.nl2sql_converter else None
+        if scheduler:
+            queue = scheduler.stats()
+            depth = queue['queue_depth']
+            st.caption(f"🚦 Queue: {queue['active']}/{queue['max_concurrent']} active • "
+                       f"{depth['interactive']} interactive, {depth['agent']} agent, {depth['batch']} batch waiting • "
+                       f"{queue['retries']} retries, {queue['rate_limited']} rate-limited")
+    
     def render_connection_ui(self):
         """Render connection interface"""
         if not st.session_state.is_connected:
@@ -563,8 +650,14 @@ class FireboltNL2SQLApp:
                 os.environ['FIREBOLT_MCP_DATABASE'] = database
                 os.environ['FIREBOLT_MCP_ENGINE'] = engine
                 
-                # Test connection and discover schema
-                schema_info = self.discover_schema()
+                # A cataloged schema is used right away (after a one-row connection test) and
+                # refreshed in the background; otherwise discovery doubles as the connection test
+                schema_entry = self.schema_catalog.get(account, database)
+                if schema_entry:
+                    self.test_connection()
+                    schema_source = "catalog"
+                else:
+                    schema_entry, schema_source = self.discover_schema(account, database)
                 
                 # Store connection details
                 st.session_state.credentials = {
@@ -575,14 +668,30 @@ class FireboltNL2SQLApp:
                     'client_secret': client_secret
                 }
                 st.session_state.is_connected = True
-                st.session_state.schema_info = schema_info
+                st.session_state.schema_info = schema_entry['schema_info']
+                st.session_state.schema_fingerprint = schema_entry['fingerprint']
+                st.session_state.schema_context = None
+                st.session_state.column_stats = schema_entry.get('column_stats') or {}
                 st.session_state.connection_error = None  # Clear any previous errors
                 
                 # Initialize NL2SQL converter
                 schema_context = self.format_schema_for_claude()
-                self.nl2sql_converter = NL2SQLConverter(schema_context=schema_context)
+                self.nl2sql_converter = NL2SQLConverter(
+                    schema_context=schema_context,
+                    schema_info=st.session_state.schema_info,
+                    usage_tracker=st.session_state.llm_usage,
+                    example_store=ExampleStore(database=database),
+                    column_stats=st.session_state.column_stats
+                )
                 
-                st.success("✅ Connected successfully!")
+                # Check a cataloged schema for changes and profile unprofiled columns in the background
+                st.session_state.schema_refresh = self._query_executor().submit(
+                    self.refresh_catalog, account, database
+                )
+                if schema_source == "catalog":
+                    st.success("✅ Connected successfully! (schema loaded from catalog, checking for changes)")
+                else:
+                    st.success("✅ Connected successfully!")
                 st.rerun()
                 
             except Exception as e:
@@ -590,6 +699,10 @@ class FireboltNL2SQLApp:
                 st.session_state.is_connected = False
                 st.session_state.credentials = {}
                 st.session_state.schema_info = {}
+                st.session_state.schema_fingerprint = None
+                st.session_state.schema_context = None
+                st.session_state.schema_refresh = None
+                st.session_state.column_stats = {}
                 st.session_state.last_query_result = None
                 st.session_state.last_executed_sql = ""
                 st.session_state.last_execution_time = None
@@ -679,6 +792,10 @@ class FireboltNL2SQLApp:
         st.session_state.is_connected = False
         st.session_state.credentials = {}
         st.session_state.schema_info = {}
+        st.session_state.schema_fingerprint = None
+        st.session_state.schema_context = None
+        st.session_state.schema_refresh = None
+        st.session_state.column_stats = {}
         st.session_state.last_query_result = None
         st.session_state.last_executed_sql = ""
         st.session_state.last_execution_time = None
@@ -686,103 +803,133 @@ class FireboltNL2SQLApp:
         self.nl2sql_converter = None
         st.rerun()
     
-    def discover_schema(self):
-        """Discover database schema"""
+    def discover_schema(self, account, database):
+        """Load the schema from the catalog, refreshing changed tables or rediscovering as needed
+
+        Returns the catalog entry and its source ("cache", "incremental" or "discovery").
+        """
         try:
-            # Test basic connectivity first
-            test_query = "SELECT 1 as test_connection"
-            test_result = asyncio.run(execute_query_via_mcp(test_query))
-            if not test_result:
-                raise Exception("Failed basic connectivity test")
-            
-            # Get tables - try simplified query first
-            tables_query = "SELECT table_name, table_type FROM information_schema.tables WHERE table_schema = 'public'"
-            tables_result = asyncio.run(execute_query_via_mcp(tables_query))
-            
-            # If basic tables query works, try with more details
-            if tables_result:
-                try:
-                    detailed_tables_query = "SELECT table_name, table_type, ddl, primary_index FROM information_schema.tables WHERE table_schema = 'public'"
-                    detailed_result = asyncio.run(execute_query_via_mcp(detailed_tables_query))
-                    tables_result = detailed_result
-                except:
-                    # Fall back to basic query if detailed query fails
-                    pass
-            
-            # Get columns
-            columns_query = "SELECT table_name, column_name, data_type FROM information_schema.columns WHERE table_schema = 'public' ORDER BY table_name, ordinal_position"
-            columns_result = asyncio.run(execute_query_via_mcp(columns_query))
-            
-            # Organize schema information
-            schema_info = {}
-            
-            # Process tables
-            for table in tables_result:
-                table_name = table['table_name']
-                schema_info[table_name] = {
-                    'type': table.get('table_type', 'TABLE'),
-                    'ddl': table.get('ddl', 'Not available'),
-                    'primary_index': table.get('primary_index', 'Not available'),
-                    'columns': []
-                }
-            
-            # Process columns
-            for column in columns_result:
-                table_name = column['table_name']
-                if table_name in schema_info:
-                    schema_info[table_name]['columns'].append({
-                        'name': column['column_name'],
-                        'type': column['data_type']
-                    })
-            
-            return schema_info
-            
+            return asyncio.run(self._discover_schema_async(account, database))
         except Exception as e:
             # Re-raise the exception so connection fails properly
             raise Exception(f"Schema discovery failed: {str(e)}")
     
+    def test_connection(self):
+        """Run SELECT 1 so bad credentials or a stopped engine fail the connect, not the first query"""
+        try:
+            asyncio.run(self._test_connection_async())
+        except Exception as e:
+            raise Exception(f"Failed basic connectivity test: {str(e)}")
+    
+    async def _test_connection_async(self):
+        async with firebolt_mcp_session() as firebolt:
+            await firebolt.query("SELECT 1")
+    
+    async def _discover_schema_async(self, account, database):
+        """Fingerprint probe and (only if needed) the refresh queries in one MCP session"""
+        async with firebolt_mcp_session() as firebolt:
+            return await self.schema_catalog.load(firebolt, account, database)
+    
+    def refresh_catalog(self, account, database):
+        """Background job: refresh the cataloged schema, then profile tables with missing or expired column stats"""
+        try:
+            return asyncio.run(self._refresh_catalog_async(account, database))
+        except Exception as e:
+            raise Exception(f"Schema refresh failed: {str(e)}")
+    
+    async def _refresh_catalog_async(self, account, database):
+        async with firebolt_mcp_session() as firebolt:
+            schema_entry, schema_source = await self.schema_catalog.load(firebolt, account, database)
+            unprofiled = stale_tables(schema_entry)
+            if unprofiled:
+                column_stats = await profile_schema(firebolt, schema_entry['schema_info'], unprofiled)
+                schema_entry = self.schema_catalog.set_column_stats(
+                    account, database, schema_entry['fingerprint'], column_stats
+                ) or schema_entry
+        return schema_entry, schema_source
+    
+    def apply_schema_refresh(self):
+        """Swap in the schema and column stats from a finished background refresh"""
+        refresh = st.session_state.schema_refresh
+        if refresh is None or not refresh.done():
+            return
+        st.session_state.schema_refresh = None
+        try:
+            schema_entry, schema_source = refresh.result()
+        except Exception as e:
+            st.warning(f"⚠️ Background schema refresh failed, using the cataloged schema: {str(e)}")
+            return
+        st.session_state.column_stats = schema_entry.get('column_stats') or {}
+        if schema_source == "cache":
+            if self.nl2sql_converter:
+                self.nl2sql_converter.update_column_stats(st.session_state.column_stats)
+            return
+        
+        st.session_state.schema_info = schema_entry['schema_info']
+        st.session_state.schema_fingerprint = schema_entry['fingerprint']
+        st.session_state.schema_context = None
+        self.nl2sql_converter = None  # rebuilt for the new schema on next use
+        changes = schema_entry.get('changes')
+        if changes:
+            st.info(f"🔄 Schema updated: {len(changes['added'])} new, {len(changes['changed'])} changed, "
+                    f"{len(changes['removed'])} removed tables")
+        else:
+            st.info("🔄 Schema updated from a full rediscovery")
+    
     def format_schema_for_claude(self):
-        """Format schema information for Claude with enhanced descriptions"""
+        """Prompt context for the connected schema, memoized in the session and the schema catalog"""
         if not st.session_state.schema_info:
             return ""
+        if st.session_state.schema_context:
+            return st.session_state.schema_context
         
-        # Enhanced table descriptions and relationships
+        credentials = st.session_state.credentials
+        context = self.schema_catalog.schema_context(
+            credentials['account'], credentials['database'], SCHEMA_CONTEXT_VERSION
+        )
+        if context is None:
+            context = self._build_schema_context()
+            if st.session_state.schema_fingerprint:
+                self.schema_catalog.set_schema_context(
+                    credentials['account'], credentials['database'],
+                    st.session_state.schema_fingerprint, SCHEMA_CONTEXT_VERSION, context
+                )
+        st.session_state.schema_context = context
+        return context
+    
+    def _build_schema_context(self):
+        """Format schema information for Claude with enhanced descriptions"""
+        # Enhanced table descriptions (join keys come from the join graph)
         table_descriptions = {
             'players': {
                 'purpose': 'Master dimension table containing player profiles and demographics',
                 'business_use': 'Player registration info, geographic data, premium status, engagement levels',
-                'key_columns': ['player_id (primary key)', 'country', 'level', 'is_premium', 'total_playtime_hours'],
-                'relationships': 'Joins with ALL other tables via player_id - central hub of the schema'
+                'key_columns': ['player_id (primary key)', 'country', 'level', 'is_premium', 'total_playtime_hours']
             },
             'games': {
                 'purpose': 'Fact table storing individual gaming sessions and performance metrics',
                 'business_use': 'Game session analysis, performance tracking, completion rates, engagement measurement',
-                'key_columns': ['game_id', 'player_id', 'game_type', 'duration_seconds', 'score', 'level_reached'],
-                'relationships': 'Links to players (player_id) and player_events (game_id, player_id)'
+                'key_columns': ['game_id', 'player_id', 'game_type', 'duration_seconds', 'score', 'level_reached']
             },
             'player_events': {
                 'purpose': 'Detailed event tracking table for player actions and behaviors',
                 'business_use': 'Behavioral analysis, feature usage, engagement patterns, real-time analytics',
-                'key_columns': ['event_id', 'player_id', 'game_id', 'event_type', 'level', 'event_timestamp'],
-                'relationships': 'Links to players (player_id) and games (game_id, player_id)'
+                'key_columns': ['event_id', 'player_id', 'game_id', 'event_type', 'level', 'event_timestamp']
             },
             'player_events_big': {
                 'purpose': 'Large-scale event data with JSON payloads for detailed analytics',
                 'business_use': 'Advanced behavioral analysis, A/B testing data, detailed event tracking',
-                'key_columns': ['event_id', 'player_id', 'game_id', 'event_type', 'level', 'payload_json'],
-                'relationships': 'Alternative to player_events with richer data - links to players and games'
+                'key_columns': ['event_id', 'player_id', 'game_id', 'event_type', 'level', 'payload_json']
             },
             'transactions': {
                 'purpose': 'Monetization fact table tracking all player purchases and financial activity',
                 'business_use': 'Revenue analysis, player lifetime value, monetization optimization, item popularity',
-                'key_columns': ['transaction_id', 'player_id', 'amount_usd', 'item_category', 'payment_method'],
-                'relationships': 'Links to players (player_id) for revenue analysis and LTV calculations'
+                'key_columns': ['transaction_id', 'player_id', 'amount_usd', 'item_category', 'payment_method']
             },
             'leaderboards': {
                 'purpose': 'Competition and ranking data showing player performance over time',
                 'business_use': 'Competitive analysis, player engagement through competition, seasonal performance',
-                'key_columns': ['leaderboard_id', 'player_id', 'rank_position', 'score', 'period_type'],
-                'relationships': 'Links to players (player_id) for competitive analysis and ranking trends'
+                'key_columns': ['leaderboard_id', 'player_id', 'rank_position', 'score', 'period_type']
             }
         }
         
@@ -798,22 +945,16 @@ class FireboltNL2SQLApp:
         
         context_parts = [
             f"Database: {st.session_state.credentials['database']}",
-            "\\n=== GAMING ANALYTICS DATABASE SCHEMA ===\\n",
+            "\n=== GAMING ANALYTICS DATABASE SCHEMA ===\n",
             "🎮 BUSINESS CONTEXT: Gaming company with players, game sessions, events, transactions, and competitions",
-            "💡 SCHEMA DESIGN: Player-centric star schema - all tables join through player_id\\n",
+            "💡 SCHEMA DESIGN: Player-centric star schema - all tables join through player_id\n",
             "📊 CORE ANALYTICS USE CASES:",
             "- Player demographics and geographic analysis (players table)",
             "- Game performance and session analysis (games table)", 
             "- Behavioral tracking and engagement (player_events tables)",
             "- Revenue and monetization analysis (transactions table)",
-            "- Competitive and ranking analysis (leaderboards table)\\n",
-            "🔗 KEY RELATIONSHIPS:",
-            "- players ←→ games (player_id): Player sessions and performance",
-            "- players ←→ player_events (player_id): Player behavior and actions", 
-            "- players ←→ transactions (player_id): Player spending and monetization",
-            "- players ←→ leaderboards (player_id): Player rankings and competition",
-            "- games ←→ player_events (game_id, player_id): Events within specific game sessions\\n",
-            "📋 DETAILED TABLE SCHEMA:\\n"
+            "- Competitive and ranking analysis (leaderboards table)\n",
+            "📋 DETAILED TABLE SCHEMA:\n"
         ]
         
         # Process each table with enhanced descriptions
@@ -826,7 +967,6 @@ class FireboltNL2SQLApp:
                 desc = table_descriptions[table_name]
                 context_parts.append(f"🎯 Purpose: {desc['purpose']}")
                 context_parts.append(f"💼 Business Use: {desc['business_use']}")
-                context_parts.append(f"🔗 Relationships: {desc['relationships']}")
                 context_parts.append(f"⭐ Key Columns: {', '.join(desc['key_columns'])}")
             elif table_name in external_descriptions:
                 context_parts.append(f"🌐 External Table: {external_descriptions[table_name]}")
@@ -845,7 +985,7 @@ class FireboltNL2SQLApp:
             "- For behavioral analysis: Use 'player_events' or 'player_events_big' with player context",
             "- For revenue analysis: Use 'transactions' table joined with 'players' for demographics",
             "- For competitive analysis: Use 'leaderboards' with 'players' for ranking insights",
-            "- For real-time data: External tables (ext_*) contain streaming/batch data\\n",
+            "- For real-time data: External tables (ext_*) contain streaming/batch data\n",
             "🎯 COMMON ANALYSIS PATTERNS:",
             "- Geographic analysis: GROUP BY players.country",
             "- Time-series analysis: Use date/timestamp columns with date functions", 
@@ -854,7 +994,7 @@ class FireboltNL2SQLApp:
             "- Engagement metrics: COUNT sessions, AVG duration, event frequencies"
         ])
         
-        return '\\n'.join(context_parts)
+        return '\n'.join(context_parts)
     
     def render_schema_info(self):
         """Render schema information"""
@@ -1063,6 +1203,22 @@ class FireboltNL2SQLApp:
             help="✏️ You can edit the selected demo query or type your own custom question"
         )
         
+        st.checkbox(
+            "⚡ Run automatically as soon as SQL is ready",
+            key="auto_execute_sql",
+            help="Starts executing the generated SQL while Claude is still writing the explanation"
+        )
+        st.checkbox(
+            "🔧 Automatically repair queries that fail",
+            key="auto_repair_sql",
+            help="Sends the failed SQL, the error and the relevant tables back to Claude (up to 3 attempts)"
+        )
+        st.checkbox(
+            "🎯 Generate 3 SQL candidates in parallel (hard questions)",
+            key="parallel_candidates",
+            help="Uses more tokens: the first candidate that passes schema validation wins and the rest are cancelled"
+        )
+        
         col1, col2 = st.columns([1, 1])
         
         with col1:
@@ -1073,6 +1229,35 @@ class FireboltNL2SQLApp:
             if st.button("⚡ Run Query", type="secondary", disabled=not st.session_state.get('converted_sql', '')):
                 self.execute_query(st.session_state.get('converted_sql', ''))
         
+        # Template fast-path metrics
+        if st.session_state.get('template_stats'):
+            stats = st.session_state.template_stats
+            st.caption(f"⚡ Template fast path: {stats['hits']}/{stats['lookups']} questions answered locally "
+                       f"({stats['hit_rate']:.0%} hit rate, avg {stats['avg_match_us']:.0f}μs)")
+        
+        # Model tier ladder: how often the fast tier answers without escalation
+        if st.session_state.get('model_tier_stats'):
+            tiers = ModelTierLadder(stats=st.session_state.model_tier_stats).get_stats()
+            st.caption("🪜 Model tiers: " + " → ".join(
+                f"{tier['model']} {tier['accepted']}/{tier['calls']} ({tier['hit_rate']:.0%}, avg {tier['avg_latency_ms']:.0f}ms)"
+                for tier in tiers))
+        
+        # Prompt trimming applied to stay within the call site's token budget
+        budget_report = st.session_state.get('prompt_budget_report')
+        if budget_report and budget_report['trimmed']:
+            st.caption(f"✂️ Prompt trimmed from ~{budget_report['tokens_before']} to ~{budget_report['tokens']} tokens "
+                       f"(budget {budget_report['budget']}): {'; '.join(budget_report['trimmed'])}")
+        
+        # Self-repair attempts for the last executed query
+        attempts = st.session_state.get('last_repair_attempts')
+        if attempts and len(attempts) > 1:
+            with st.expander(f"🔧 Auto-repair: {len(attempts)} attempts"):
+                for attempt in attempts:
+                    outcome = attempt.get('category', 'success')
+                    st.markdown(f"**Attempt {attempt['attempt']}** ({outcome}) - generation {attempt['generation_ms']:.0f}ms, "
+                                f"execution {attempt['execution_ms']:.0f}ms")
+                    st.code(attempt['sql'], language="sql")
+        
         # Show converted SQL
         if st.session_state.get('converted_sql', ''):
             st.markdown("### 📝 Generated SQL")
@@ -1083,29 +1268,159 @@ class FireboltNL2SQLApp:
                 key="sql_editor"
             )
             st.session_state.converted_sql = edited_sql
+            
+            validation = st.session_state.get('sql_validation')
+            if validation and validation['sql'] == edited_sql:
+                for error in validation['errors']:
+                    st.warning(f"⚠️ {error}")
+                for warning in validation['warnings']:
+                    st.caption(f"ℹ️ {warning}")
     
     def convert_to_sql(self, question):
-        """Convert natural language to SQL"""
+        """Convert natural language to SQL, streaming the SQL as soon as it is ready"""
+        sql_placeholder = st.empty()
+        execution = {}
+        
+        def on_sql(sql, time_to_sql_ms):
+            # Show the SQL (and optionally start running it) before the explanation arrives
+            sql_placeholder.code(sql, language="sql")
+            st.caption(f"⏱️ SQL ready in {time_to_sql_ms:.0f}ms")
+            if execution.get('sql') != sql:
+                discard_execution(execution)
+            if st.session_state.auto_execute_sql and SQLValidator(st.session_state.schema_info).validate(sql)['valid']:
+                execution['sql'] = sql
+                execution['start_time'] = datetime.now()
+                execution['future'] = self._query_executor().submit(lambda: asyncio.run(execute_query_via_mcp(sql)))
+        
+        st.session_state.converted_question = question
+        
         with st.spinner("🧠 Converting to SQL..."):
             try:
-                if not self.nl2sql_converter:
-                    schema_context = self.format_schema_for_claude()
-                    self.nl2sql_converter = NL2SQLConverter(schema_context=schema_context)
+                self._get_converter()
+                
+                # Accumulate template hit rates across reruns for this session
+                if 'template_lookup_stats' not in st.session_state:
+                    st.session_state.template_lookup_stats = SQLTemplateEngine.new_stats()
+                self.nl2sql_converter.template_engine.stats = st.session_state.template_lookup_stats
+                if 'model_tier_stats' not in st.session_state:
+                    st.session_state.model_tier_stats = ModelTierLadder.new_stats()
+                self.nl2sql_converter.tier_ladder.stats = st.session_state.model_tier_stats
                 
-                result = self.nl2sql_converter.generate_sql(question)
+                if st.session_state.parallel_candidates:
+                    result = self.nl2sql_converter.generate_sql_candidates(question, num_candidates=3)
+                    if result.get('candidates'):
+                        st.caption(f"🎯 {len(result['candidates'])} candidate(s) checked, "
+                                   f"first valid after {result['time_to_valid_ms'] or 0:.0f}ms")
+                    if result['success']:
+                        on_sql(result['sql'], result.get('time_to_valid_ms') or 0)
+                else:
+                    result = self.nl2sql_converter.generate_sql_stream(question, on_sql=on_sql)
+                st.session_state.template_stats = self.nl2sql_converter.template_engine.get_stats()
                 
                 if result['success']:
                     st.session_state.converted_sql = result['sql']
-                    st.success("✅ SQL generated successfully!")
-                    st.rerun()
+                    st.session_state.generated_sql = result['sql']
+                    st.session_state.converted_model = result.get('model')
+                    if result.get('source') == 'template':
+                        st.success(f"✅ SQL generated locally from template in {result['match_time_us']:.0f}μs")
+                    else:
+                        st.success("✅ SQL generated successfully!")
+                    st.session_state.sql_validation = result.get('validation')
+                    st.session_state.prompt_budget_report = result.get('prompt_budget')
                 else:
                     st.error(f"❌ Conversion failed: {result['error']}")
                     
             except Exception as e:
+                discard_execution(execution)
                 st.error(f"❌ Error: {str(e)}")
+                return
+        
+        if not result['success'] or execution.get('sql') != result['sql']:
+            # Tier escalation replaced the SQL after the early run started
+            discard_execution(execution)
+        if not result['success']:
+            return
+        
+        if execution:
+            with st.spinner("⚡ Executing query..."):
+                try:
+                    query_result = execution['future'].result()
+                    execution_time = (datetime.now() - execution['start_time']).total_seconds() * 1000
+                    self._store_query_result(result['sql'], query_result, execution_time)
+                    self.nl2sql_converter.remember_example(question, result['sql'])
+                    st.success(f"✅ Query executed! {len(query_result) if query_result else 0} rows returned")
+                except Exception as e:
+                    if st.session_state.auto_repair_sql:
+                        self.execute_with_repair(question, result['sql'], known_error=str(e))
+                        return
+                    st.error(f"❌ Query failed: {str(e)}")
+                    return
+        
+        st.rerun()
+    
+    def _get_converter(self):
+        """Create the NL2SQL converter for the connected schema on first use"""
+        if not self.nl2sql_converter:
+            schema_context = self.format_schema_for_claude()
+            self.nl2sql_converter = NL2SQLConverter(
+                schema_context=schema_context,
+                schema_info=st.session_state.schema_info,
+                usage_tracker=st.session_state.llm_usage,
+                example_store=ExampleStore(database=st.session_state.credentials.get('database')),
+                column_stats=st.session_state.column_stats
+            )
+        return self.nl2sql_converter
+    
+    def _query_executor(self):
+        """Thread pool used to start query execution while generation is still streaming"""
+        return shared_query_executor()
+    
+    def validate_before_execution(self, sql):
+        """Check SQL offline against the discovered schema; show problems and block invalid queries"""
+        validation = SQLValidator(st.session_state.schema_info, st.session_state.column_stats).validate(sql)
+        st.session_state.sql_validation = validation
+        if not validation['valid']:
+            st.error("🛑 Query not sent to Firebolt - validation failed:")
+            for error in validation['errors']:
+                st.markdown(f"- {error}")
+        return validation['valid']
+    
+    def execute_with_repair(self, question, sql, known_error=None):
+        """Execute SQL, letting Claude repair it from the classified error when it fails"""
+        with st.spinner("⚡ Executing query (auto-repair on)..."):
+            repair_loop = SQLRepairLoop(
+                self._get_converter(),
+                execute=lambda query: asyncio.run(execute_query_via_mcp(query))
+            )
+            outcome = repair_loop.run(question, sql=sql, known_error=known_error,
+                                      model=st.session_state.get('converted_model'))
+        
+        attempts = outcome['attempts']
+        st.session_state.last_repair_attempts = attempts
+        if not outcome['success']:
+            st.error(f"❌ Query failed after {len(attempts)} attempt(s): {outcome['error']}")
+            return
+        
+        st.session_state.converted_sql = outcome['sql']
+        st.session_state.generated_sql = outcome['sql']
+        self._store_query_result(outcome['sql'], outcome['rows'], attempts[-1]['execution_ms'])
+        if outcome['repaired']:
+            st.success(f"🔧 Query repaired after {len(attempts) - 1} failed attempt(s) in {outcome['total_time_ms']:.0f}ms")
+        st.success(f"✅ Query executed! {len(outcome['rows']) if outcome['rows'] else 0} rows returned")
+        st.rerun()
     
     def execute_query(self, sql):
         """Execute SQL query"""
+        question = st.session_state.get('converted_question')
+        # SQL the user edited by hand is run as written, never rewritten by Claude
+        user_edited = sql != st.session_state.get('generated_sql')
+        if st.session_state.auto_repair_sql and question and not user_edited:
+            self.execute_with_repair(question, sql)
+            return
+        
+        if not self.validate_before_execution(sql):
+            return
+        
         with st.spinner("⚡ Executing query..."):
             try:
                 start_time = datetime.now()
@@ -1114,13 +1429,10 @@ class FireboltNL2SQLApp:
                 
                 execution_time = (end_time - start_time).total_seconds() * 1000
                 
-                # Store results
-                st.session_state.last_query_result = result
-                st.session_state.last_executed_sql = sql
-                st.session_state.last_execution_time = execution_time
-                st.session_state.engine_time_data = None  # Reset engine time
-                st.session_state.show_visualizations = False  # Reset visualizations
-                st.session_state.selected_chart_type = None  # Reset chart selection
+                self._store_query_result(sql, result, execution_time)
+                # Hand-edited SQL may no longer answer the question: never keep it as an example
+                if question and not user_edited:
+                    self._get_converter().remember_example(question, sql)
                 
                 st.success(f"✅ Query executed! {len(result) if result else 0} rows returned")
                 st.rerun()
@@ -1128,6 +1440,15 @@ class FireboltNL2SQLApp:
             except Exception as e:
                 st.error(f"❌ Query failed: {str(e)}")
     
+    def _store_query_result(self, sql, result, execution_time):
+        """Store query results and reset per-result UI state"""
+        st.session_state.last_query_result = result
+        st.session_state.last_executed_sql = sql
+        st.session_state.last_execution_time = execution_time
+        st.session_state.engine_time_data = None  # Reset engine time
+        st.session_state.show_visualizations = False  # Reset visualizations
+        st.session_state.selected_chart_type = None  # Reset chart selection
+    
     def render_results(self):
         """Render query results"""
         if st.session_state.last_query_result is None:
@@ -1406,6 +1727,7 @@ class FireboltNL2SQLApp:
         self.render_connection_ui()
         
         if st.session_state.is_connected:
+            self.apply_schema_refresh()
             self.render_schema_info()
             self.render_query_interface()
             
@@ -1414,6 +1736,8 @@ class FireboltNL2SQLApp:
 
 def main():
     """Main function"""
+    # Warm the shared Claude connection pool (no-op after the first run in this process)
+    preconnect_llm_backend()
     app = FireboltNL2SQLApp()
     app.run()
 
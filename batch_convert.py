@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Bulk NL2SQL conversion for saved questions
+Reads questions from JSONL, converts them through Anthropic's Message Batches
+API (or a local concurrency-limited runner when batches are unavailable) and
+writes question -> SQL -> validation results to JSONL. Finished questions are
+appended as they complete, so an interrupted run resumes where it stopped.
+
+Usage:
+    python batch_convert.py questions.jsonl results.jsonl
+    python batch_convert.py saved.jsonl out.jsonl --question-field body --id-field request_id --mode local
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from nl2sql_claude import NL2SQLConverter
+from llm_calls import BATCH_COST_MULTIPLIER, USAGE_FIELDS, usage_from_message
+from llm_scheduler import BATCH, request_priority
+from prompt_budget import PromptBudgetExceeded
+
+DEFAULT_CONCURRENCY = 4
+BATCH_POLL_INTERVAL_S = 30
+
+# Message Batches custom_id must match ^[a-zA-Z0-9_-]{1,64}$
+CUSTOM_ID_PREFIX = "q-"
+
+
+def load_questions(path: str, question_field: str = "question", id_field: str = "id") -> List[Dict[str, str]]:
+    """Questions with stable ids (line number when the record has no id)"""
+    questions = []
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            question = record.get(question_field)
+            if not question:
+                print(f"⚠️  Line {line_number}: no '{question_field}' field, skipped")
+                continue
+            questions.append({"id": str(record.get(id_field) or line_number), "question": question})
+    return questions
+
+
+def load_completed(path: str) -> set:
+    """Ids already written to the output file
+
+    A run killed mid-write leaves a partial last line; it is cut off so that
+    question is converted again and the next append starts on a fresh line.
+    Undecodable lines elsewhere are skipped.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'rb') as f:
+        lines = f.readlines()
+
+    completed = set()
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            completed.add(json.loads(line)["id"])
+        except (ValueError, KeyError, TypeError):
+            if number < len(lines):
+                print(f"⚠️  {path} line {number}: undecodable, skipped")
+                continue
+            print(f"⚠️  {path} line {number}: partial record from an interrupted run, removed")
+            with open(path, 'rb+') as f:
+                f.truncate(sum(len(l) for l in lines[:-1]))
+            return completed
+
+    if lines and not lines[-1].endswith(b"\n"):
+        with open(path, 'ab') as f:
+            f.write(b"\n")
+    return completed
+
+
+def load_results(path: str) -> List[Dict[str, any]]:
+    """Decodable result records from the output file"""
+    results = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                continue
+    return results
+
+
+def schema_context_from_info(schema_info: Dict[str, Dict]) -> str:
+    """Plain-text schema for the prompt from a discovered-schema JSON file"""
+    lines = ["DATABASE SCHEMA:"]
+    for table_name, info in schema_info.items():
+        columns = ", ".join(f"{col['name']} {col.get('type', '')}".strip() for col in info.get('columns', []))
+        lines.append(f"- {table_name}({columns})")
+    return "\n".join(lines)
+
+
+class BatchConverter:
+    """Convert many questions with one converter, checkpointing every finished result"""
+
+    def __init__(self, converter: NL2SQLConverter, output_path: str, concurrency: int = DEFAULT_CONCURRENCY):
+        self.converter = converter
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+
+    @property
+    def batch_checkpoint_path(self) -> str:
+        return self.output_path + ".batch.json"
+
+    def supports_batches(self) -> bool:
+        """Replay/record backends and old SDKs have no Message Batches API"""
+        return hasattr(self.converter.client.messages, "batches")
+
+    def run(self, questions: List[Dict[str, str]], mode: str = "auto") -> Dict[str, any]:
+        """Convert every question not already in the output file"""
+        completed = load_completed(self.output_path)
+        pending = [q for q in questions if q["id"] not in completed]
+        if mode == "auto":
+            mode = "batch" if self.supports_batches() else "local"
+
+        print(f"📋 {len(questions)} questions, {len(completed)} already done, {len(pending)} to convert ({mode})")
+        start_time = time.perf_counter()
+        if pending:
+            if mode == "batch":
+                self.run_batch(pending)
+            else:
+                self.run_local(pending)
+
+        return {"mode": mode, "converted": len(pending), "skipped": len(completed),
+                "total_time_s": time.perf_counter() - start_time}
+
+    # Local runner
+
+    def run_local(self, questions: List[Dict[str, str]]):
+        """generate_sql with at most `concurrency` requests in flight (templates and tiers apply)
+
+        Requests run at batch priority, so interactive users sharing the process go first.
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(self._convert_local, q["question"]): q for q in questions}
+            for done, future in enumerate(as_completed(futures), 1):
+                question = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = self.converter._api_error_result(e)
+                self._write(question, result, "local")
+                print(f"   [{done}/{len(questions)}] {question['id']}: {'✅' if result['success'] else '❌'}")
+
+    def _convert_local(self, question: str) -> Dict[str, any]:
+        with request_priority(BATCH):
+            return self.converter.generate_sql(question)
+
+    # Message Batches runner
+
+    def run_batch(self, questions: List[Dict[str, str]]):
+        """Submit one batch (or resume the checkpointed one), poll until it ends, write results
+
+        Questions added to the input after the checkpointed batch was submitted
+        are converted locally once it has been written out.
+        """
+        messages = self.converter.client.messages
+        checkpoint = self._load_batch_checkpoint()
+        uncovered = []
+        if checkpoint is None:
+            # Template matches never need a model call; over-budget prompts are never sent
+            model = self.converter.tier_ladder.top_model
+            ids, requests = {}, []
+            for q in questions:
+                template_result = self.converter._match_template(q["question"])
+                if template_result:
+                    self._write(q, template_result, "template")
+                    continue
+                try:
+                    prompt, _ = self.converter._build_prompt(q["question"], "nl2sql.batch")
+                except PromptBudgetExceeded as e:
+                    self._write(q, self.converter._prompt_budget_error_result(e), "batch")
+                    continue
+                custom_id = f"{CUSTOM_ID_PREFIX}{len(ids)}"
+                ids[custom_id] = q
+                requests.append({"custom_id": custom_id, "params": self.converter._build_request(prompt, model)})
+            if not requests:
+                return
+
+            batch = messages.batches.create(requests=requests)
+            checkpoint = {"batch_id": batch.id, "model": model, "questions": ids}
+            with open(self.batch_checkpoint_path, 'w', encoding='utf-8') as f:
+                json.dump(checkpoint, f)
+            print(f"📤 Submitted batch {batch.id} ({len(ids)} requests, {model})")
+        else:
+            print(f"🔁 Resuming batch {checkpoint['batch_id']}")
+            covered = {q["id"] for q in checkpoint["questions"].values()}
+            uncovered = [q for q in questions if q["id"] not in covered]
+
+        batch_id = checkpoint["batch_id"]
+        while True:
+            batch = messages.batches.retrieve(batch_id)
+            if batch.processing_status == "ended":
+                break
+            counts = batch.request_counts
+            print(f"   ⏳ {batch.processing_status}: {counts.processing} processing, {counts.succeeded} succeeded")
+            time.sleep(BATCH_POLL_INTERVAL_S)
+
+        completed = load_completed(self.output_path)
+        for entry in messages.batches.results(batch_id):
+            question = checkpoint["questions"].get(entry.custom_id)
+            if question is None or question["id"] in completed:
+                continue
+            if entry.result.type == "succeeded":
+                result = self.converter._response_to_result(entry.result.message, question["question"])
+                result["model"] = checkpoint["model"]
+                self._record_usage(checkpoint["model"], usage_from_message(entry.result.message))
+            else:
+                result = self.converter._api_error_result(Exception(f"batch request {entry.result.type}"))
+                self._record_usage(checkpoint["model"], dict.fromkeys(USAGE_FIELDS, 0),
+                                   error=f"batch request {entry.result.type}")
+            self._write(question, result, "batch")
+
+        os.remove(self.batch_checkpoint_path)
+        if uncovered:
+            ids = ", ".join(q["id"] for q in uncovered[:10]) + (", ..." if len(uncovered) > 10 else "")
+            print(f"➕ {len(uncovered)} questions are not in batch {batch_id} ({ids}), converting locally")
+            self.run_local(uncovered)
+
+    def _record_usage(self, model: str, usage: Dict[str, int], error: Optional[str] = None):
+        """Batch results bypass LLMClient, so account for them on the converter's tracker directly"""
+        self.converter.llm.tracker.record("nl2sql.batch", model, usage, 0.0, success=error is None,
+                                          error=error, cost_multiplier=BATCH_COST_MULTIPLIER)
+
+    def _load_batch_checkpoint(self) -> Optional[Dict[str, any]]:
+        if not os.path.exists(self.batch_checkpoint_path):
+            return None
+        with open(self.batch_checkpoint_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write(self, question: Dict[str, str], result: Dict[str, any], mode: str):
+        validation = result.get("validation") or {}
+        record = {
+            "id": question["id"],
+            "question": question["question"],
+            "success": result["success"],
+            "sql": result.get("sql"),
+            "error": result.get("error"),
+            "confidence": result.get("confidence"),
+            "model": result.get("model"),
+            "source": result.get("source"),
+            "valid": validation.get("valid"),
+            "validation_errors": validation.get("errors", []),
+            "validation_warnings": validation.get("warnings", []),
+            "mode": mode,
+        }
+        with self._lock, open(self.output_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Convert saved questions to SQL in bulk")
+    parser.add_argument("input", help="JSONL file with one question per line")
+    parser.add_argument("output", help="JSONL file for results (appended; finished ids are skipped)")
+    parser.add_argument("--question-field", default="question")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--schema-file", help="JSON schema_info ({table: {columns: [{name, type}]}})")
+    parser.add_argument("--mode", choices=["auto", "batch", "local"], default="auto",
+                        help="batch uses the Message Batches API; local runs concurrent requests")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    args = parser.parse_args()
+
+    schema_info = None
+    schema_context = None
+    if args.schema_file:
+        with open(args.schema_file, encoding='utf-8') as f:
+            schema_info = json.load(f)
+        schema_context = schema_context_from_info(schema_info)
+
+    converter = NL2SQLConverter(schema_context=schema_context, schema_info=schema_info)
+    questions = load_questions(args.input, args.question_field, args.id_field)
+    summary = BatchConverter(converter, args.output, args.concurrency).run(questions, args.mode)
+
+    results = load_results(args.output)
+    print("=" * 60)
+    print(f"✅ Converted {summary['converted']} questions in {summary['total_time_s']:.1f}s ({summary['mode']})")
+    print(f"   Successful: {sum(1 for r in results if r['success'])}/{len(results)}")
+    print(f"   Passed validation: {sum(1 for r in results if r['valid'])}/{len(results)}")
+    totals = converter.llm.tracker.summary()["totals"]
+    print(f"   LLM calls: {totals['calls']}, tokens in/out: {totals['input_tokens']}/{totals['output_tokens']}, "
+          f"est. cost: ${totals['cost_usd']:.4f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
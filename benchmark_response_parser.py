@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the NL2SQL response parser
+Times parse_sql_response on well-formed, malformed and adversarial responses of
+growing size, and checks that parse time grows linearly with input length
+"""
+
+import re
+import sys
+import time
+
+from response_parser import StreamingSQLExtractor, parse_sql_response
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+# Time per character may grow at most this much between the smallest and
+# largest input before the parser is considered super-linear
+MAX_SCALING_FACTOR = 4.0
+
+# Legacy cascade from _parse_claude_response, kept only as a comparison baseline
+LEGACY_PATTERNS = [
+    (r':\s*"([^"]*)"([^"]*)"([^"]*)"', 0),
+    (r'"sql"\s*:\s*"((?:[^"\\]|\\.)*)(?:"(?:\s*,|\s*}))', re.DOTALL),
+    (r'SELECT\s+.*?(?:FROM|$)', re.IGNORECASE | re.MULTILINE | re.DOTALL),
+    (r'WITH\s+.*?SELECT\s+.*', re.IGNORECASE | re.MULTILINE | re.DOTALL),
+]
+LEGACY_MAX_SIZE = 100_000
+
+
+def _pad(prefix: str, filler: str, suffix: str, size: int) -> str:
+    repeats = max(1, (size - len(prefix) - len(suffix)) // len(filler))
+    return prefix + filler * repeats + suffix
+
+
+WORST_CASES = {
+    "valid_json": lambda n: _pad('{"sql": "SELECT ', 'col_a, ', 'col_b FROM t", "explanation": "ok", "confidence": 0.9}', n),
+    "raw_inner_quotes": lambda n: _pad('{"sql": "SELECT ', '"a" || "b" ', 'FROM t", "explanation": "ok", "confidence": 0.9}', n),
+    "unterminated_string": lambda n: _pad('{"sql": "SELECT ', 'x \\" y ', '', n),
+    "many_colons_quotes": lambda n: _pad('{', ': "a', '}', n),
+    "prose_with_no_select": lambda n: _pad('Here is my answer {', 'with ', '}', n),
+    "nested_values": lambda n: _pad('{"assumptions": ', '[', '', n),
+    "whitespace_runs": lambda n: _pad('{"sql": "SELECT 1 "', ' ', 'x", "confidence": 1}', n),
+}
+
+
+def _time_call(func, text: str, repeat: int = 3) -> float:
+    """Best-of-N wall time in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            func(text)
+        except ValueError:
+            pass
+        best = min(best, (time.perf_counter() - start) * 1000)
+    return best
+
+
+def _legacy_parse(text: str):
+    for pattern, flags in LEGACY_PATTERNS:
+        re.search(pattern, text, flags)
+
+
+def _streaming_parse(text: str):
+    extractor = StreamingSQLExtractor()
+    for i in range(0, len(text), 64):
+        extractor.feed(text[i:i + 64])
+
+
+def run_benchmarks() -> bool:
+    """Run all worst-case inputs and report whether every case scaled linearly"""
+    print("🧪 RESPONSE PARSER MICRO-BENCHMARKS")
+    print("=" * 78)
+    print(f"{'Case':<22} {'Size':>9} {'Parser ms':>10} {'Stream ms':>10} {'Legacy ms':>10} {'μs/KB':>8}")
+    print("-" * 78)
+
+    all_bounded = True
+    for name, build in WORST_CASES.items():
+        per_char = []
+        for size in SIZES:
+            text = build(size)
+            parser_ms = _time_call(parse_sql_response, text)
+            stream_ms = _time_call(_streaming_parse, text, repeat=1)
+            legacy = f"{_time_call(_legacy_parse, text, repeat=1):10.2f}" if size <= LEGACY_MAX_SIZE else f"{'skipped':>10}"
+            per_char.append(parser_ms / len(text))
+            print(f"{name:<22} {len(text):>9,} {parser_ms:>10.2f} {stream_ms:>10.2f} {legacy} {parser_ms / len(text) * 1_000_000:>8.1f}")
+
+        scaling = per_char[-1] / per_char[0] if per_char[0] > 0 else 1.0
+        bounded = scaling <= MAX_SCALING_FACTOR
+        all_bounded &= bounded
+        print(f"{'':<22} {'scaling':>9} {scaling:>10.2f}x {'✅ linear' if bounded else '❌ super-linear'}")
+        print("-" * 78)
+
+    print("✅ Parse time is bounded by input length" if all_bounded else "❌ Super-linear parse time detected")
+    return all_bounded
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_benchmarks() else 1)
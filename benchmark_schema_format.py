@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Verbose vs compact schema format on the stress-test prompt set
+Generates SQL for every focused_stress_test prompt with each schema format and
+compares prompt tokens (estimated and billed), generation latency and SQL
+accuracy: offline validation plus the expected tables being used, and - with
+--execute - successful execution on Firebolt.
+
+Usage:
+    python benchmark_schema_format.py                  # Claude via NL2SQL_LLM_BACKEND
+    python benchmark_schema_format.py --tokens-only    # prompt sizes only, no model calls
+    NL2SQL_LLM_BACKEND=record python benchmark_schema_format.py --execute --output formats.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+from llm_calls import LLMUsageTracker
+from nl2sql_claude import NL2SQLConverter
+from prompt_budget import estimate_tokens
+from schema_format import SCHEMA_FORMATS, compact_schema
+
+
+def run_format(schema_format: str, prompts: List[Dict], schema_context: str, schema_info: Dict[str, Dict],
+               tokens_only: bool, execute_queries) -> Dict[str, any]:
+    """Generate (and optionally execute) every prompt with one schema format"""
+    tracker = LLMUsageTracker()
+    converter = NL2SQLConverter(schema_context=schema_context, schema_info=schema_info, use_templates=False,
+                                usage_tracker=tracker, schema_format=schema_format)
+    schema_text = compact_schema(schema_info, converter.validator.join_graph) if schema_format == "compact" else schema_context
+
+    rows = []
+    for prompt_data in prompts:
+        prompt, budget_report = converter._build_prompt(prompt_data["prompt"], "nl2sql.generate")
+        row = {"id": prompt_data["id"], "prompt_tokens": budget_report["tokens"], "trimmed": budget_report["trimmed"]}
+        if not tokens_only:
+            start_time = time.perf_counter()
+            result = converter.generate_sql(prompt_data["prompt"])
+            validation = result.get("validation") or {}
+            used_tables = set(validation.get("tables", []))
+            row.update({
+                "latency_ms": (time.perf_counter() - start_time) * 1000,
+                "generated": bool(result.get("sql")),
+                "valid": bool(validation.get("valid")),
+                "expected_tables": set(prompt_data["expected_tables"]) <= used_tables,
+                "sql": result.get("sql"),
+                "error": result.get("error"),
+            })
+        rows.append(row)
+
+    if execute_queries and not tokens_only:
+        outcomes = execute_queries([row["sql"] for row in rows if row["valid"]])
+        for row in [row for row in rows if row["valid"]]:
+            outcome = outcomes.pop(0)
+            row["executed"] = not isinstance(outcome, Exception)
+
+    usage = tracker.summary()["totals"]
+    return {
+        "schema_format": schema_format,
+        "schema_tokens": estimate_tokens(schema_text),
+        "rows": rows,
+        "input_tokens": usage["input_tokens"],
+        "llm_calls": usage["calls"],
+        "cost_usd": usage["cost_usd"],
+    }
+
+
+def summarize(run: Dict[str, any]) -> Dict[str, any]:
+    rows = run["rows"]
+    summary = {
+        "schema_format": run["schema_format"],
+        "schema_tokens": run["schema_tokens"],
+        "avg_prompt_tokens": statistics.mean(row["prompt_tokens"] for row in rows),
+        "input_tokens": run["input_tokens"],
+        "cost_usd": run["cost_usd"],
+    }
+    if "latency_ms" in rows[0]:
+        latencies = [row["latency_ms"] for row in rows]
+        summary.update({
+            "p50_latency_ms": statistics.median(latencies),
+            "max_latency_ms": max(latencies),
+            "valid": sum(row["valid"] for row in rows),
+            "expected_tables": sum(row["valid"] and row["expected_tables"] for row in rows),
+        })
+    if any("executed" in row for row in rows):
+        summary["executed"] = sum(row.get("executed", False) for row in rows)
+    return summary
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare schema formats on the stress-test prompts")
+    parser.add_argument("--tokens-only", action="store_true", help="measure prompt sizes without calling Claude")
+    parser.add_argument("--execute", action="store_true", help="also execute valid SQL on Firebolt")
+    parser.add_argument("--output", help="write per-prompt results as JSON")
+    args = parser.parse_args()
+
+    # focused_stress_test exits at import without Firebolt credentials unless execution is off
+    os.environ.setdefault('STRESS_TEST_EXECUTE', '1' if args.execute else '0')
+    from focused_stress_test import STRESS_TEST_PROMPTS, STRESS_TEST_SCHEMA_INFO, format_schema_for_claude
+
+    execute_queries = None
+    if args.execute:
+        from test_mcp_real import execute_queries_via_mcp
+        execute_queries = lambda queries: asyncio.run(execute_queries_via_mcp(queries))
+
+    print("🧪 SCHEMA FORMAT BENCHMARK")
+    print("=" * 78)
+    runs = [run_format(schema_format, STRESS_TEST_PROMPTS, format_schema_for_claude(), STRESS_TEST_SCHEMA_INFO,
+                       args.tokens_only, execute_queries)
+            for schema_format in SCHEMA_FORMATS]
+    summaries = [summarize(run) for run in runs]
+    total = len(STRESS_TEST_PROMPTS)
+
+    print(f"{'Format':<9} {'Schema tok':>10} {'Prompt tok':>10} {'Billed in':>10} {'p50 ms':>8} {'max ms':>8} "
+          f"{'Valid':>6} {'Tables':>7} {'Exec':>6}")
+    print("-" * 78)
+    for s in summaries:
+        latency = f"{s['p50_latency_ms']:>8.0f} {s['max_latency_ms']:>8.0f}" if "p50_latency_ms" in s else f"{'-':>8} {'-':>8}"
+        accuracy = f"{s['valid']:>3}/{total:<2} {s['expected_tables']:>4}/{total:<2}" if "valid" in s else f"{'-':>6} {'-':>7}"
+        executed = f"{s['executed']:>3}/{total:<2}" if "executed" in s else f"{'-':>6}"
+        print(f"{s['schema_format']:<9} {s['schema_tokens']:>10,} {s['avg_prompt_tokens']:>10,.0f} "
+              f"{s['input_tokens']:>10,} {latency} {accuracy} {executed}")
+    print("-" * 78)
+
+    verbose, compact = summaries
+    saving = 1 - compact["avg_prompt_tokens"] / verbose["avg_prompt_tokens"]
+    print(f"📉 Compact prompts are {saving * 100:.1f}% smaller on average")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"summaries": summaries, "runs": runs}, f, indent=1)
+        print(f"💾 Per-prompt results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
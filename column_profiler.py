@@ -0,0 +1,202 @@
+"""
+Low-cost column statistics for prompts and validation
+Profiles each column with approximate SQL - approximate distinct counts,
+min/max for numeric and date columns, and the most common values of
+low-cardinality text columns from a random row sample. The stats are cached
+with the schema catalog and re-profiled once older than
+NL2SQL_PROFILE_TTL_S; only the hints relevant to a question are added to its
+prompt, so Claude sees real literal values (e.g. `event_type`) without any
+extra round-trips.
+"""
+
+import os
+import re
+import time
+from typing import Dict, Iterable, List, Optional
+
+from example_store import STOPWORDS
+from prompt_budget import estimate_tokens
+
+# Expected rows in the random sample for top values; distinct counts and ranges
+# use approximate full-table aggregates
+PROFILE_SAMPLE_ROWS = 100000
+TOP_K_VALUES = 10
+
+# Stats older than this are re-profiled by the background schema refresh
+DEFAULT_PROFILE_TTL_S = 7 * 24 * 3600
+
+# Text columns with more distinct values than this get no value list
+LOW_CARDINALITY = 50
+
+MAX_HINT_COLUMNS = 8
+DEFAULT_HINT_TOKENS = 300
+
+_TEXT_TYPES = ('text', 'varchar', 'char', 'string')
+_NUMERIC_TYPES = ('int', 'real', 'double', 'float', 'numeric', 'decimal')
+_DATE_TYPES = ('date', 'timestamp')
+
+
+def column_kind(data_type: str) -> Optional[str]:
+    """"text", "numeric" or "date"; None for arrays, JSON, booleans and other unprofiled types"""
+    data_type = (data_type or '').lower()
+    if 'array' in data_type:
+        return None
+    if data_type.startswith(_DATE_TYPES):
+        return "date"
+    if data_type.startswith(_NUMERIC_TYPES) or data_type in ('bigint', 'smallint'):
+        return "numeric"
+    if data_type.startswith(_TEXT_TYPES):
+        return "text"
+    return None
+
+
+def profile_ttl_s() -> float:
+    return float(os.getenv('NL2SQL_PROFILE_TTL_S', DEFAULT_PROFILE_TTL_S))
+
+
+def stale_tables(schema_entry: Dict[str, any], ttl_s: Optional[float] = None,
+                 now: Optional[float] = None) -> List[str]:
+    """Tables of a catalog entry that were never profiled or were profiled more than `ttl_s` ago"""
+    ttl_s = profile_ttl_s() if ttl_s is None else ttl_s
+    now = time.time() if now is None else now
+    profiled_at = schema_entry.get('profiled_at') or {}
+    return [table for table in schema_entry['schema_info']
+            if now - profiled_at.get(table, 0) > ttl_s]
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _json_value(value):
+    return value if value is None or isinstance(value, (str, int, float)) else str(value)
+
+
+async def profile_table(firebolt, table: str, columns: List[Dict[str, str]]) -> Dict[str, Dict]:
+    """Stats for one table's profilable columns over an open FireboltMCPSession
+
+    One aggregate query for row count, distinct counts and ranges, then one
+    top-values query per low-cardinality text column over a random sample of
+    about PROFILE_SAMPLE_ROWS rows. A value list is marked `complete` only when
+    an exact COUNT(DISTINCT) confirms the sample listed every value.
+    """
+    profiled = [(col['name'], column_kind(col['type'])) for col in columns]
+    profiled = [(name, kind) for name, kind in profiled if kind]
+    if not profiled:
+        return {}
+
+    aggregates = ["COUNT(*) AS row_count"]
+    for i, (name, kind) in enumerate(profiled):
+        aggregates.append(f"APPROX_COUNT_DISTINCT({_quote(name)}) AS d{i}")
+        if kind != "text":
+            aggregates.append(f"MIN({_quote(name)}) AS min{i}, MAX({_quote(name)}) AS max{i}")
+    row = (await firebolt.query(f"SELECT {', '.join(aggregates)} FROM {_quote(table)}"))[0]
+    row_count = row.get("row_count") or 0
+    sample_filter = ""
+    if row_count > PROFILE_SAMPLE_ROWS:
+        sample_filter = f"RANDOM() < {PROFILE_SAMPLE_ROWS / row_count:.6g} AND "
+
+    stats = {}
+    for i, (name, kind) in enumerate(profiled):
+        column_stats = {"kind": kind, "distinct": row.get(f"d{i}")}
+        if kind != "text":
+            column_stats.update({"min": _json_value(row.get(f"min{i}")), "max": _json_value(row.get(f"max{i}"))})
+        elif column_stats["distinct"] is not None and column_stats["distinct"] <= LOW_CARDINALITY:
+            values = await firebolt.query(
+                f"SELECT {_quote(name)} AS value, COUNT(*) AS n FROM {_quote(table)} "
+                f"WHERE {sample_filter}{_quote(name)} IS NOT NULL GROUP BY 1 ORDER BY n DESC LIMIT {TOP_K_VALUES}"
+            )
+            column_stats["top_values"] = [str(value["value"]) for value in values]
+            column_stats["complete"] = False
+        stats[name] = column_stats
+
+    # Every value is listed: safe to flag literals outside the list. The approximate
+    # count only picks candidates; the exact count decides.
+    candidates = [name for name, column_stats in stats.items()
+                  if "top_values" in column_stats and column_stats["distinct"] <= 2 * TOP_K_VALUES]
+    if candidates:
+        exact = (await firebolt.query(
+            "SELECT " + ", ".join(f"COUNT(DISTINCT {_quote(name)}) AS e{i}" for i, name in enumerate(candidates))
+            + f" FROM {_quote(table)}"
+        ))[0]
+        for i, name in enumerate(candidates):
+            distinct = exact.get(f"e{i}")
+            listed = len(stats[name]["top_values"])
+            stats[name]["complete"] = distinct is not None and distinct == listed <= TOP_K_VALUES
+    return stats
+
+
+async def profile_schema(firebolt, schema_info: Dict[str, Dict],
+                         tables: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Dict]]:
+    """Stats for `tables` (default: all); tables that fail to profile get empty stats and are not retried"""
+    stats = {}
+    for table in tables if tables is not None else schema_info:
+        try:
+            stats[table] = await profile_table(firebolt, table, schema_info[table].get('columns', []))
+        except Exception:
+            stats[table] = {}
+    return stats
+
+
+def _stem(word: str) -> str:
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    if word.endswith('s') and not word.endswith('ss') and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def _terms(text: str) -> set:
+    return {_stem(word) for word in re.findall(r'[a-z0-9]+', text.lower()) if word not in STOPWORDS}
+
+
+def _hint_line(table: str, column: str, stats: Dict[str, any]) -> Optional[str]:
+    distinct = stats.get("distinct")
+    if stats["kind"] == "text":
+        values = stats.get("top_values")
+        if not values:
+            return None
+        listed = ", ".join(f"'{value}'" for value in values)
+        suffix = "" if stats.get("complete") else ", ..."
+        return f"- {table}.{column}: {listed}{suffix} (~{distinct} distinct)"
+    if stats.get("min") is None:
+        return None
+    return f"- {table}.{column}: {stats['min']} to {stats['max']} (~{distinct} distinct)"
+
+
+def format_value_hints(column_stats: Dict[str, Dict[str, Dict]], question: str,
+                       tables: Optional[Iterable[str]] = None, max_tokens: int = DEFAULT_HINT_TOKENS) -> str:
+    """Value hints for the columns most relevant to `question`, within `max_tokens`
+
+    Columns score for known values mentioned in the question, then for
+    column-name and table-name overlap; columns with no overlap are left out.
+    """
+    terms = _terms(question)
+    lowered = question.lower()
+    allowed = {t.lower() for t in tables} if tables is not None else None
+    ranked = []
+    for table, columns in column_stats.items():
+        if allowed is not None and table.lower() not in allowed:
+            continue
+        table_hits = len(terms & _terms(table.replace('_', ' ')))
+        for column, stats in columns.items():
+            values = stats.get("top_values") or []
+            value_hits = sum(1 for value in values
+                             if _terms(value) & terms or (len(value) > 3 and value.lower() in lowered))
+            score = 4 * value_hits + 2 * len(terms & _terms(column.replace('_', ' '))) + table_hits
+            line = _hint_line(table, column, stats) if score else None
+            if line:
+                # Ties: value lists and date ranges are more useful than numeric ranges
+                ranked.append((score, stats["kind"] != "numeric", line))
+    ranked.sort(reverse=True)
+
+    lines, used_tokens = [], 0
+    for _, _, line in ranked[:MAX_HINT_COLUMNS]:
+        cost = estimate_tokens(line)
+        if used_tokens + cost > max_tokens:
+            continue
+        lines.append(line)
+        used_tokens += cost
+    if not lines:
+        return ""
+    return "COLUMN VALUES (profiled):\n" + "\n".join(lines)
@@ -0,0 +1,197 @@
+"""
+Retrieval-based few-shot examples for NL2SQL prompts
+Keeps verified question -> SQL pairs per database and injects only the few
+most similar to the current question, within a token budget. Queries that
+execute successfully are added automatically, so the store grows with use.
+
+Under the record/replay LLM backends the store is frozen: persisted examples
+are not loaded and nothing is added, so prompts - and the cassette keys
+hashed from them - do not drift as the store grows.
+"""
+
+import math
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from json_files import load_json, path_lock, write_json_atomic
+from prompt_budget import estimate_tokens
+
+DEFAULT_STORE_PATH = "nl2sql_examples.json"
+DEFAULT_TOP_K = 3
+DEFAULT_EXAMPLE_TOKENS = 600
+
+# Oldest, least used examples are evicted beyond this many per database
+MAX_EXAMPLES_PER_DATABASE = 500
+
+# Examples sharing less than this fraction of the question's weight are noise
+MIN_SIMILARITY = 0.15
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'do', 'does', 'for', 'from', 'give', 'have', 'how',
+    'i', 'in', 'is', 'it', 'list', 'me', 'of', 'on', 'or', 'our', 'per', 'please', 'show', 'tell', 'that',
+    'the', 'their', 'there', 'this', 'to', 'we', 'what', 'whats', 'which', 'who', 'with'
+}
+
+
+def recorded_backend() -> bool:
+    """True when NL2SQL_LLM_BACKEND records or replays a cassette (see llm_backend)"""
+    return os.getenv('NL2SQL_LLM_BACKEND', 'anthropic').strip().lower() in ('record', 'replay')
+
+
+def question_terms(question: str) -> Set[str]:
+    """Lowercased content words with a naive plural strip"""
+    terms = set()
+    for word in re.findall(r'[a-z0-9_]+', question.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms.add(word)
+    return terms
+
+
+class ExampleStore:
+    """Verified examples for one database with an inverted index for similarity lookups
+
+    `database=None` keeps the store in memory only; otherwise examples are
+    persisted under that database's key in `path` (NL2SQL_EXAMPLE_STORE).
+    A `frozen` store (default: under record/replay) holds only `seed` and
+    ignores `add`.
+    """
+
+    def __init__(self, database: Optional[str] = None, path: Optional[str] = None,
+                 seed: Optional[List[Dict[str, str]]] = None, frozen: Optional[bool] = None):
+        self.database = database
+        self.path = path or os.getenv('NL2SQL_EXAMPLE_STORE', DEFAULT_STORE_PATH)
+        self.frozen = recorded_backend() if frozen is None else frozen
+        self.examples: List[Dict[str, any]] = []
+        self._index: Dict[str, Set[int]] = {}
+        self._norms_stale = False
+        self._lock = threading.Lock()
+
+        for example in self._load() if database and not self.frozen else []:
+            self._insert(example)
+        if not self.examples:
+            for example in seed or []:
+                self._insert({"question": example["question"], "sql": example["sql"],
+                              "tables": example.get("tables", []), "uses": 0, "added": 0})
+
+    def __len__(self) -> int:
+        return len(self.examples)
+
+    def select(self, question: str, k: int = DEFAULT_TOP_K, max_tokens: int = DEFAULT_EXAMPLE_TOKENS,
+               available_tables: Optional[Iterable[str]] = None) -> List[Dict[str, any]]:
+        """Top-k examples by IDF-weighted term overlap that fit in `max_tokens`
+
+        Examples that reference tables missing from `available_tables` are
+        skipped, so a schema change never injects SQL for dropped tables.
+        """
+        terms = question_terms(question)
+        available = {t.lower() for t in available_tables} if available_tables is not None else None
+        with self._lock:
+            if self._norms_stale:
+                self._refresh_norms()
+            total = len(self.examples)
+            weights = {term: math.log(1 + total / len(self._index[term])) for term in terms if term in self._index}
+            query_norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+
+            scores: Dict[int, float] = {}
+            for term, weight in weights.items():
+                for position in self._index[term]:
+                    scores[position] = scores.get(position, 0.0) + weight * weight
+
+            ranked = []
+            for position, score in scores.items():
+                example = self.examples[position]
+                similarity = score / (query_norm * math.sqrt(example["_norm"]))
+                if similarity < MIN_SIMILARITY:
+                    continue
+                if available is not None and not set(example["tables"]) <= available:
+                    continue
+                ranked.append((similarity, position))
+            ranked.sort(reverse=True)
+
+            selected, used_tokens = [], 0
+            for similarity, position in ranked:
+                example = self.examples[position]
+                cost = estimate_tokens(example["question"]) + estimate_tokens(example["sql"])
+                if used_tokens + cost > max_tokens:
+                    continue
+                example["uses"] += 1
+                used_tokens += cost
+                selected.append({"question": example["question"], "sql": example["sql"],
+                                 "similarity": similarity})
+                if len(selected) == k:
+                    break
+        return selected
+
+    def add(self, question: str, sql: str, tables: Optional[List[str]] = None) -> bool:
+        """Record a verified pair (replacing the SQL of a known question); False if unchanged or frozen"""
+        if self.frozen:
+            return False
+        key = " ".join(question.lower().split())
+        with self._lock:
+            for example in self.examples:
+                if " ".join(example["question"].lower().split()) == key:
+                    if example["sql"] == sql:
+                        return False
+                    example.update({"sql": sql, "tables": sorted(tables or []), "added": time.time()})
+                    break
+            else:
+                self._insert({"question": question, "sql": sql, "tables": sorted(tables or []),
+                              "uses": 0, "added": time.time()})
+                if len(self.examples) > MAX_EXAMPLES_PER_DATABASE:
+                    self._evict()
+        self._save()
+        return True
+
+    def _insert(self, example: Dict[str, any]):
+        terms = question_terms(example["question"])
+        example["_terms"] = terms
+        position = len(self.examples)
+        self.examples.append(example)
+        for term in terms:
+            self._index.setdefault(term, set()).add(position)
+        self._norms_stale = True
+
+    def _refresh_norms(self):
+        """Example vector norms depend on IDF, which shifts as examples are added"""
+        total = len(self.examples)
+        for example in self.examples:
+            example["_norm"] = sum(math.log(1 + total / len(self._index[t])) ** 2 for t in example["_terms"]) or 1.0
+        self._norms_stale = False
+
+    def _evict(self):
+        keep = sorted(self.examples, key=lambda e: (e["uses"], e["added"]), reverse=True)[:MAX_EXAMPLES_PER_DATABASE]
+        self.examples, self._index = [], {}
+        for example in keep:
+            self._insert(example)
+
+    def _load(self) -> List[Dict[str, any]]:
+        with path_lock(self.path):
+            return (load_json(self.path) or {}).get(self.database, [])
+
+    def _save(self):
+        """Rewrite this database's examples atomically, keeping other databases' entries
+
+        Other stores for the same file (other sessions) may have saved since this
+        one loaded, so their examples are merged in; this store's SQL wins for
+        questions both hold.
+        """
+        if not self.database:
+            return
+        with path_lock(self.path):
+            data = load_json(self.path) or {}
+            with self._lock:
+                merged = {" ".join(example["question"].lower().split()): example
+                          for example in data.get(self.database, [])}
+                for example in self.examples:
+                    merged[" ".join(example["question"].lower().split())] = {
+                        name: value for name, value in example.items() if not name.startswith('_')
+                    }
+            data[self.database] = sorted(merged.values(), key=lambda e: (e["uses"], e["added"]),
+                                         reverse=True)[:MAX_EXAMPLES_PER_DATABASE]
+            write_json_atomic(self.path, data)
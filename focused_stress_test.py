@@ -5,12 +5,19 @@ import asyncio
 import time
 from nl2sql_claude import NL2SQLConverter
 from test_mcp_real import execute_query_via_mcp
+from llm_backend import backend_mode, backend_requires_api_key
+
+# Offline runs: NL2SQL_LLM_BACKEND=replay replays recorded Claude responses and
+# STRESS_TEST_EXECUTE=0 skips Firebolt, so generation, parsing and validation
+# can be load-tested without network access (STRESS_TEST_REPEAT multiplies the prompts)
+EXECUTE_QUERIES = os.getenv('STRESS_TEST_EXECUTE', '1') != '0'
+REPEAT = int(os.getenv('STRESS_TEST_REPEAT', '1'))
 
 # Set up Firebolt credentials (must be provided via environment variables)
 # Please set these environment variables before running:
 # export FIREBOLT_MCP_CLIENT_ID='your_client_id'
 # export FIREBOLT_MCP_CLIENT_SECRET='your_client_secret'
-if not os.getenv('FIREBOLT_MCP_CLIENT_ID') or not os.getenv('FIREBOLT_MCP_CLIENT_SECRET'):
+if EXECUTE_QUERIES and (not os.getenv('FIREBOLT_MCP_CLIENT_ID') or not os.getenv('FIREBOLT_MCP_CLIENT_SECRET')):
     print("❌ Error: FIREBOLT_MCP_CLIENT_ID and FIREBOLT_MCP_CLIENT_SECRET must be set as environment variables")
     print("Please set: export FIREBOLT_MCP_CLIENT_ID='your_client_id'")
     print("Please set: export FIREBOLT_MCP_CLIENT_SECRET='your_client_secret'")
@@ -23,8 +30,16 @@ os.environ['FIREBOLT_MCP_ENGINE'] = 'kush_test_engine'
 # API key must be provided via environment variable
 
 from nl2sql_claude import NL2SQLConverter
+from sql_repair import SQLRepairLoop, classify_sql_error, format_sql_error
 from test_mcp_real import execute_query_via_mcp
 
+# Opt-in: concurrent SQL candidates for advanced prompts (first valid wins)
+PARALLEL_CANDIDATES = int(os.getenv('STRESS_TEST_CANDIDATES', '1'))
+
+def explain_on_firebolt(sql):
+    """Dry-run a candidate with EXPLAIN so broken SQL is rejected before the real run"""
+    return asyncio.run(execute_query_via_mcp(f"EXPLAIN {sql}"))
+
 # 10 Carefully Selected Test Prompts (5 Intermediate + 5 Advanced)
 STRESS_TEST_PROMPTS = [
     # === INTERMEDIATE COMPLEXITY ===
@@ -102,6 +117,32 @@ STRESS_TEST_PROMPTS = [
     }
 ]
 
+# Discovered-schema shape of the tables below, used for offline validation
+STRESS_TEST_SCHEMA_INFO = {
+    "campaigns": {"type": "TABLE", "columns": [
+        {"name": "campaign_id", "type": "TEXT"},
+        {"name": "advertiser", "type": "TEXT"},
+        {"name": "campaign_type", "type": "TEXT"},
+        {"name": "daily_budget", "type": "DECIMAL(10,2)"},
+        {"name": "start_date", "type": "DATE"},
+    ]},
+    "publishers": {"type": "TABLE", "columns": [
+        {"name": "publisher_id", "type": "TEXT"},
+        {"name": "publisher_name", "type": "TEXT"},
+        {"name": "region", "type": "TEXT"},
+        {"name": "publisher_type", "type": "TEXT"},
+    ]},
+    "ad_events": {"type": "TABLE", "columns": [
+        {"name": "event_id", "type": "TEXT"},
+        {"name": "campaign_id", "type": "TEXT"},
+        {"name": "publisher_id", "type": "TEXT"},
+        {"name": "event_type", "type": "TEXT"},
+        {"name": "event_hour", "type": "INTEGER"},
+        {"name": "cost_usd", "type": "DECIMAL(15,4)"},
+        {"name": "revenue_usd", "type": "DECIMAL(15,4)"},
+    ]},
+}
+
 def format_schema_for_claude():
     """Format the schema context for Claude with important column mappings"""
     return """
@@ -176,7 +217,14 @@ async def test_prompt(prompt_data, nl2sql_converter):
         print("🔄 Step 1: Generating SQL with Claude...")
         start_time = time.time()
         
-        response = nl2sql_converter.generate_sql(prompt)
+        if difficulty == "advanced" and PARALLEL_CANDIDATES > 1:
+            response = nl2sql_converter.generate_sql_candidates(
+                prompt, PARALLEL_CANDIDATES, dry_run=explain_on_firebolt if EXECUTE_QUERIES else None)
+            for candidate in response.get('candidates', []):
+                print(f"   Candidate #{candidate['index']} (t={candidate['temperature']}): {candidate['status']} "
+                      f"after {candidate['latency_ms']:.0f}ms")
+        else:
+            response = nl2sql_converter.generate_sql(prompt)
         
         if not response.get('success'):
             result["error"] = f"SQL Generation Failed: {response.get('error', 'Unknown error')}"
@@ -191,6 +239,14 @@ async def test_prompt(prompt_data, nl2sql_converter):
         print(f"📄 Generated SQL:")
         print(f"```sql\n{sql}\n```")
         
+        if not EXECUTE_QUERIES:
+            validation = response.get('validation') or nl2sql_converter.validate_sql(sql)
+            result["success"] = validation['valid']
+            if not validation['valid']:
+                result["error"] = format_sql_error("; ".join(validation['errors']))
+            print(f"⏭️  Execution skipped - offline validation {'passed' if validation['valid'] else 'failed'}")
+            return result
+        
         # Step 2: Execute SQL
         print("\n🔄 Step 2: Executing SQL on Firebolt...")
         exec_start = time.time()
@@ -200,6 +256,7 @@ async def test_prompt(prompt_data, nl2sql_converter):
         exec_time = time.time() - exec_start
         result["execution_time"] = exec_time
         result["execution_success"] = True
+        nl2sql_converter.remember_example(prompt, sql)
         
         # Step 3: Validate Results
         if query_result and len(query_result) > 0:
@@ -239,15 +296,41 @@ async def test_prompt(prompt_data, nl2sql_converter):
         print(f"❌ Error: {e}")
         
         # Additional error context
-        if "Decimal math overflow" in str(e):
-            result["error"] = f"Decimal overflow - need to increase precision: {e}"
-        elif "Column" in str(e) and "does not exist" in str(e):
-            result["error"] = f"Schema mismatch - wrong column name: {e}"
-        elif "syntax error" in str(e).lower():
-            result["error"] = f"SQL syntax error: {e}"
+        result["error"] = format_sql_error(str(e))
+        result["error_category"] = classify_sql_error(str(e))["category"]
+        
+        if result["sql_generated"] and not result["execution_success"]:
+            await repair_failed_query(prompt, result, str(e), nl2sql_converter)
     
     return result
 
+async def repair_failed_query(prompt, result, error, nl2sql_converter):
+    """Try the bounded self-repair loop on a query Firebolt rejected"""
+    print("\n🔧 Step 4: Repairing SQL from the classified error...")
+    repair_loop = SQLRepairLoop(
+        nl2sql_converter,
+        execute=lambda query: asyncio.run(execute_query_via_mcp(query))
+    )
+    outcome = await asyncio.to_thread(repair_loop.run, prompt, result["sql_generated"], error)
+    result["repair_attempts"] = outcome["attempts"]
+    
+    for attempt in outcome["attempts"][1:]:
+        print(f"   Attempt {attempt['attempt']}: generation {attempt['generation_ms']:.0f}ms, "
+              f"execution {attempt['execution_ms']:.0f}ms, {attempt.get('category', 'success')}")
+    
+    if outcome["success"]:
+        result.update({
+            "success": True,
+            "repaired": True,
+            "sql_generated": outcome["sql"],
+            "execution_success": True,
+            "execution_time": outcome["attempts"][-1]["execution_ms"] / 1000,
+            "result_count": len(outcome["rows"]) if outcome["rows"] else 0
+        })
+        print(f"✅ Repaired in {len(outcome['attempts']) - 1} round-trip(s), {outcome['total_time_ms']:.0f}ms total")
+    else:
+        print(f"❌ Repair failed: {outcome['error']}")
+
 async def run_focused_stress_test():
     """Run the focused stress test on 10 carefully selected prompts"""
     
@@ -258,29 +341,30 @@ async def run_focused_stress_test():
     print()
     
     # Check API key
-    if not os.getenv('ANTHROPIC_API_KEY'):
+    if backend_requires_api_key() and not os.getenv('ANTHROPIC_API_KEY'):
         print("❌ Error: ANTHROPIC_API_KEY environment variable not set")
         print("Please set your API key: export ANTHROPIC_API_KEY='<your-key>'")
         return
     
     # Initialize Claude with schema context
     schema_context = format_schema_for_claude()
-    nl2sql_converter = NL2SQLConverter(schema_context=schema_context)
+    nl2sql_converter = NL2SQLConverter(schema_context=schema_context, schema_info=STRESS_TEST_SCHEMA_INFO)
     
-    print("✅ Claude NL2SQL Converter initialized")
-    print("✅ Firebolt MCP credentials configured")
+    print(f"✅ Claude NL2SQL Converter initialized ({backend_mode()} backend)")
+    print("✅ Firebolt MCP credentials configured" if EXECUTE_QUERIES else "⏭️  Firebolt execution disabled")
     print()
     
     # Run all tests
     results = []
     start_time = time.time()
     
-    for prompt_data in STRESS_TEST_PROMPTS:
+    for prompt_data in STRESS_TEST_PROMPTS * REPEAT:
         result = await test_prompt(prompt_data, nl2sql_converter)
         results.append(result)
         
-        # Brief pause between tests
-        await asyncio.sleep(1)
+        # Brief pause between tests (not needed when replaying offline)
+        if backend_mode() != 'replay':
+            await asyncio.sleep(1)
     
     total_time = time.time() - start_time
     
@@ -300,7 +384,9 @@ async def run_focused_stress_test():
     print(f"   SQL Generated: {successful_sql}/{total_tests} ({successful_sql/total_tests*100:.1f}%)")
     print(f"   SQL Executed: {successful_execution}/{total_tests} ({successful_execution/total_tests*100:.1f}%)")
     print(f"   Fully Successful: {fully_successful}/{total_tests} ({fully_successful/total_tests*100:.1f}%)")
+    print(f"   Recovered by Self-Repair: {sum(1 for r in results if r.get('repaired'))}")
     print(f"   Total Test Time: {total_time:.1f}s")
+    print(f"   Throughput: {total_tests / total_time:.2f} prompts/s")
     
     # Success by Difficulty
     intermediate_results = [r for r in results if r["difficulty"] == "intermediate"]
@@ -326,6 +412,27 @@ async def run_focused_stress_test():
         print(f"   Slowest Query: {max_time:.2f}s")
         print(f"   Sub-second Queries: {sum(1 for t in execution_times if t < 1.0)}/{len(execution_times)}")
     
+    # Token & Cost Analysis
+    usage = nl2sql_converter.llm.tracker.summary()
+    if usage["totals"]["calls"]:
+        totals = usage["totals"]
+        print(f"\n🪙 CLAUDE USAGE:")
+        print(f"   Calls: {totals['calls']} ({totals['errors']} errors), est. cost ${totals['cost_usd']:.4f}")
+        print(f"   Tokens: {totals['input_tokens']:,} in / {totals['output_tokens']:,} out / "
+              f"{totals['cache_read_input_tokens']:,} cache read")
+        for call_site, stats in sorted(usage["by_call_site"].items(), key=lambda item: -item[1]["input_tokens"]):
+            print(f"   {call_site:<18} {stats['calls']:3d} calls  {stats['input_tokens']:>8,} in  "
+                  f"{stats['output_tokens']:>7,} out  avg {stats['avg_latency_ms']:.0f}ms  ${stats['cost_usd']:.4f}")
+    
+    # Model Tier Analysis
+    tier_stats = nl2sql_converter.tier_ladder.get_stats()
+    if tier_stats:
+        print(f"\n🪜 MODEL TIERS:")
+        for tier in tier_stats:
+            escalations = ", ".join(f"{reason}: {count}" for reason, count in tier["escalations"].items()) or "none"
+            print(f"   {tier['model']}: {tier['accepted']}/{tier['calls']} accepted ({tier['hit_rate']*100:.1f}%), "
+                  f"avg {tier['avg_latency_ms']:.0f}ms, escalations: {escalations}")
+    
     # Failed Tests Analysis
     failed_tests = [r for r in results if not r["success"]]
     if failed_tests:
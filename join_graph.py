@@ -0,0 +1,206 @@
+"""
+Join graph derived from discovered schema metadata
+Tables are linked by shared key columns (`*_id` names and primary index
+columns, taken from `primary_index` or the DDL) to the table that owns the
+key, and by `<table>_id -> <table>.id` references. Keys no table owns and
+variants of the owner (`player_events_big`, `ext_player_events`) are not
+linked. Shortest join paths are computed once per source table and cached,
+so path lookups for prompts, pruning and validation are dictionary reads.
+"""
+
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+_PRIMARY_INDEX_DDL = re.compile(r'PRIMARY\s+INDEX\s+(?P<columns>[\w\s,"]+)', re.IGNORECASE)
+
+
+def primary_index_columns(info: Dict[str, any]) -> Set[str]:
+    """Primary index column names from `primary_index`, else from the DDL"""
+    primary_index = info.get('primary_index')
+    if not primary_index or primary_index == 'Not available':
+        match = _PRIMARY_INDEX_DDL.search(info.get('ddl') or '')
+        primary_index = match.group('columns') if match else ''
+    return {name.strip().strip('"').lower() for name in primary_index.split(',') if name.strip()}
+
+
+# Tables beyond those named in a question that mentioned_tables may add
+MAX_RANKED_TABLES = 3
+
+
+def _is_variant(table: str, other: str) -> bool:
+    """`player_events_big` and `ext_player_events` are copies of `player_events`, not references to it"""
+    return table.startswith(other + '_') or table.endswith('_' + other)
+
+
+def _name_terms(name: str) -> Set[str]:
+    terms = set()
+    for word in re.findall(r'[a-z0-9]+', name.lower()):
+        if word.endswith('ies') and len(word) > 4:
+            word = word[:-3] + 'y'
+        elif word.endswith('s') and not word.endswith('ss') and len(word) > 3:
+            word = word[:-1]
+        terms.add(word)
+    return terms
+
+
+class JoinGraph:
+    """Undirected graph of tables with the column pairs that join them"""
+
+    def __init__(self, schema_info: Optional[Dict[str, Dict]] = None):
+        # table -> neighbour -> [(column in table, column in neighbour)]
+        self.edges: Dict[str, Dict[str, List[Tuple[str, str]]]] = {}
+        # table -> column -> table owning the key it refers to
+        self.references: Dict[str, Dict[str, str]] = {}
+        self._parents: Dict[str, Dict[str, Optional[str]]] = {}
+        # table -> words of its column names, for ranking tables against a question
+        self._column_terms: Dict[str, Set[str]] = {}
+        self._build(schema_info or {})
+
+    def _build(self, schema_info: Dict[str, Dict]):
+        columns = {table.lower(): {col['name'].lower() for col in info.get('columns', [])}
+                   for table, info in schema_info.items()}
+        primary = {table.lower(): primary_index_columns(info) for table, info in schema_info.items()}
+        self.edges = {table: {} for table in columns}
+        self.references = {table: {} for table in columns}
+        self._column_terms = {table: set().union(*map(_name_terms, names)) for table, names in columns.items()}
+
+        # Shared key columns: same `*_id` or primary index column name in both tables, joined to
+        # the table that owns the key (`player_id` in players, else a primary index column) only -
+        # fact tables sharing `player_id` are not joined to each other, and an unowned key
+        # (`session_id` in two event tables) joins nothing
+        by_column: Dict[str, List[str]] = {}
+        for table, names in columns.items():
+            for name in names:
+                if name != 'id' and (name.endswith('_id') or name in primary[table]):
+                    by_column.setdefault(name, []).append(table)
+        for name, tables in by_column.items():
+            base = _name_terms(name[:-3] if name.endswith('_id') else name)
+            owners = ([t for t in tables if _name_terms(t.split('_')[-1]) == base or _name_terms(t) == base]
+                      or [t for t in tables if name in primary[t]])
+            if len(owners) == 1:
+                for table in tables:
+                    if table != owners[0] and not _is_variant(table, owners[0]):
+                        self.references[table][name] = owners[0]
+            for i, left in enumerate(tables):
+                for right in tables[i + 1:]:
+                    if _is_variant(left, right) or _is_variant(right, left):
+                        continue
+                    if left in owners or right in owners:
+                        self._add_edge(left, right, name, name)
+
+        # `player_id` -> players.id / player.id
+        for table, names in columns.items():
+            for name in names:
+                if not name.endswith('_id'):
+                    continue
+                base = name[:-3]
+                for target in (base, base + 's', base + 'es', base[:-1] + 'ies' if base.endswith('y') else None):
+                    if target and target != table and 'id' in columns.get(target, ()):
+                        self._add_edge(table, target, name, 'id')
+                        self.references[table].setdefault(name, target)
+
+        # Deterministic traversal: fewer hops first, then neighbours joined on primary index columns
+        for table, neighbours in self.edges.items():
+            self.edges[table] = dict(sorted(
+                neighbours.items(),
+                key=lambda item: (not any(l in primary[table] or r in primary[item[0]] for l, r in item[1]), item[0])
+            ))
+
+    def _add_edge(self, left: str, right: str, left_column: str, right_column: str):
+        pairs = self.edges[left].setdefault(right, [])
+        if (left_column, right_column) not in pairs:
+            pairs.append((left_column, right_column))
+            self.edges[right].setdefault(left, []).append((right_column, left_column))
+
+    def __contains__(self, table: str) -> bool:
+        return table.lower() in self.edges
+
+    def join_columns(self, left: str, right: str) -> List[Tuple[str, str]]:
+        """Column pairs that join `left` directly to `right` (empty if not adjacent)"""
+        return self.edges.get(left.lower(), {}).get(right.lower(), [])
+
+    def join_path(self, source: str, target: str) -> Optional[List[str]]:
+        """Tables on a minimal (fewest joins) path from `source` to `target`, or None if unconnected"""
+        source, target = source.lower(), target.lower()
+        if source not in self.edges or target not in self.edges:
+            return None
+        parents = self._parents.get(source)
+        if parents is None:
+            parents = self._parents[source] = self._bfs(source)
+        if target not in parents:
+            return None
+        path = [target]
+        while path[-1] != source:
+            path.append(parents[path[-1]])
+        return path[::-1]
+
+    def _bfs(self, source: str) -> Dict[str, Optional[str]]:
+        parents = {source: None}
+        queue = deque([source])
+        while queue:
+            table = queue.popleft()
+            for neighbour in self.edges[table]:
+                if neighbour not in parents:
+                    parents[neighbour] = table
+                    queue.append(neighbour)
+        return parents
+
+    def connect(self, tables: Iterable[str]) -> List[Tuple[str, str]]:
+        """Joins (table pairs) linking all `tables`, growing from the first by shortest paths
+
+        Tables that cannot be reached are left out.
+        """
+        tables = [t.lower() for t in tables if t.lower() in self.edges]
+        if not tables:
+            return []
+        connected, joins = {tables[0]}, []
+        for table in tables[1:]:
+            if table in connected:
+                continue
+            paths = [self.join_path(start, table) for start in sorted(connected)]
+            paths = [path for path in paths if path]
+            if not paths:
+                continue
+            path = min(paths, key=len)
+            for left, right in zip(path, path[1:]):
+                if right not in connected:
+                    joins.append((left, right))
+                    connected.add(right)
+        return joins
+
+    def mentioned_tables(self, question: str) -> List[str]:
+        """Tables the question refers to, named ones first
+
+        A table is named when every word of its name (naively singularised)
+        appears in the question. When fewer than two are named, up to
+        MAX_RANKED_TABLES more are ranked as prompt_budget.rank_tables does:
+        name-word overlap counts three times, column-word overlap once. Words
+        of the named tables and words found in most tables' columns (`player`
+        in `player_id`) are ignored.
+        """
+        terms = _name_terms(question)
+        named = [table for table in self.edges if _name_terms(table) <= terms]
+        if len(named) >= 2:
+            return named
+
+        terms -= set().union(*map(_name_terms, named))
+        terms -= {term for term in terms
+                  if sum(term in words for words in self._column_terms.values()) > len(self._column_terms) / 2}
+
+        def score(table):
+            return 3 * len(_name_terms(table) & terms) + len(self._column_terms[table] & terms)
+
+        ranked = sorted((table for table in self.edges if table not in named and score(table) > 0),
+                        key=score, reverse=True)
+        return named + ranked[:MAX_RANKED_TABLES]
+
+    def hints(self, tables: Iterable[str]) -> str:
+        """JOIN KEYS block for the joins linking `tables`; empty when fewer than two are linked"""
+        lines = []
+        for left, right in self.connect(tables):
+            condition = " AND ".join(f"{left}.{l} = {right}.{r}" for l, r in self.join_columns(left, right))
+            lines.append(f"- {left} JOIN {right} ON {condition}")
+        if not lines:
+            return ""
+        return "JOIN KEYS:\n" + "\n".join(lines)
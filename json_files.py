@@ -0,0 +1,42 @@
+"""
+Process-wide locking and atomic rewrites for the JSON files behind the stores
+Streamlit sessions, reruns and background threads each build their own store
+instances, so the lock for a file is shared per path rather than per instance,
+and every rewrite goes through its own temp file before replacing the original.
+"""
+
+import json
+import os
+import tempfile
+import threading
+from typing import Dict
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def path_lock(path: str) -> threading.Lock:
+    """The lock every reader-modifier-writer of `path` in this process shares"""
+    key = os.path.abspath(path)
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def load_json(path: str, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_json_atomic(path: str, data, indent: int = 1):
+    """Write `data` to a unique temp file next to `path`, then swap it in"""
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
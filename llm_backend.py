@@ -0,0 +1,391 @@
+"""
+Pluggable LLM backends for the NL2SQL converters
+Backends expose the `messages.create` / `messages.stream` surface of the
+Anthropic client. Besides the live client there is a record/replay pair: the
+recorder captures real responses to a JSONL cassette and the replayer serves
+them back deterministically, optionally with simulated latency, so the whole
+Python pipeline can be benchmarked without network access.
+
+Select a backend with NL2SQL_LLM_BACKEND=anthropic|record|replay, the cassette
+with NL2SQL_LLM_CASSETTE and the replay latency with NL2SQL_REPLAY_LATENCY
+(none, recorded, fixed:<ms> or lognormal:<median_ms>:<sigma>).
+
+Converters share one process-wide backend (shared_llm_backend): a single
+Anthropic client with a keep-alive connection pool, pre-connected at startup,
+whose requests are dispatched by an llm_scheduler.LLMScheduler (priorities,
+rate-limit pauses, retries) with at most NL2SQL_LLM_MAX_CONCURRENCY in flight.
+"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import anthropic
+import httpx
+
+from llm_scheduler import LLMScheduler, current_priority
+
+
+DEFAULT_CASSETTE = "llm_cassette.jsonl"
+
+# Request fields that do not change the model's answer
+_UNKEYED_FIELDS = {"timeout", "extra_headers", "metadata"}
+
+# Characters of tool input JSON / text per replayed stream delta
+STREAM_CHUNK_CHARS = 24
+
+# Concurrent Claude requests per process; also the connection pool size
+DEFAULT_MAX_CONCURRENCY = 8
+KEEPALIVE_EXPIRY_S = 120.0
+PRECONNECT_TIMEOUT_S = 5.0
+
+_shared_backends: Dict[tuple, "SharedLLMBackend"] = {}
+_shared_lock = threading.Lock()
+
+
+def request_key(request: Dict[str, any]) -> str:
+    """Stable hash of everything in a request that affects the response"""
+    keyed = {name: value for name, value in request.items() if name not in _UNKEYED_FIELDS}
+    canonical = json.dumps(keyed, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def message_to_dict(message) -> Dict[str, any]:
+    """Serializable form of a Claude message"""
+    if hasattr(message, "model_dump"):
+        return message.model_dump(mode="json")
+    return json.loads(json.dumps(message, default=lambda value: vars(value)))
+
+
+def message_from_dict(data: Dict[str, any]):
+    """Rebuild a message with attribute access; tool inputs stay plain dicts"""
+    return SimpleNamespace(**{
+        **data,
+        "content": [SimpleNamespace(**block) for block in data.get("content", [])],
+        "usage": SimpleNamespace(**(data.get("usage") or {})),
+    })
+
+
+def backend_mode() -> str:
+    return os.getenv('NL2SQL_LLM_BACKEND', 'anthropic').strip().lower()
+
+
+def backend_requires_api_key() -> bool:
+    return backend_mode() != 'replay'
+
+
+def max_concurrency() -> int:
+    return int(os.getenv('NL2SQL_LLM_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY))
+
+
+def create_llm_backend(api_key: Optional[str] = None):
+    """Backend selected by NL2SQL_LLM_BACKEND (live Anthropic client by default)"""
+    mode = backend_mode()
+    cassette = os.getenv('NL2SQL_LLM_CASSETTE', DEFAULT_CASSETTE)
+    if mode == 'replay':
+        return ReplayBackend(cassette, LatencyModel.from_spec(os.getenv('NL2SQL_REPLAY_LATENCY', 'none')))
+    # Retries (and their backoff) are owned by the shared scheduler
+    client = anthropic.Anthropic(api_key=api_key, http_client=_pooled_http_client(), max_retries=0)
+    if mode == 'record':
+        return RecordingBackend(client, cassette)
+    if mode != 'anthropic':
+        raise ValueError(f"Unknown NL2SQL_LLM_BACKEND: {mode} (expected anthropic, record or replay)")
+    return client
+
+
+def _pooled_http_client():
+    """httpx client with the SDK's defaults and a keep-alive pool sized to the concurrency limit"""
+    limits = httpx.Limits(max_connections=max_concurrency(), max_keepalive_connections=max_concurrency(),
+                          keepalive_expiry=KEEPALIVE_EXPIRY_S)
+    return anthropic.DefaultHttpxClient(limits=limits)
+
+
+def shared_llm_backend(api_key: Optional[str] = None) -> "SharedLLMBackend":
+    """Process-wide backend for the current mode and key, created on first use
+
+    Safe to share across threads and Streamlit sessions: the Anthropic client is
+    thread-safe and every request is dispatched through one scheduler.
+    """
+    key = (backend_mode(), api_key)
+    with _shared_lock:
+        backend = _shared_backends.get(key)
+        if backend is None:
+            backend = SharedLLMBackend(create_llm_backend(api_key), max_concurrency())
+            _shared_backends[key] = backend
+    return backend
+
+
+def preconnect_llm_backend(api_key: Optional[str] = None) -> Optional[threading.Thread]:
+    """Open a pooled connection to the API in the background so the first question skips the TLS handshake"""
+    api_key = api_key or os.getenv('ANTHROPIC_API_KEY')
+    if backend_requires_api_key() and not api_key:
+        return None
+    backend = shared_llm_backend(api_key)
+    with _shared_lock:
+        if backend.preconnected:
+            return None
+        backend.preconnected = True
+    thread = threading.Thread(target=backend.preconnect, name="llm-preconnect", daemon=True)
+    thread.start()
+    return thread
+
+
+class SharedLLMBackend:
+    """Dispatches requests through the scheduler; streams hold their slot until closed"""
+
+    def __init__(self, backend, max_concurrent: int = DEFAULT_MAX_CONCURRENCY):
+        self.backend = backend
+        self.scheduler = LLMScheduler(max_concurrent)
+        self.preconnected = False
+        self.messages = SimpleNamespace(create=self._create, stream=self._stream)
+        if hasattr(backend.messages, "batches"):
+            self.messages.batches = backend.messages.batches
+
+    def _create(self, **request):
+        return self.scheduler.run(current_priority(), lambda: self._send(request))
+
+    def _send(self, request: Dict[str, any]):
+        """Create the message, reading rate-limit headers when the client exposes raw responses"""
+        raw_messages = getattr(self.backend.messages, "with_raw_response", None)
+        if raw_messages is None:
+            return self.backend.messages.create(**request)
+        raw = raw_messages.create(**request)
+        self.scheduler.observe_headers(raw.headers)
+        return raw.parse()
+
+    def _stream(self, **request):
+        return _SlotStream(self, request)
+
+    def preconnect(self):
+        """Establish and pool one connection (any HTTP response will do; errors are ignored)"""
+        client = getattr(self.backend, "client", self.backend)
+        http_client = getattr(client, "_client", None)
+        if http_client is None or not hasattr(client, "base_url"):
+            return
+        try:
+            http_client.head(str(client.base_url), timeout=PRECONNECT_TIMEOUT_S)
+        except Exception:
+            pass
+
+
+class _SlotStream:
+    """Stream context manager that holds a scheduler slot from enter to exit
+
+    Errors opening the stream are retried like blocking calls; errors after the
+    first event are not, since part of the response was already consumed.
+    """
+
+    def __init__(self, shared: SharedLLMBackend, request: Dict[str, any]):
+        self.shared = shared
+        self.request = request
+
+    def __enter__(self):
+        scheduler = self.shared.scheduler
+        priority = current_priority()
+        attempt = 0
+        while True:
+            scheduler.acquire(priority)
+            try:
+                self.manager = self.shared.backend.messages.stream(**self.request)
+                stream = self.manager.__enter__()
+            except Exception as e:
+                scheduler.release()
+                delay = scheduler.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            response = getattr(stream, "response", None)
+            scheduler.observe_headers(getattr(response, "headers", None))
+            return stream
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            return self.manager.__exit__(exc_type, exc, traceback)
+        finally:
+            self.shared.scheduler.release()
+
+
+class LatencyModel:
+    """Simulated response latency for replayed calls"""
+
+    def __init__(self, kind: str = "none", median_ms: float = 0.0, sigma: float = 0.0, seed: int = 0):
+        self.kind = kind
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_spec(cls, spec: str) -> "LatencyModel":
+        """Parse `none`, `recorded`, `fixed:<ms>` or `lognormal:<median_ms>:<sigma>`"""
+        parts = spec.strip().lower().split(':')
+        if parts[0] in ('', 'none', 'recorded'):
+            return cls(parts[0] or 'none')
+        if parts[0] == 'fixed' and len(parts) == 2:
+            return cls('fixed', float(parts[1]))
+        if parts[0] == 'lognormal' and len(parts) == 3:
+            return cls('lognormal', float(parts[1]), float(parts[2]))
+        raise ValueError(f"Invalid latency spec: {spec}")
+
+    def sample_ms(self, recorded_ms: float) -> float:
+        if self.kind == 'recorded':
+            return recorded_ms
+        if self.kind == 'fixed':
+            return self.median_ms
+        if self.kind == 'lognormal':
+            with self._lock:
+                return self.median_ms * self._random.lognormvariate(0.0, self.sigma)
+        return 0.0
+
+
+class ReplayMissError(KeyError):
+    """No recorded response matches the request"""
+
+
+class RecordingBackend:
+    """Forward requests to a live client and append every response to a cassette"""
+
+    def __init__(self, client, cassette_path: str = DEFAULT_CASSETTE):
+        self.client = client
+        self.cassette_path = cassette_path
+        self.messages = SimpleNamespace(create=self._create, stream=self._stream)
+        self._lock = threading.Lock()
+
+    def _create(self, **request):
+        start_time = time.perf_counter()
+        message = self.client.messages.create(**request)
+        self._append(request, message, (time.perf_counter() - start_time) * 1000)
+        return message
+
+    def _stream(self, **request):
+        return _RecordingStream(self, request)
+
+    def _append(self, request: Dict[str, any], message, latency_ms: float):
+        entry = {
+            "key": request_key(request),
+            "model": request.get("model"),
+            "latency_ms": latency_ms,
+            "response": message_to_dict(message),
+        }
+        with self._lock, open(self.cassette_path, 'a', encoding='utf-8') as cassette:
+            cassette.write(json.dumps(entry) + "\n")
+
+
+class _RecordingStream:
+    """Wraps a live stream; completed streams are written to the cassette on exit"""
+
+    def __init__(self, backend: RecordingBackend, request: Dict[str, any]):
+        self.backend = backend
+        self.request = request
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        self.manager = self.backend.client.messages.stream(**self.request)
+        self.stream = self.manager.__enter__()
+        self.completed = False
+        return self
+
+    def __iter__(self):
+        for event in self.stream:
+            yield event
+        self.completed = True
+
+    def get_final_message(self):
+        message = self.stream.get_final_message()
+        self.completed = True
+        return message
+
+    @property
+    def current_message_snapshot(self):
+        return self.stream.current_message_snapshot
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            if self.completed and exc_type is None:
+                self.backend._append(self.request, self.stream.get_final_message(),
+                                     (time.perf_counter() - self.start_time) * 1000)
+        finally:
+            suppress = self.manager.__exit__(exc_type, exc, traceback)
+        return suppress
+
+
+class ReplayBackend:
+    """Serve recorded responses keyed by request; repeated requests cycle through recordings"""
+
+    def __init__(self, cassette_path: str = DEFAULT_CASSETTE, latency: Optional[LatencyModel] = None):
+        self.cassette_path = cassette_path
+        self.latency = latency or LatencyModel()
+        self.messages = SimpleNamespace(create=self._create, stream=self._stream)
+        self._recordings: Dict[str, List[Dict[str, any]]] = {}
+        self._next_index: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        with open(cassette_path, encoding='utf-8') as cassette:
+            for line in cassette:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._recordings.setdefault(entry["key"], []).append(entry)
+
+    def _lookup(self, request: Dict[str, any]) -> Dict[str, any]:
+        key = request_key(request)
+        with self._lock:
+            entries = self._recordings.get(key)
+            if not entries:
+                raise ReplayMissError(f"No recorded response for {request.get('model')} request {key[:12]} "
+                                      f"in {self.cassette_path}")
+            index = self._next_index.get(key, 0)
+            self._next_index[key] = index + 1
+        return entries[index % len(entries)]
+
+    def _create(self, **request):
+        entry = self._lookup(request)
+        time.sleep(self.latency.sample_ms(entry["latency_ms"]) / 1000)
+        return message_from_dict(entry["response"])
+
+    def _stream(self, **request):
+        entry = self._lookup(request)
+        return _ReplayStream(entry["response"], self.latency.sample_ms(entry["latency_ms"]))
+
+
+class _ReplayStream:
+    """Replays a recorded message as content_block_delta events spread over the latency"""
+
+    def __init__(self, response: Dict[str, any], latency_ms: float):
+        self.response = response
+        self.latency_ms = latency_ms
+        self.current_message_snapshot = message_from_dict(response)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def __iter__(self):
+        deltas = []
+        for index, block in enumerate(self.response.get("content", [])):
+            if block.get("type") == "tool_use":
+                body, field, delta_type = json.dumps(block.get("input", {})), "partial_json", "input_json_delta"
+            elif block.get("type") == "text":
+                body, field, delta_type = block.get("text", ""), "text", "text_delta"
+            else:
+                continue
+            for start in range(0, len(body), STREAM_CHUNK_CHARS):
+                delta = SimpleNamespace(type=delta_type, **{field: body[start:start + STREAM_CHUNK_CHARS]})
+                deltas.append(SimpleNamespace(type="content_block_delta", index=index, delta=delta))
+
+        pause_s = self.latency_ms / 1000 / max(len(deltas), 1)
+        for event in deltas:
+            if pause_s:
+                time.sleep(pause_s)
+            yield event
+
+    def get_final_message(self):
+        return message_from_dict(self.response)
@@ -0,0 +1,173 @@
+"""
+Shared wrapper for Claude calls with token, cost and latency accounting
+Every request records input, output and cache tokens, latency, model and the
+call site that issued it, aggregated per session and per agent run. The run
+id lives in a context variable, so concurrent runs (or a prefetch thread next
+to a foreground step) each tag their own calls.
+"""
+
+import contextvars
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from llm_scheduler import priority_for_call_site, request_priority
+
+
+# USD per million tokens: (input, output, cache write, cache read)
+MODEL_PRICING = {
+    "claude-3-5-haiku-20241022": (0.80, 4.00, 1.00, 0.08),
+    "claude-3-5-sonnet-20241022": (3.00, 15.00, 3.75, 0.30),
+}
+
+# Message Batches requests are billed at half the standard rates
+BATCH_COST_MULTIPLIER = 0.5
+
+_current_run = contextvars.ContextVar("llm_usage_run", default=None)
+
+USAGE_FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
+
+def usage_from_message(message) -> Dict[str, int]:
+    """Token counts from a Claude message (missing or None fields count as 0)"""
+    usage = getattr(message, "usage", None)
+    return {field: getattr(usage, field, None) or 0 for field in USAGE_FIELDS}
+
+
+def estimate_cost(model: str, usage: Dict[str, int]) -> float:
+    """Cost in USD for one call, 0.0 for models without a price entry"""
+    prices = MODEL_PRICING.get(model)
+    if not prices:
+        return 0.0
+    return sum(usage[field] * price for field, price in zip(USAGE_FIELDS, prices)) / 1_000_000
+
+
+class LLMUsageTracker:
+    """Collects one record per Claude call; summaries can be scoped to an agent run"""
+
+    def __init__(self):
+        self.records: List[Dict[str, any]] = []
+        self.runs: Dict[str, str] = {}
+
+    @property
+    def current_run(self) -> Optional[str]:
+        return _current_run.get()
+
+    def start_run(self, label: str = "") -> str:
+        """Tag subsequent calls in the current context with a new agent run id"""
+        run_id = uuid.uuid4().hex[:8]
+        self.runs[run_id] = label
+        _current_run.set(run_id)
+        return run_id
+
+    def end_run(self):
+        _current_run.set(None)
+
+    @contextmanager
+    def run(self, run_id: Optional[str]):
+        """Tag calls made inside the block (and threads/tasks started from it) with `run_id`"""
+        token = _current_run.set(run_id)
+        try:
+            yield
+        finally:
+            _current_run.reset(token)
+
+    def record(self, call_site: str, model: str, usage: Dict[str, int], latency_ms: float,
+               success: bool = True, error: Optional[str] = None,
+               cost_multiplier: float = 1.0) -> Dict[str, any]:
+        entry = {
+            "call_site": call_site,
+            "model": model,
+            "run_id": _current_run.get(),
+            "latency_ms": latency_ms,
+            "success": success,
+            "error": error,
+            "cost_usd": estimate_cost(model, usage) * cost_multiplier,
+            "timestamp": time.time(),
+            **usage,
+        }
+        self.records.append(entry)
+        return entry
+
+    def summary(self, run_id: Optional[str] = None) -> Dict[str, any]:
+        """Totals plus breakdowns by call site and model, optionally for one run"""
+        records = [r for r in self.records if run_id is None or r["run_id"] == run_id]
+        return {
+            "totals": self._aggregate(records),
+            "by_call_site": self._group(records, "call_site"),
+            "by_model": self._group(records, "model"),
+        }
+
+    def _group(self, records: List[Dict[str, any]], key: str) -> Dict[str, Dict[str, any]]:
+        groups: Dict[str, List[Dict[str, any]]] = {}
+        for record in records:
+            groups.setdefault(record[key], []).append(record)
+        return {name: self._aggregate(group) for name, group in groups.items()}
+
+    def _aggregate(self, records: List[Dict[str, any]]) -> Dict[str, any]:
+        totals = {field: sum(r[field] for r in records) for field in USAGE_FIELDS}
+        totals.update({
+            "calls": len(records),
+            "errors": sum(1 for r in records if not r["success"]),
+            "latency_ms": sum(r["latency_ms"] for r in records),
+            "cost_usd": sum(r["cost_usd"] for r in records),
+        })
+        totals["avg_latency_ms"] = totals["latency_ms"] / len(records) if records else 0.0
+        return totals
+
+
+class LLMClient:
+    """Thin wrapper over an Anthropic client that records every request"""
+
+    def __init__(self, client, tracker: Optional[LLMUsageTracker] = None):
+        self.client = client
+        self.tracker = tracker if tracker is not None else LLMUsageTracker()
+
+    def create(self, call_site: str, **request):
+        """messages.create with accounting; exceptions are recorded and re-raised"""
+        start_time = time.perf_counter()
+        try:
+            with request_priority(priority_for_call_site(call_site)):
+                message = self.client.messages.create(**request)
+        except Exception as e:
+            self._record_failure(call_site, request, start_time, e)
+            raise
+        self.tracker.record(call_site, request["model"], usage_from_message(message),
+                            (time.perf_counter() - start_time) * 1000)
+        return message
+
+    @contextmanager
+    def stream(self, call_site: str, **request):
+        """messages.stream with accounting, including streams abandoned part-way"""
+        start_time = time.perf_counter()
+        try:
+            manager = self.client.messages.stream(**request)
+            with request_priority(priority_for_call_site(call_site)):
+                stream = manager.__enter__()
+        except Exception as e:
+            self._record_failure(call_site, request, start_time, e)
+            raise
+
+        error = None
+        try:
+            yield stream
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.tracker.record(call_site, request["model"], usage_from_message(self._snapshot(stream)),
+                                (time.perf_counter() - start_time) * 1000,
+                                success=error is None, error=str(error) if error else None)
+            manager.__exit__(None, None, None)
+
+    def _snapshot(self, stream):
+        """Message received so far, so cancelled streams still report their input tokens"""
+        try:
+            return stream.current_message_snapshot
+        except Exception:
+            return None
+
+    def _record_failure(self, call_site: str, request: Dict[str, any], start_time: float, error: Exception):
+        self.tracker.record(call_site, request.get("model", ""), dict.fromkeys(USAGE_FIELDS, 0),
+                            (time.perf_counter() - start_time) * 1000, success=False, error=str(error))
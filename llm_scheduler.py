@@ -0,0 +1,253 @@
+"""
+Rate-limit-aware scheduling for Claude requests
+All requests in the process queue for a bounded number of slots by priority -
+interactive NL2SQL first, then agent steps, then batch jobs - with one slot
+held back for interactive work. Rate-limit response headers and 429/529
+errors pause dispatch until the limit resets, and failed requests are retried
+with backoff instead of surfacing as "Claude API error" - but never past a
+deadline set with request_deadline().
+"""
+
+import contextvars
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+INTERACTIVE = 0
+AGENT = 1
+BATCH = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", AGENT: "agent", BATCH: "batch"}
+
+# Call-site prefix -> priority (first match wins); unknown call sites are interactive
+CALL_SITE_PRIORITIES = [
+    ("nl2sql.batch", BATCH),
+    ("agent.", AGENT),
+    ("nl2sql.", INTERACTIVE),
+]
+
+# Slots only interactive requests may use, so bursts of agent/batch work never starve the UI
+RESERVED_INTERACTIVE_SLOTS = 1
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+DEFAULT_MAX_RETRIES = 4
+BASE_BACKOFF_S = 0.5
+MAX_BACKOFF_S = 30.0
+
+# Below this fraction of the request/token limit, only interactive requests are dispatched
+LOW_WATERMARK = 0.1
+
+_RATE_LIMIT_KINDS = ("requests", "tokens", "input-tokens", "output-tokens")
+
+_current_priority = contextvars.ContextVar("llm_request_priority", default=None)
+_current_deadline = contextvars.ContextVar("llm_request_deadline", default=None)
+
+
+class SchedulerDeadlineExceeded(TimeoutError):
+    """A request could not be dispatched before its request_deadline()"""
+
+
+@contextmanager
+def request_priority(priority: int):
+    """Run Claude calls made inside the block at `priority` (overrides the call-site default)"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+@contextmanager
+def request_deadline(seconds: float):
+    """Give Claude calls made inside the block `seconds` to be dispatched and retried
+
+    Queueing stops with SchedulerDeadlineExceeded and retries are not attempted
+    once the deadline would be passed; nested deadlines keep the earlier one.
+    """
+    deadline = time.time() + seconds
+    outer = _current_deadline.get()
+    token = _current_deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _current_deadline.reset(token)
+
+
+def current_priority() -> int:
+    priority = _current_priority.get()
+    return INTERACTIVE if priority is None else priority
+
+
+def priority_for_call_site(call_site: str) -> int:
+    """Explicit request_priority() wins; otherwise the call site's default priority"""
+    explicit = _current_priority.get()
+    if explicit is not None:
+        return explicit
+    for prefix, priority in CALL_SITE_PRIORITIES:
+        if call_site.startswith(prefix):
+            return priority
+    return INTERACTIVE
+
+
+def _reset_time(value: str) -> Optional[float]:
+    """Epoch seconds from an RFC 3339 `anthropic-ratelimit-*-reset` header"""
+    try:
+        reset = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return None
+    if reset.tzinfo is None:
+        reset = reset.replace(tzinfo=timezone.utc)
+    return reset.timestamp()
+
+
+class LLMScheduler:
+    """Priority queue for request slots, with rate-limit pauses and retry/backoff"""
+
+    def __init__(self, max_concurrent: int, max_retries: int = DEFAULT_MAX_RETRIES):
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.active = 0
+        self._queue = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0        # no dispatch at all (hard limit or 429)
+        self._throttled_until = 0.0     # interactive only (close to the limit)
+        self._condition = threading.Condition()
+        self._random = random.Random()
+        self.counters = {"dispatched": 0, "retries": 0, "rate_limited": 0, "wait_ms": 0.0}
+
+    # Slots
+
+    def acquire(self, priority: int):
+        """Block until this request is the highest-priority waiter and may be dispatched"""
+        start_time = time.perf_counter()
+        entry = (priority, next(self._sequence))
+        deadline = _current_deadline.get()
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            while True:
+                wait_s = self._dispatch_delay(priority)
+                if self._queue[0] == entry and wait_s == 0:
+                    break
+                if deadline is not None:
+                    remaining_s = deadline - time.time()
+                    if remaining_s <= 0:
+                        self._queue.remove(entry)
+                        heapq.heapify(self._queue)
+                        self._condition.notify_all()
+                        raise SchedulerDeadlineExceeded("Claude request deadline passed while queued")
+                    wait_s = min(wait_s, remaining_s) if wait_s else remaining_s
+                self._condition.wait(timeout=wait_s or None)
+            heapq.heappop(self._queue)
+            self.active += 1
+            self.counters["dispatched"] += 1
+            self.counters["wait_ms"] += (time.perf_counter() - start_time) * 1000
+            # The next waiter may be dispatchable too
+            self._condition.notify_all()
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, priority: int):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _dispatch_delay(self, priority: int) -> float:
+        """0 when a request at `priority` may start now, else how long to wait before re-checking"""
+        now = time.time()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if priority != INTERACTIVE and now < self._throttled_until:
+            return self._throttled_until - now
+        limit = self.max_concurrent if priority == INTERACTIVE else self.max_concurrent - RESERVED_INTERACTIVE_SLOTS
+        if self.active >= max(1, limit):
+            return 0.5  # woken by release(); the timeout only guards against missed notifies
+        return 0.0
+
+    # Rate limits
+
+    def observe_headers(self, headers):
+        """Pause dispatch from `anthropic-ratelimit-*` headers when a limit is exhausted or close"""
+        if not headers:
+            return
+        for kind in _RATE_LIMIT_KINDS:
+            remaining = headers.get(f"anthropic-ratelimit-{kind}-remaining")
+            limit = headers.get(f"anthropic-ratelimit-{kind}-limit")
+            reset = _reset_time(headers.get(f"anthropic-ratelimit-{kind}-reset"))
+            if remaining is None or reset is None:
+                continue
+            remaining = int(remaining)
+            with self._condition:
+                if remaining <= 0:
+                    self._paused_until = max(self._paused_until, reset)
+                elif limit and remaining < int(limit) * LOW_WATERMARK:
+                    self._throttled_until = max(self._throttled_until, reset)
+
+    def retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying `error`, or None if it should not be retried
+
+        Not retried when the wait would run past the caller's request_deadline().
+        """
+        status = getattr(error, "status_code", None)
+        retryable = status in RETRYABLE_STATUS or type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+        if not retryable or attempt >= self.max_retries:
+            return None
+
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        self.observe_headers(headers)
+        try:
+            delay = float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            delay = min(MAX_BACKOFF_S, BASE_BACKOFF_S * 2 ** attempt) * (0.5 + self._random.random() / 2)
+
+        deadline = _current_deadline.get()
+        with self._condition:
+            if status in (429, 529):
+                # Account-wide limit: hold every queued request, not just this one
+                self.counters["rate_limited"] += 1
+                self._paused_until = max(self._paused_until, time.time() + delay)
+            if deadline is not None and time.time() + delay >= deadline:
+                return None
+            self.counters["retries"] += 1
+        return delay
+
+    def run(self, priority: int, call: Callable[[], any]):
+        """Run `call` in a slot, retrying retryable errors with backoff"""
+        attempt = 0
+        while True:
+            try:
+                with self.slot(priority):
+                    return call()
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+
+    def stats(self) -> Dict[str, any]:
+        """Queue depth per priority, active requests, pause state and counters"""
+        with self._condition:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _ in self._queue:
+                depth[PRIORITY_NAMES.get(priority, str(priority))] += 1
+            now = time.time()
+            return {
+                "queue_depth": depth,
+                "queued": len(self._queue),
+                "active": self.active,
+                "max_concurrent": self.max_concurrent,
+                "paused_s": max(0.0, self._paused_until - now),
+                "throttled_s": max(0.0, self._throttled_until - now),
+                **self.counters,
+            }
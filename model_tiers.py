@@ -0,0 +1,101 @@
+"""
+Model tier ladder for Claude calls
+Questions go to a small, fast model first and escalate to a larger one only when
+the answer has low confidence, fails local validation or fails on the engine
+"""
+
+import os
+from typing import Dict, List, Optional
+
+
+# Smallest/fastest first; override with NL2SQL_MODEL_TIERS="model-a,model-b,..."
+DEFAULT_MODEL_TIERS = [
+    "claude-3-5-haiku-20241022",
+    "claude-3-5-sonnet-20241022",
+]
+
+# Answers below this confidence are retried on the next tier
+DEFAULT_MIN_CONFIDENCE = 0.7
+
+
+def load_model_tiers() -> List[str]:
+    """Tier ladder from the environment, falling back to the defaults"""
+    configured = os.getenv('NL2SQL_MODEL_TIERS', '')
+    tiers = [model.strip() for model in configured.split(',') if model.strip()]
+    return tiers or list(DEFAULT_MODEL_TIERS)
+
+
+class ModelTierLadder:
+    """Ordered model tiers with escalation rules and per-tier latency / hit-rate stats"""
+
+    def __init__(self, models: Optional[List[str]] = None, min_confidence: Optional[float] = None,
+                 stats: Optional[Dict[str, Dict]] = None):
+        self.models = models or load_model_tiers()
+        self.min_confidence = (min_confidence if min_confidence is not None
+                               else float(os.getenv('NL2SQL_MIN_CONFIDENCE', DEFAULT_MIN_CONFIDENCE)))
+        # Callers may pass a long-lived stats dict to accumulate across instances
+        self.stats = stats if stats is not None else self.new_stats()
+
+    @staticmethod
+    def new_stats() -> Dict[str, Dict]:
+        return {}
+
+    @property
+    def top_model(self) -> str:
+        return self.models[-1]
+
+    def next_model(self, model: Optional[str]) -> str:
+        """Tier above `model`, or the top tier when unknown or already at the top"""
+        if model in self.models:
+            return self.models[min(self.models.index(model) + 1, len(self.models) - 1)]
+        return self.top_model
+
+    def escalation_reason(self, result: Dict[str, any], confidence_key: str = "confidence") -> Optional[str]:
+        """Why a tier's answer should be retried on a larger model, or None to accept it"""
+        if not result.get("success", True):
+            return "generation_failed"
+        confidence = result.get(confidence_key)
+        if isinstance(confidence, (int, float)) and confidence < self.min_confidence:
+            return "low_confidence"
+        validation = result.get("validation")
+        if validation and not validation["valid"]:
+            return "validation_failed"
+        return None
+
+    def record(self, model: str, latency_ms: float, escalation_reason: Optional[str] = None):
+        """Record one call on a tier and whether its answer was accepted"""
+        tier = self._tier_stats(model)
+        tier["calls"] += 1
+        tier["total_latency_ms"] += latency_ms
+        if escalation_reason:
+            tier["escalations"][escalation_reason] = tier["escalations"].get(escalation_reason, 0) + 1
+        else:
+            tier["accepted"] += 1
+
+    def record_escalation(self, model: str, reason: str):
+        """Mark an accepted answer as escalated after the fact (e.g. it failed on the engine)"""
+        tier = self._tier_stats(model)
+        tier["accepted"] = max(0, tier["accepted"] - 1)
+        tier["escalations"][reason] = tier["escalations"].get(reason, 0) + 1
+
+    def get_stats(self) -> List[Dict[str, any]]:
+        """Per-tier calls, hit rate (answers accepted at that tier) and average latency"""
+        report = []
+        for model in self.models:
+            tier = self.stats.get(model)
+            if not tier:
+                continue
+            report.append({
+                "model": model,
+                "calls": tier["calls"],
+                "accepted": tier["accepted"],
+                "hit_rate": tier["accepted"] / tier["calls"] if tier["calls"] else 0.0,
+                "avg_latency_ms": tier["total_latency_ms"] / tier["calls"] if tier["calls"] else 0.0,
+                "escalations": dict(tier["escalations"]),
+            })
+        return report
+
+    def _tier_stats(self, model: str) -> Dict[str, any]:
+        if model not in self.stats:
+            self.stats[model] = {"calls": 0, "accepted": 0, "total_latency_ms": 0.0, "escalations": {}}
+        return self.stats[model]
@@ -4,30 +4,94 @@ Specifically designed for AdTech analytics on the ad_performance table
 """
 
 import os
-import anthropic
-from typing import Dict, List, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
 import json
-import re
+
+from response_parser import (
+    DEFAULT_EXPLANATION, StreamingSQLExtractor, extract_tool_input, message_text, parse_sql_response
+)
+from column_profiler import format_value_hints
+from example_store import ExampleStore
+from llm_backend import backend_requires_api_key, shared_llm_backend
+from llm_calls import LLMClient, LLMUsageTracker
+from model_tiers import ModelTierLadder
+from prompt_budget import PromptBudget, PromptBudgetExceeded
+from schema_format import compact_schema, default_schema_format
+from sql_templates import SQLTemplateEngine
+from sql_validator import SQLValidator
+
+# Structured output tool: Claude fills this schema instead of writing free-form JSON.
+# `sql` is listed first so it streams before the explanation and confidence.
+SQL_TOOL = {
+    "name": "submit_sql",
+    "description": "Submit the Firebolt SQL query that answers the user's question",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "sql": {"type": "string", "description": "Read-only Firebolt SQL query starting with SELECT or WITH"},
+            "explanation": {"type": "string", "description": "Brief description, under 100 characters"},
+            "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+            "assumptions": {"type": "array", "items": {"type": "string"}}
+        },
+        "required": ["sql", "explanation", "confidence"]
+    }
+}
+
+GENERATION_SYSTEM_PROMPT = "You are a Firebolt SQL expert specializing in business analytics. Generate valid Firebolt SQL with proper JOINs and aggregations."
+REPAIR_SYSTEM_PROMPT = "You are a Firebolt SQL expert who fixes failing queries with minimal changes."
+
+# Variants used for parallel candidate generation: spread temperature and
+# steer each candidate towards a different way of writing the query
+CANDIDATE_VARIANTS = [
+    {"temperature": 0.0, "hint": ""},
+    {"temperature": 0.4, "hint": "Prefer CTEs (WITH ...) to break the query into clear steps."},
+    {"temperature": 0.7, "hint": "Cast numeric aggregates to DOUBLE and guard every division with NULLIF."},
+    {"temperature": 0.3, "hint": "Prefer simple JOINs and subqueries over window functions where possible."},
+    {"temperature": 1.0, "hint": ""},
+]
 
 
 class NL2SQLConverter:
     """Convert natural language questions to SQL queries for AdTech data"""
     
-    def __init__(self, api_key: Optional[str] = None, schema_context: Optional[str] = None):
-        """Initialize the NL2SQL converter with Claude API key and optional schema context"""
+    def __init__(self, api_key: Optional[str] = None, schema_context: Optional[str] = None,
+                 schema_info: Optional[Dict[str, Dict]] = None, use_templates: bool = True,
+                 model_tiers: Optional[List[str]] = None, usage_tracker: Optional[LLMUsageTracker] = None,
+                 backend=None, example_store: Optional[ExampleStore] = None,
+                 prompt_budgets: Optional[Dict[str, int]] = None,
+                 column_stats: Optional[Dict[str, Dict[str, Dict]]] = None,
+                 schema_format: Optional[str] = None):
+        """Initialize the NL2SQL converter with Claude API key and optional schema context
+        
+        `backend` replaces the Anthropic client with any object exposing the same
+        `messages` API (e.g. llm_backend.ReplayBackend); by default the backend is
+        chosen by NL2SQL_LLM_BACKEND. `example_store` supplies few-shot examples;
+        without one, the built-in AdTech examples are used for the default schema only.
+        `prompt_budgets` overrides the per-call-site input token budgets.
+        `column_stats` (from column_profiler) adds value hints to prompts and
+        literal checks to validation. `schema_format` ("verbose" or "compact",
+        default NL2SQL_SCHEMA_FORMAT) picks how the schema is written into
+        prompts; the generate methods can override it per call.
+        """
         # Try multiple sources for API key (no hardcoded fallback)
         self.api_key = api_key or os.getenv('ANTHROPIC_API_KEY')
         
-        if not self.api_key:
+        if not self.api_key and backend is None and backend_requires_api_key():
             raise ValueError("ANTHROPIC_API_KEY must be provided via environment variable or api_key parameter")
         
-        # Initialize Claude client
+        # Process-wide Claude client: pooled connections shared by every converter and session
         try:
-            self.client = anthropic.Anthropic(api_key=self.api_key)
+            self.client = backend or shared_llm_backend(self.api_key)
         except Exception as e:
             print(f"Error initializing Claude client: {e}")
             raise
         
+        # Every request goes through the accounting wrapper
+        self.llm = LLMClient(self.client, usage_tracker)
+        
         # Dynamic schema context (from user's database)
         self.schema_context = schema_context
         
@@ -74,16 +138,6 @@ class NL2SQLConverter:
                 "country": "TEXT - Country code",
                 "region": "TEXT - Region/state",
                 "city": "TEXT - City name"
-            },
-            "sample_data": {
-                "total_rows": "1,000,000 rows",
-                "date_range": "Recent AdTech performance data",
-                "common_values": {
-                    "event_type": ["impression", "click", "conversion"],
-                    "device_type": ["mobile", "desktop", "tablet"],
-                    "countries": ["US", "GB", "DE", "FR", "CA", "AU", "BR", "JP"],
-                    "campaign_types": ["display", "search", "social", "video"]
-                }
             }
         }
         
@@ -110,79 +164,447 @@ class NL2SQLConverter:
                 "sql": "SELECT event_date, SUM(revenue) as daily_revenue FROM ad_performance WHERE event_type = 'conversion' AND event_date >= CURRENT_DATE - INTERVAL '7' DAY GROUP BY event_date ORDER BY event_date"
             }
         ]
+        
+        # Few-shot examples retrieved per question (AdTech seeds only fit the default table)
+        self.example_store = example_store or ExampleStore(seed=self.example_queries if schema_info is None else None)
+        
+        # Deterministic fast path for template-matchable questions
+        schema_info = schema_info or self._default_schema_info()
+        self.use_templates = use_templates
+        self.template_engine = SQLTemplateEngine(schema_info)
+        
+        # Offline schema-aware validation, so bad identifiers never reach the engine
+        self.column_stats = column_stats or {}
+        self.validator = SQLValidator(schema_info, self.column_stats)
+        
+        # Small model first, escalating on low confidence or failed validation
+        self.tier_ladder = ModelTierLadder(model_tiers)
+        
+        # Prompts are measured and trimmed to their call site's budget before sending
+        self.prompt_budget = PromptBudget(prompt_budgets)
+        self.schema_format = schema_format or default_schema_format()
     
-    def update_schema_context(self, schema_context: str):
+    def update_schema_context(self, schema_context: str, schema_info: Optional[Dict[str, Dict]] = None):
         """Update the schema context for the user's connected database"""
         self.schema_context = schema_context
+        if schema_info is not None:
+            self.template_engine.update_schema(schema_info)
+            self.validator.update_schema(schema_info)
+    
+    def update_column_stats(self, column_stats: Dict[str, Dict[str, Dict]]):
+        """Use newly profiled column stats for value hints and literal checks"""
+        self.column_stats = column_stats
+        self.validator.update_column_stats(column_stats)
     
-    def generate_sql(self, natural_language_query: str) -> Dict[str, any]:
+    def generate_sql(self, natural_language_query: str, schema_format: Optional[str] = None) -> Dict[str, any]:
         """
         Convert natural language query to SQL
         
         Args:
             natural_language_query: User's question in natural language
+            schema_format: "verbose" or "compact" for this call (default: the converter's)
             
         Returns:
             Dictionary with SQL query, explanation, and metadata
         """
+        template_result = self._match_template(natural_language_query)
+        if template_result:
+            return template_result
+        
         try:
-            # Construct the prompt for OpenAI
-            prompt = self._build_prompt(natural_language_query)
+            prompt, budget_report = self._build_prompt(natural_language_query, "nl2sql.generate", schema_format)
+        except PromptBudgetExceeded as e:
+            return self._prompt_budget_error_result(e)
+        
+        escalations = []
+        for model in self.tier_ladder.models:
+            tier_start = time.perf_counter()
+            try:
+                response = self.llm.create("nl2sql.generate", **self._build_request(prompt, model))
+                result = self._response_to_result(response, natural_language_query)
+            except Exception as e:
+                result = self._api_error_result(e)
             
-            # Call Claude API with parameters optimized for complex queries
-            response = self.client.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=1000,  # Increased for complex business queries
-                temperature=0.1,  # Slight creativity for complex queries
-                system="You are a Firebolt SQL expert specializing in business analytics. Generate valid Firebolt SQL with proper JOINs and aggregations. Always respond with valid JSON only.",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            )
+            if self._accept_tier(result, model, tier_start, escalations):
+                result["prompt_budget"] = budget_report
+                return result
+    
+    def generate_sql_candidates(self, natural_language_query: str, num_candidates: int = 3,
+                                dry_run: Optional[Callable[[str], any]] = None,
+                                schema_format: Optional[str] = None) -> Dict[str, any]:
+        """
+        Generate several SQL candidates concurrently and return the first one that passes
+        
+        Each candidate uses a different temperature / prompt variant, is validated
+        offline against the schema and, if `dry_run` is given, checked with it
+        (e.g. an EXPLAIN on the engine). The first passing candidate wins and the
+        remaining in-flight generations are cancelled. Trades token spend for
+        lower tail latency on hard questions.
+        
+        Args:
+            natural_language_query: User's question in natural language
+            num_candidates: Number of concurrent candidates (at most len(CANDIDATE_VARIANTS))
+            dry_run: Optional callable that raises if the SQL would fail on the engine
+            schema_format: "verbose" or "compact" for this call (default: the converter's)
+            
+        Returns:
+            Same dictionary as generate_sql, plus `candidates` (per-candidate outcome),
+            `candidate_index` and `time_to_valid_ms`
+        """
+        template_result = self._match_template(natural_language_query)
+        if template_result:
+            return template_result
+        
+        try:
+            prompt, budget_report = self._build_prompt(natural_language_query, "nl2sql.candidate", schema_format)
+        except PromptBudgetExceeded as e:
+            return self._prompt_budget_error_result(e)
+        
+        start_time = time.perf_counter()
+        cancelled = threading.Event()
+        variants = CANDIDATE_VARIANTS[:max(1, num_candidates)]
+        candidates = []
+        results = []
+        winner = None
+        
+        executor = ThreadPoolExecutor(max_workers=len(variants))
+        futures = {
+            executor.submit(self._generate_candidate, natural_language_query, prompt, variant,
+                            cancelled, dry_run, start_time): index
+            for index, variant in enumerate(variants)
+        }
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                candidates.append({
+                    "index": futures[future],
+                    "temperature": variants[futures[future]]["temperature"],
+                    "status": result["candidate_status"],
+                    "error": result.get("error"),
+                    "latency_ms": result["latency_ms"]
+                })
+                if result["candidate_status"] == "passed":
+                    winner = result
+                    winner["candidate_index"] = futures[future]
+                    break
+        finally:
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        if winner:
+            winner.update({"candidates": candidates, "time_to_valid_ms": elapsed_ms, "prompt_budget": budget_report})
+            return winner
+        
+        # Keep the first SQL that was generated so callers can still repair it
+        fallback = next((result for result in results if result.get("sql")), {})
+        return {
+            "success": False,
+            "error": "No SQL candidate passed validation: " + "; ".join(
+                f"#{c['index']} {c['status']}: {c['error']}" for c in candidates),
+            "sql": fallback.get("sql"),
+            "explanation": fallback.get("explanation"),
+            "confidence": 0,
+            "candidates": candidates,
+            "time_to_valid_ms": None,
+            "total_time_ms": elapsed_ms
+        }
+    
+    def _generate_candidate(self, natural_language_query: str, prompt: str, variant: Dict[str, any],
+                            cancelled: threading.Event, dry_run: Optional[Callable[[str], any]],
+                            start_time: float) -> Dict[str, any]:
+        """Generate and check one candidate, aborting the stream if another candidate already won"""
+        request = self._build_request(prompt, self.tier_ladder.top_model)
+        request["temperature"] = variant["temperature"]
+        if variant["hint"]:
+            request["messages"][0]["content"] += f"\n\nSTYLE: {variant['hint']}"
+        
+        def finish(result, status):
+            result["candidate_status"] = status
+            result["latency_ms"] = (time.perf_counter() - start_time) * 1000
+            return result
+        
+        try:
+            with self.llm.stream("nl2sql.candidate", **request) as stream:
+                for _ in stream:
+                    if cancelled.is_set():
+                        # Leaving the context manager closes the HTTP response
+                        return finish({"success": False, "error": "cancelled"}, "cancelled")
+                message = stream.get_final_message()
+        except Exception as e:
+            return finish({"success": False, "error": f"Claude API error: {str(e)}"}, "generation_failed")
+        
+        result = self._response_to_result(message, natural_language_query)
+        if not result["success"]:
+            return finish(result, "generation_failed")
+        if not result["validation"]["valid"]:
+            result["error"] = "; ".join(result["validation"]["errors"])
+            return finish(result, "invalid")
+        
+        if dry_run and not cancelled.is_set():
+            try:
+                dry_run(result["sql"])
+            except Exception as e:
+                result["error"] = str(e)
+                return finish(result, "dry_run_failed")
+        return finish(result, "passed")
+    
+    def generate_sql_stream(self, natural_language_query: str,
+                            on_sql: Optional[Callable[[str, float], None]] = None,
+                            schema_format: Optional[str] = None) -> Dict[str, any]:
+        """
+        Convert natural language query to SQL, streaming the completion
+        
+        The `sql` field is extracted as soon as its JSON string closes, and
+        `on_sql(sql, elapsed_ms)` is invoked right away so the caller can show
+        or execute the query while the explanation and confidence still stream.
+        If the answer escalates to a larger model tier, `on_sql` is invoked again
+        with that tier's SQL; callers should act on the final `sql` in the result.
+        
+        Args:
+            natural_language_query: User's question in natural language
+            on_sql: Optional callback receiving the early SQL and time-to-SQL in ms
+            schema_format: "verbose" or "compact" for this call (default: the converter's)
             
-            # Parse the response
-            response_content = response.content[0].text.strip()
-            return self._parse_claude_response(response_content, natural_language_query)
+        Returns:
+            Same dictionary as generate_sql, plus `time_to_sql_ms` and `total_time_ms`
+        """
+        start_time = time.perf_counter()
+        time_to_sql_ms = None
+        
+        template_result = self._match_template(natural_language_query)
+        if template_result:
+            template_result["time_to_sql_ms"] = template_result["total_time_ms"] = (time.perf_counter() - start_time) * 1000
+            if on_sql:
+                on_sql(template_result["sql"], template_result["time_to_sql_ms"])
+            return template_result
+        
+        try:
+            prompt, budget_report = self._build_prompt(natural_language_query, "nl2sql.stream", schema_format)
+        except PromptBudgetExceeded as e:
+            return self._prompt_budget_error_result(e)
+        
+        escalations = []
+        for model in self.tier_ladder.models:
+            tier_start = time.perf_counter()
+            extractor = StreamingSQLExtractor()
+            sql_reported = False
+            try:
+                with self.llm.stream("nl2sql.stream", **self._build_request(prompt, model)) as stream:
+                    for event in stream:
+                        if event.type != "content_block_delta":
+                            continue
+                        # Tool input arrives as partial JSON; plain text only if the model skipped the tool
+                        delta = event.delta
+                        sql = extractor.feed(getattr(delta, "partial_json", None) or getattr(delta, "text", None) or "")
+                        if sql is not None and not sql_reported:
+                            sql_reported = True
+                            time_to_sql_ms = (time.perf_counter() - start_time) * 1000
+                            if on_sql:
+                                on_sql(sql, time_to_sql_ms)
+                    
+                    result = self._response_to_result(stream.get_final_message(), natural_language_query)
+                
+            except Exception as e:
+                result = self._api_error_result(e)
             
+            if self._accept_tier(result, model, tier_start, escalations):
+                break
+        
+        result["time_to_sql_ms"] = time_to_sql_ms
+        result["total_time_ms"] = (time.perf_counter() - start_time) * 1000
+        result["prompt_budget"] = budget_report
+        return result
+    
+    def repair_sql(self, original_question: str, failed_sql: str, error: Dict[str, str],
+                   schema_slice: str, timeout: Optional[float] = None, model: Optional[str] = None) -> Dict[str, any]:
+        """
+        Fix SQL rejected by the validator or by Firebolt with one small, targeted call
+        
+        Only the failed SQL, the classified error and the relevant schema slice are
+        sent, so a repair costs far fewer tokens than a fresh generation.
+        
+        Args:
+            original_question: The user's question the SQL should answer
+            failed_sql: The SQL that failed
+            error: Classified error from sql_repair.classify_sql_error
+            schema_slice: Tables and columns relevant to the failed SQL
+            timeout: Optional request timeout in seconds
+            model: Model tier to repair with (defaults to the top tier)
+        """
+        model = model or self.tier_ladder.top_model
+        try:
+            request, budget_report = self._build_repair_request(original_question, failed_sql, error, schema_slice, model)
+        except PromptBudgetExceeded as e:
+            return self._prompt_budget_error_result(e)
+        if timeout is not None:
+            request["timeout"] = timeout
+        
+        start_time = time.perf_counter()
+        try:
+            response = self.llm.create("nl2sql.repair", **request)
+            result = self._response_to_result(response, original_question)
         except Exception as e:
-            return {
-                "success": False,
-                "error": f"Claude API error: {str(e)}",
-                "sql": None,
-                "explanation": None,
-                "confidence": 0
+            return self._api_error_result(e)
+        
+        self.tier_ladder.record(model, (time.perf_counter() - start_time) * 1000,
+                                None if result["success"] else "generation_failed")
+        result["model"] = model
+        result["prompt_budget"] = budget_report
+        if result["success"]:
+            result["source"] = "repair"
+        return result
+    
+    def _accept_tier(self, result: Dict[str, any], model: str, tier_start: float,
+                     escalations: List[Dict[str, any]]) -> bool:
+        """Record a tier's answer; False means it should be retried on the next tier"""
+        latency_ms = (time.perf_counter() - tier_start) * 1000
+        reason = self.tier_ladder.escalation_reason(result)
+        self.tier_ladder.record(model, latency_ms, reason)
+        
+        result["model"] = model
+        result["escalations"] = list(escalations)
+        if reason and model != self.tier_ladder.top_model:
+            escalations.append({"model": model, "reason": reason, "latency_ms": latency_ms})
+            return False
+        return True
+    
+    def _api_error_result(self, error: Exception) -> Dict[str, any]:
+        return {
+            "success": False,
+            "error": f"Claude API error: {str(error)}",
+            "sql": None,
+            "explanation": None,
+            "confidence": 0
+        }
+    
+    def _prompt_budget_error_result(self, error: PromptBudgetExceeded) -> Dict[str, any]:
+        return {
+            "success": False,
+            "error": f"Prompt too large: {str(error)}",
+            "sql": None,
+            "explanation": None,
+            "confidence": 0
+        }
+    
+    def _match_template(self, natural_language_query: str) -> Optional[Dict[str, any]]:
+        """Answer the question locally when a deterministic template applies"""
+        if not self.use_templates:
+            return None
+        
+        match = self.template_engine.match(natural_language_query)
+        if not match:
+            return None
+        
+        return {
+            "success": True,
+            "sql": match["sql"],
+            "explanation": match["explanation"],
+            "confidence": 1.0,
+            "assumptions": [],
+            "original_question": natural_language_query,
+            "source": "template",
+            "template": match["template"],
+            "match_time_us": match["match_time_us"],
+            "validation": self.validator.validate(match["sql"])
+        }
+    
+    def _default_schema_info(self) -> Dict[str, Dict]:
+        """Expose the default AdTech table in the discovered-schema shape"""
+        return {
+            self.table_schema["table_name"]: {
+                "type": "TABLE",
+                "columns": [
+                    {"name": name, "type": description.split(" - ")[0]}
+                    for name, description in self.table_schema["columns"].items()
+                ]
             }
+        }
+    
+    def _build_request(self, prompt: str, model: str) -> Dict[str, any]:
+        """Build the Claude messages request shared by the blocking and streaming paths"""
+        return {
+            "model": model,
+            "max_tokens": 1000,  # Increased for complex business queries
+            "temperature": 0.1,  # Slight creativity for complex queries
+            "system": GENERATION_SYSTEM_PROMPT,
+            "tools": [SQL_TOOL],
+            "tool_choice": {"type": "tool", "name": SQL_TOOL["name"]},
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+        }
+    
+    def _build_repair_request(self, original_question: str, failed_sql: str,
+                              error: Dict[str, str], schema_slice: str, model: str):
+        """Build a compact repair request (failed SQL, classified error and schema slice) and its budget report"""
+        def render(examples, schema):
+            return f"""This Firebolt SQL failed. Fix it so it answers the question.
+
+QUESTION: {original_question}
+
+FAILED SQL:
+{failed_sql}
+
+ERROR ({error['category']}): {error['message']}
+HINT: {error['hint']}
+
+RELEVANT SCHEMA:
+{schema}
+
+Submit the corrected query with the submit_sql tool."""
+        
+        prompt, budget_report = self.prompt_budget.fit(
+            "nl2sql.repair", render, schema=schema_slice, question=original_question,
+            overhead=REPAIR_SYSTEM_PROMPT + json.dumps(SQL_TOOL)
+        )
+        return {
+            "model": model,
+            "max_tokens": 600,
+            "temperature": 0,
+            "system": REPAIR_SYSTEM_PROMPT,
+            "tools": [SQL_TOOL],
+            "tool_choice": {"type": "tool", "name": SQL_TOOL["name"]},
+            "messages": [{"role": "user", "content": prompt}]
+        }, budget_report
     
-    def _build_prompt(self, user_question: str) -> str:
-        """Build the prompt for Claude with schema and examples"""
+    def _build_prompt(self, user_question: str, call_site: str, schema_format: Optional[str] = None):
+        """Build the prompt for Claude with schema and examples, trimmed to the call site's budget
         
-        # Use dynamic schema if available, otherwise use default
-        if self.schema_context:
+        Returns the prompt and the budget report (size, schema format and any
+        trimming applied); raises PromptBudgetExceeded if it cannot be made to fit.
+        """
+        schema_format = schema_format or self.schema_format
+        join_graph = self.validator.join_graph
+        if schema_format == "compact":
+            # Key references are inline, so no separate join hints
+            schema_text = compact_schema(self.validator.schema_info, join_graph)
+        elif self.schema_context:
+            # Use dynamic schema if available, otherwise use default
             schema_text = self.schema_context
         else:
             schema_text = self._format_default_schema()
-            
-        # Get first table name for example (or default to ad_performance)
-        first_table = "your_table"
-        if self.schema_context and "##" in self.schema_context:
-            # Try to extract first table name from schema context
-            lines = self.schema_context.split('\n')
-            for line in lines:
-                if line.startswith('## ') and '(' in line:
-                    first_table = line.split('## ')[1].split(' (')[0].strip()
-                    break
-        elif not self.schema_context:
-            first_table = "ad_performance"
         
-        prompt = f"""
+        # Profiled values and join keys for the tables this question touches; trimmed along with descriptions
+        hints = [format_value_hints(self.column_stats, user_question)]
+        if schema_format != "compact":
+            hints.append(join_graph.hints(join_graph.mentioned_tables(user_question)))
+        hints = "\n\n".join(hint for hint in hints if hint)
+        if hints:
+            schema_text = f"{schema_text.rstrip()}\n\n{hints}"
+        
+        def render(examples, schema):
+            examples_text = f"\nVERIFIED EXAMPLES:\n{examples}\n" if examples else ""
+            return f"""
 You are a Firebolt SQL expert. Convert this natural language question into a SQL query using the provided database schema.
 
 DATABASE SCHEMA:
-{schema_text}
-
+{schema}
+{examples_text}
 RULES:
 - Use only tables/columns from the schema above
 - Generate valid Firebolt SQL syntax
@@ -191,15 +613,15 @@ RULES:
 
 USER QUESTION: {user_question}
 
-CRITICAL: Respond with ONLY valid JSON format. Follow these rules strictly:
-- Keep explanations SHORT (under 100 characters)
-- Use \\n for newlines in SQL, not actual newlines
-- Escape any quotes in strings with \\"
-- No line breaks within the JSON structure
-
-Use this EXACT format:
-{{"sql": "SELECT columns FROM tables WHERE conditions", "explanation": "Brief description", "confidence": 0.95}}"""
-        return prompt
+Submit the query with the submit_sql tool."""
+        
+        prompt, budget_report = self.prompt_budget.fit(
+            call_site, render, examples=self._format_examples(user_question), schema=schema_text,
+            question=user_question, overhead=GENERATION_SYSTEM_PROMPT + json.dumps(SQL_TOOL),
+            join_graph=join_graph
+        )
+        budget_report["schema_format"] = schema_format
+        return prompt, budget_report
     
     def _format_default_schema(self) -> str:
         """Format the default table schema for the prompt"""
@@ -212,152 +634,42 @@ Use this EXACT format:
         
         return "\n".join(schema_lines)
     
-    def _format_examples(self) -> str:
-        """Format example queries for the prompt"""
+    def _format_examples(self, user_question: str) -> str:
+        """Format the verified examples most similar to the question"""
         examples = []
-        for i, example in enumerate(self.example_queries, 1):
+        selected = self.example_store.select(user_question, available_tables=self.validator.schema_info.keys())
+        for i, example in enumerate(selected, 1):
             examples.append(f"{i}. Q: {example['question']}")
             examples.append(f"   A: {example['sql']}")
         
         return "\n".join(examples)
     
+    def _response_to_result(self, message, original_question: str) -> Dict[str, any]:
+        """Build the result from the structured tool input, parsing text only if no tool was used"""
+        tool_input = extract_tool_input(message, SQL_TOOL["name"])
+        if tool_input is None:
+            return self._parse_claude_response(message_text(message), original_question)
+        
+        tool_input["strategy"] = "tool_use"
+        return self._build_sql_result(tool_input, original_question, json.dumps(tool_input))
+    
     def _parse_claude_response(self, response_content: str, original_question: str) -> Dict[str, any]:
-        """Parse Claude response with robust JSON parsing for complex queries"""
+        """Parse a free-text Claude response with a linear-time tolerant parser"""
+        try:
+            parsed = parse_sql_response(response_content)
+        except ValueError as e:
+            return self._format_error_result(e, response_content, original_question)
+        return self._build_sql_result(parsed, original_question, response_content)
+    
+    def _build_sql_result(self, parsed: Dict[str, any], original_question: str, response_content: str) -> Dict[str, any]:
+        """Check the generated SQL is a read-only analytical query and build the result"""
         try:
-            # Clean response content
-            content = response_content.strip()
-            
-            # Remove any markdown code blocks if present
-            if content.startswith("```"):
-                lines = content.split('\n')
-                content = '\n'.join(lines[1:-1]) if len(lines) > 2 else content
-                content = content.strip()
-            
-            # Ensure we have JSON format
-            if not content.startswith("{"):
-                # Find JSON in response
-                start = content.find("{")
-                if start != -1:
-                    end = content.rfind("}") + 1
-                    content = content[start:end]
-                else:
-                    raise ValueError("No JSON found in response")
-            
-            # Parse JSON with multiple fallback strategies
-            parsed = None
-            
-            # Strategy 1: Direct JSON parsing
-            try:
-                parsed = json.loads(content)
-            except json.JSONDecodeError as json_error:
-                
-                # Strategy 2: Fix common escaping issues
-                try:
-                    # Escape unescaped quotes and newlines more carefully
-                    fixed_content = content
-                    # Fix newlines in strings
-                    fixed_content = re.sub(r'(?<!\\)\n', '\\n', fixed_content)
-                    # Fix unescaped quotes in values (but not structure quotes)
-                    fixed_content = re.sub(r':\s*"([^"]*)"([^"]*)"([^"]*)"', r': "\1\\\"\2\\\"\3"', fixed_content)
-                    parsed = json.loads(fixed_content)
-                except json.JSONDecodeError:
-                    
-                    # Strategy 3: Extract fields manually with improved regex
-                    sql_pattern = r'"sql"\s*:\s*"((?:[^"\\]|\\.)*)(?:"(?:\s*,|\s*}))'
-                    explanation_pattern = r'"explanation"\s*:\s*"((?:[^"\\]|\\.)*)(?:"(?:\s*,|\s*}))'
-                    confidence_pattern = r'"confidence"\s*:\s*([0-9.]+)'
-                    
-                    sql_match = re.search(sql_pattern, content, re.DOTALL)
-                    explanation_match = re.search(explanation_pattern, content, re.DOTALL)
-                    confidence_match = re.search(confidence_pattern, content)
-                    
-                    if sql_match:
-                        # Unescape the extracted SQL
-                        sql_text = sql_match.group(1)
-                        sql_text = sql_text.replace('\\"', '"').replace('\\n', '\n').replace('\\t', '\t')
-                        
-                        explanation_text = "SQL query generated for complex business analysis"
-                        if explanation_match:
-                            explanation_text = explanation_match.group(1)
-                            explanation_text = explanation_text.replace('\\"', '"').replace('\\n', ' ').replace('\\t', ' ')
-                        
-                        confidence_val = 0.8
-                        if confidence_match:
-                            try:
-                                confidence_val = float(confidence_match.group(1))
-                            except ValueError:
-                                pass
-                        
-                        parsed = {
-                            "sql": sql_text,
-                            "explanation": explanation_text,
-                            "confidence": confidence_val
-                        }
-                    else:
-                        # Strategy 4: Look for any SQL-like content as fallback
-                        sql_patterns = [
-                            r'SELECT\s+.*?(?:FROM|$)',
-                            r'WITH\s+.*?SELECT\s+.*',
-                            r'(?:^|\n)\s*(SELECT[\s\S]*?)(?:\n\n|$|```)',
-                        ]
-                        
-                        for pattern in sql_patterns:
-                            match = re.search(pattern, content, re.IGNORECASE | re.MULTILINE | re.DOTALL)
-                            if match:
-                                parsed = {
-                                    "sql": match.group(1).strip() if match.groups() else match.group(0).strip(),
-                                    "explanation": "Complex query extracted from response",
-                                    "confidence": 0.7
-                                }
-                                break
-                        
-                        if not parsed:
-                            raise ValueError(f"JSON parsing failed and no SQL found: {str(json_error)[:100]}")
-            
-            # Validate required fields
-            if "sql" not in parsed:
-                raise ValueError("Missing 'sql' field in response")
-            
             sql_content = parsed["sql"].strip()
             
-            # Validate SQL is analytical (read-only operations)
-            sql_upper = sql_content.upper().strip()
-            
-            # Remove leading whitespace and comments
-            sql_lines = []
-            for line in sql_upper.split('\n'):
-                line = line.strip()
-                if line and not line.startswith('--') and not line.startswith('/*'):
-                    sql_lines.append(line)
-            
-            if not sql_lines:
-                raise ValueError("SQL query is empty or contains only comments")
-            
-            sql_clean = ' '.join(sql_lines).strip()
-            
-            # Valid analytical query patterns (read-only operations)
-            valid_analytical_patterns = [
-                'SELECT',           # Standard queries
-                'WITH',             # Common Table Expressions
-                'EXPLAIN',          # Query plan analysis
-                'DESCRIBE', 'DESC', # Schema information
-                'SHOW',             # Metadata queries
-                'VALUES',           # Value lists for analysis
-                '(SELECT',          # Parenthesized SELECT
-                '(WITH'             # Parenthesized CTE
-            ]
-            
-            # Check if SQL starts with any valid pattern (strict matching)
-            is_valid_analytical = False
-            for pattern in valid_analytical_patterns:
-                if (sql_clean.startswith(pattern + ' ') or 
-                    sql_clean == pattern or 
-                    sql_clean.startswith(pattern + '(')):
-                    is_valid_analytical = True
-                    break
-            
-            if not is_valid_analytical:
-                raise ValueError(f"SQL must be an analytical query (SELECT, WITH, EXPLAIN, DESCRIBE, SHOW, VALUES). Got: {sql_clean[:50]}...")
+            # Validate SQL is a single read-only analytical statement
+            read_only_errors = self.validator.check_read_only(sql_content)
+            if read_only_errors:
+                raise ValueError("; ".join(read_only_errors))
             
             # Basic SQL validation (removed hardcoded table requirement)
             if len(sql_content) < 10:
@@ -366,92 +678,44 @@ Use this EXACT format:
             return {
                 "success": True,
                 "sql": sql_content,
-                "explanation": parsed.get("explanation", "Firebolt SQL query generated"),
+                "explanation": parsed.get("explanation", DEFAULT_EXPLANATION),
                 "confidence": parsed.get("confidence", 0.9),
                 "assumptions": parsed.get("assumptions", []),
                 "original_question": original_question,
+                "source": "claude",
+                "parse_strategy": parsed.get("strategy"),
+                "validation": self.validator.validate(sql_content),
                 "raw_response": response_content
             }
             
-        except (json.JSONDecodeError, ValueError, KeyError) as e:
-            # For debugging complex queries, truncate raw response
-            debug_response = response_content[:500] + "..." if len(response_content) > 500 else response_content
-            
-            return {
-                "success": False,
-                "error": f"Invalid response format: {str(e)}",
-                "sql": None,
-                "explanation": f"Error parsing response for complex query. Raw response preview: {debug_response[:100]}...",
-                "confidence": 0,
-                "original_question": original_question,
-                "raw_response": debug_response
-            }
-    
-    def _extract_sql_from_text(self, text: str) -> str:
-        """Extract SQL query from unstructured text"""
-        # First, try to extract from JSON if it's a JSON response
-        if '{"sql":' in text or '"sql"' in text:
-            try:
-                # Find JSON and extract SQL from it
-                if "{" in text and "}" in text:
-                    start = text.find("{")
-                    end = text.rfind("}") + 1
-                    json_str = text[start:end]
-                    parsed = json.loads(json_str)
-                    sql_content = parsed.get("sql", "")
-                    if sql_content and sql_content.strip().upper().startswith('SELECT'):
-                        return sql_content.strip()
-            except:
-                pass
-        
-        # Look for SQL in code blocks
-        if "```sql" in text:
-            start = text.find("```sql") + 6
-            end = text.find("```", start)
-            if end != -1:
-                return text[start:end].strip()
-        
-        # Look for SQL starting with SELECT
-        lines = text.split('\n')
-        sql_lines = []
-        in_sql = False
-        
-        for line in lines:
-            line = line.strip()
-            if line.upper().startswith('SELECT'):
-                in_sql = True
-            
-            if in_sql:
-                sql_lines.append(line)
-                if line.endswith(';'):
-                    break
-        
-        return ' '.join(sql_lines) if sql_lines else text.strip()
+        except (ValueError, KeyError, AttributeError) as e:
+            return self._format_error_result(e, response_content, original_question)
     
-    def validate_sql(self, sql_query: str) -> Dict[str, any]:
-        """Basic validation of the generated SQL query"""
-        issues = []
-        
-        # Basic checks
-        if not sql_query.strip():
-            issues.append("Empty SQL query")
-        
-        if not sql_query.upper().strip().startswith('SELECT'):
-            issues.append("Query should start with SELECT")
-        
-        # Skip hardcoded table validation - using dynamic schema now
-        
-        # Check for potential SQL injection patterns
-        dangerous_keywords = ['DROP', 'DELETE', 'UPDATE', 'INSERT', 'ALTER', 'CREATE']
-        for keyword in dangerous_keywords:
-            if keyword in sql_query.upper():
-                issues.append(f"Potentially dangerous keyword: {keyword}")
+    def _format_error_result(self, error: Exception, response_content: str, original_question: str) -> Dict[str, any]:
+        """Error result for responses that did not contain a usable query"""
+        # For debugging complex queries, truncate raw response
+        debug_response = response_content[:500] + "..." if len(response_content) > 500 else response_content
         
         return {
-            "valid": len(issues) == 0,
-            "issues": issues,
-            "sql": sql_query
+            "success": False,
+            "error": f"Invalid response format: {str(error)}",
+            "sql": None,
+            "explanation": f"Error parsing response for complex query. Raw response preview: {debug_response[:100]}...",
+            "confidence": 0,
+            "original_question": original_question,
+            "raw_response": debug_response
         }
+    
+    def remember_example(self, question: str, sql: str) -> bool:
+        """Add a question/SQL pair that executed successfully to the few-shot store"""
+        validation = self.validator.validate(sql)
+        if not validation["valid"]:
+            return False
+        return self.example_store.add(question, sql, validation["tables"])
+    
+    def validate_sql(self, sql_query: str) -> Dict[str, any]:
+        """Validate the SQL offline against the schema (read-only, known tables and columns)"""
+        return self.validator.validate(sql_query)
 
 
 def test_nl2sql():
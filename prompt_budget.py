@@ -0,0 +1,202 @@
+"""
+Pre-flight prompt sizing with per-call-site token budgets
+Every prompt is measured before it is sent. Prompts over their call site's
+budget are trimmed in priority order - few-shot examples, then schema
+descriptions, then the tables least relevant to the question - and the
+trimming applied is reported with the result. Prompts that still do not fit
+are rejected instead of being sent.
+"""
+
+import os
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Input-token budgets (prompt + system + tool schema); override with
+# NL2SQL_PROMPT_BUDGETS="nl2sql.generate=4000,agent.step_query=3000"
+DEFAULT_PROMPT_BUDGETS = {
+    "nl2sql.generate": 8000,
+    "nl2sql.stream": 8000,
+    "nl2sql.candidate": 8000,
+    "nl2sql.repair": 3000,
+    "nl2sql.batch": 8000,
+    "agent.analysis_plan": 8000,
+    "agent.step_query": 8000,
+    "agent.result_analysis": 3000,
+    "agent.recommendations": 4000,
+}
+DEFAULT_PROMPT_BUDGET = 8000
+
+# "## 📊 Table: players (TABLE)" in discovered-schema context, "Table: ad_performance" otherwise,
+# "players(player_id:bigint*, ...)" in the compact format (schema_format.compact_schema)
+_TABLE_HEADER = re.compile(r'^\s*(?:(?:##\s*)?(?:\W+\s*)?Table:\s*(?P<name>[\w.]+)|(?P<compact>[\w.]+)\()')
+
+# Narrative lines inside a table section (purpose, business use, relationships, ...)
+_DESCRIPTION_LINE = re.compile(r'^\s*(?:🎯|💼|🔗|⭐|🌐|Description:)')
+
+# "- advertiser (TEXT) - Company name like 'AutoCorp'" -> "- advertiser (TEXT)"
+_COLUMN_COMMENT = re.compile(r'^(?P<column>\s*[-•]\s+\S.*?)\s+-\s+.*$')
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough Claude token count (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def load_prompt_budgets() -> Dict[str, int]:
+    """Budgets from the environment layered over the defaults"""
+    budgets = dict(DEFAULT_PROMPT_BUDGETS)
+    for entry in os.getenv('NL2SQL_PROMPT_BUDGETS', '').split(','):
+        if '=' in entry:
+            call_site, limit = entry.split('=', 1)
+            budgets[call_site.strip()] = int(limit)
+    return budgets
+
+
+class PromptBudgetExceeded(ValueError):
+    """The prompt is over budget even after every trimming step"""
+
+
+def split_schema(schema_text: str) -> Tuple[List[str], List[Tuple[str, List[str]]], List[str]]:
+    """Split schema context into header lines, per-table sections and trailing guidance
+
+    A table section runs from its `Table:` header to the next blank line or header.
+    """
+    header, tables, trailer = [], [], []
+    current = None
+    for line in schema_text.split('\n'):
+        match = _TABLE_HEADER.match(line)
+        if match:
+            current = (match.group('name') or match.group('compact'), [line])
+            tables.append(current)
+            trailer = []
+        elif current is not None and line.strip():
+            current[1].append(line)
+        elif current is not None:
+            current = None
+            trailer.append(line)
+        elif tables:
+            trailer.append(line)
+        else:
+            header.append(line)
+    return header, tables, trailer
+
+
+def join_schema(header: List[str], tables: List[Tuple[str, List[str]]], trailer: List[str]) -> str:
+    lines = list(header)
+    for _, section in tables:
+        lines.extend(section)
+        lines.append("")
+    lines.extend(trailer)
+    return '\n'.join(lines).rstrip() + '\n'
+
+
+def strip_descriptions(schema_text: str) -> str:
+    """Keep table headers and column names/types; drop narrative and guidance text"""
+    header, tables, _ = split_schema(schema_text)
+    if not tables:
+        return schema_text
+    stripped = []
+    for name, section in tables:
+        lines = [section[0]]
+        for line in section[1:]:
+            if _DESCRIPTION_LINE.match(line):
+                continue
+            match = _COLUMN_COMMENT.match(line)
+            lines.append(match.group('column') if match else line)
+        stripped.append((name, lines))
+    return join_schema(header, stripped, [])
+
+
+def rank_tables(tables: List[Tuple[str, List[str]]], question: str, join_graph=None) -> List[str]:
+    """Table names from least to most relevant: word overlap with the question, larger tables first on ties
+
+    With a join_graph, tables needed to join the relevant ones rank above other irrelevant tables.
+    """
+    words = set(re.findall(r'[a-z0-9]+', question.lower()))
+    words |= {word[:-1] for word in words if word.endswith('s')}
+
+    def score(table):
+        name, section = table
+        table_words = set(re.findall(r'[a-z0-9]+', name.lower()))
+        column_words = set(re.findall(r'[a-z0-9]+', ' '.join(section[1:]).lower()))
+        return 3 * len(words & table_words) + len(words & column_words)
+
+    scores = {name: score((name, section)) for name, section in tables}
+    connectors = set()
+    if join_graph is not None:
+        relevant = sorted((name for name, value in scores.items() if value > 0), key=scores.get, reverse=True)
+        connectors = {table for join in join_graph.connect(relevant) for table in join}
+
+    def relevance(table):
+        name, section = table
+        return (scores[name] > 0, name.lower() in connectors, scores[name], -len(' '.join(section)))
+
+    return [name for name, _ in sorted(tables, key=relevance)]
+
+
+class PromptBudget:
+    """Measure prompts against per-call-site budgets and trim them to fit"""
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None):
+        self.budgets = budgets or load_prompt_budgets()
+
+    def limit(self, call_site: str) -> int:
+        return self.budgets.get(call_site, DEFAULT_PROMPT_BUDGET)
+
+    def fit(self, call_site: str, render: Callable[[str, str], str], examples: str = "", schema: str = "",
+            question: str = "", overhead: str = "", join_graph=None) -> Tuple[str, Dict[str, any]]:
+        """Render the prompt, trimming examples, descriptions and tables until it fits
+
+        Args:
+            call_site: Budget key, e.g. "nl2sql.generate"
+            render: Builds the prompt from (examples, schema)
+            examples: Few-shot example text, dropped first
+            schema: Schema context, stripped of descriptions and then of irrelevant tables
+            question: Text used to rank table relevance
+            overhead: System prompt and tool schema sent alongside the prompt
+            join_graph: Keeps tables that join the relevant ones (join_graph.JoinGraph)
+
+        Returns:
+            The prompt and a report of its size and the trimming applied
+        """
+        budget = self.limit(call_site)
+        overhead_tokens = estimate_tokens(overhead) if overhead else 0
+        prompt = render(examples, schema)
+        report = {"call_site": call_site, "budget": budget,
+                  "tokens_before": estimate_tokens(prompt) + overhead_tokens, "trimmed": []}
+
+        def fits(text):
+            return estimate_tokens(text) + overhead_tokens <= budget
+
+        if not fits(prompt) and examples:
+            examples = ""
+            prompt = render(examples, schema)
+            report["trimmed"].append("examples")
+
+        if not fits(prompt) and schema:
+            stripped = strip_descriptions(schema)
+            if stripped != schema:
+                schema = stripped
+                prompt = render(examples, schema)
+                report["trimmed"].append("descriptions")
+
+        if not fits(prompt) and schema:
+            header, tables, trailer = split_schema(schema)
+            dropped = []
+            for name in rank_tables(tables, question, join_graph)[:-1]:
+                tables = [table for table in tables if table[0] != name]
+                dropped.append(name)
+                schema = join_schema(header, tables, trailer)
+                prompt = render(examples, schema)
+                if fits(prompt):
+                    break
+            if dropped:
+                report["trimmed"].append(f"tables: {', '.join(dropped)}")
+
+        report["tokens"] = estimate_tokens(prompt) + overhead_tokens
+        if report["tokens"] > budget:
+            applied = f" after trimming {', '.join(report['trimmed'])}" if report["trimmed"] else ""
+            raise PromptBudgetExceeded(
+                f"{call_site} prompt needs ~{report['tokens']} tokens, over its {budget}-token budget{applied}"
+            )
+        return prompt, report
@@ -0,0 +1,302 @@
+"""
+Parsing of Claude's NL2SQL responses, incrementally and in linear time
+Lets callers act on the generated SQL before the full completion has arrived
+"""
+
+import json
+import re
+from typing import Dict, Optional, Tuple
+
+
+# Matches the opening of the "sql" string value, e.g. `"sql": "`
+_SQL_KEY_PATTERN = re.compile(r'"sql"\s*:\s*"')
+
+# Next character that can change the state of a JSON string scan
+_STRING_SPECIAL = re.compile(r'[\\"]')
+
+# Longest possible tail of a partially received key, kept to rescan chunk boundaries
+_KEY_LOOKBEHIND = 32
+
+
+def decode_json_string(raw: str) -> str:
+    """Decode the body of a JSON string literal, tolerating raw control characters"""
+    try:
+        return json.loads(f'"{raw}"', strict=False)
+    except json.JSONDecodeError:
+        return raw.replace('\\"', '"').replace('\\n', '\n').replace('\\t', '\t').replace('\\\\', '\\')
+
+
+class StreamingSQLExtractor:
+    """Extract the `sql` field from a JSON response as it streams in
+
+    Feed text chunks as they arrive; `feed` returns the decoded SQL as soon as
+    the closing quote of the `sql` string has been received, and None before
+    that. Only the new chunk is scanned on each call, so total work is linear
+    in the length of the response.
+    """
+
+    def __init__(self):
+        self.sql: Optional[str] = None
+        self._parts = []
+        self._tail = ""
+        self._value_parts: Optional[list] = None
+        self._escaped = False
+
+    def feed(self, chunk: str) -> Optional[str]:
+        """Append a chunk of streamed text and return the SQL once it is complete"""
+        self._parts.append(chunk)
+        if self.sql is not None or not chunk:
+            return self.sql
+
+        if self._value_parts is None:
+            window = self._tail + chunk
+            match = _SQL_KEY_PATTERN.search(window)
+            if not match:
+                self._tail = window[-_KEY_LOOKBEHIND:]
+                return None
+            self._value_parts = []
+            chunk = window[match.end():]
+
+        # Jump between backslashes and quotes looking for the closing quote
+        pos = 0
+        if self._escaped and chunk:
+            self._escaped = False
+            pos = 1
+        while True:
+            special = _STRING_SPECIAL.search(chunk, pos)
+            if not special:
+                break
+            if special.group() == '\\':
+                if special.end() >= len(chunk):
+                    self._escaped = True
+                    break
+                pos = special.end() + 1
+            else:
+                self._value_parts.append(chunk[:special.start()])
+                self.sql = decode_json_string(''.join(self._value_parts)).strip()
+                return self.sql
+        self._value_parts.append(chunk)
+        return None
+
+    @property
+    def text(self) -> str:
+        """Full text received so far"""
+        return ''.join(self._parts)
+
+
+# Precompiled patterns for the single-pass parser; none of them can backtrack
+# more than a bounded amount per starting position
+_STRING_RUN = re.compile(r'[^"\\]+')
+_WHITESPACE = re.compile(r'\s*')
+_SELECT_KEYWORD = re.compile(r'\bSELECT\b', re.IGNORECASE)
+_CTE_KEYWORD = re.compile(r'\bWITH\s+\w+\s+AS\s*\(', re.IGNORECASE)
+
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', '"': '"', '\\': '\\', '/': '/'}
+
+DEFAULT_EXPLANATION = "Firebolt SQL query generated"
+
+# Nested arrays/objects deeper than this are kept as raw text instead of decoded
+MAX_VALUE_DEPTH = 32
+
+
+def _skip_whitespace(text: str, pos: int) -> int:
+    return _WHITESPACE.match(text, pos).end()
+
+
+def _is_closing_quote(text: str, pos: int) -> bool:
+    """Decide whether the quote at `pos` ends a string value
+
+    Well-formed JSON escapes inner quotes, but models sometimes emit raw
+    double quotes inside SQL. A quote only closes the string when it is
+    followed by a structural character (or `, "next_key`), which needs a
+    bounded lookahead over whitespace only.
+    """
+    after = _skip_whitespace(text, pos + 1)
+    if after >= len(text) or text[after] in '}:]':
+        return True
+    if text[after] == ',':
+        next_token = _skip_whitespace(text, after + 1)
+        return next_token >= len(text) or text[next_token] in '"}'
+    return False
+
+
+def _read_string(text: str, pos: int) -> Tuple[str, int]:
+    """Read a tolerant JSON string body starting after its opening quote"""
+    parts = []
+    length = len(text)
+    while pos < length:
+        run = _STRING_RUN.match(text, pos)
+        if run:
+            parts.append(run.group())
+            pos = run.end()
+            continue
+        char = text[pos]
+        if char == '\\':
+            escape = text[pos + 1:pos + 2]
+            if escape == 'u' and pos + 6 <= length:
+                try:
+                    parts.append(chr(int(text[pos + 2:pos + 6], 16)))
+                    pos += 6
+                    continue
+                except ValueError:
+                    pass
+            parts.append(_ESCAPES.get(escape, escape))
+            pos += 2
+        elif _is_closing_quote(text, pos):
+            return ''.join(parts), pos + 1
+        else:
+            parts.append(char)
+            pos += 1
+    return ''.join(parts), pos
+
+
+def _read_raw_value(text: str, pos: int) -> Tuple[any, int]:
+    """Read a non-string value (number, literal, array, object) up to the next field"""
+    start = pos
+    depth = max_depth = 0
+    length = len(text)
+    while pos < length:
+        char = text[pos]
+        if char == '"':
+            _, pos = _read_string(text, pos + 1)
+            continue
+        if char in '[{':
+            depth += 1
+            max_depth = max(max_depth, depth)
+        elif char in ']}':
+            if depth == 0:
+                break
+            depth -= 1
+        elif char == ',' and depth == 0:
+            break
+        pos += 1
+
+    raw = text[start:pos].strip()
+    if max_depth > MAX_VALUE_DEPTH:
+        return raw, pos
+    try:
+        return json.loads(raw), pos
+    except json.JSONDecodeError:
+        return raw, pos
+
+
+def scan_json_object(text: str, start: int = 0) -> Dict[str, any]:
+    """Tolerantly read the top-level fields of the JSON object opening at `start`
+
+    Runs in a single left-to-right pass and stops at the first structural
+    error, returning whatever fields were read up to that point.
+    """
+    fields = {}
+    pos = start + 1
+    length = len(text)
+    while pos < length:
+        pos = _skip_whitespace(text, pos)
+        if pos < length and text[pos] == ',':
+            pos = _skip_whitespace(text, pos + 1)
+        if pos >= length or text[pos] != '"':
+            break
+
+        key, pos = _read_string(text, pos + 1)
+        pos = _skip_whitespace(text, pos)
+        if pos >= length or text[pos] != ':':
+            break
+        pos = _skip_whitespace(text, pos + 1)
+
+        if pos < length and text[pos] == '"':
+            value, pos = _read_string(text, pos + 1)
+        else:
+            value, pos = _read_raw_value(text, pos)
+        fields[key] = value
+    return fields
+
+
+def strip_code_fence(text: str) -> str:
+    """Return the contents of the first markdown code block, or the text unchanged"""
+    fence = text.find("```")
+    if fence == -1:
+        return text
+    body_start = text.find("\n", fence)
+    if body_start == -1:
+        return text
+    body_end = text.find("```", body_start)
+    return text[body_start + 1:body_end if body_end != -1 else len(text)].strip()
+
+
+def extract_sql_from_text(text: str) -> Optional[str]:
+    """Find a SQL statement in free text, preferring fenced ```sql blocks"""
+    fence = text.find("```sql")
+    if fence != -1:
+        return strip_code_fence(text[fence:]) or None
+
+    starts = [match.start() for match in (_SELECT_KEYWORD.search(text), _CTE_KEYWORD.search(text)) if match]
+    if not starts:
+        return None
+    start = min(starts)
+
+    # Statement ends at the first semicolon, blank line or code fence
+    end = len(text)
+    for terminator, include in ((';', True), ('\n\n', False), ('```', False)):
+        found = text.find(terminator, start)
+        if found != -1:
+            end = min(end, found + len(terminator) if include else found)
+    return text[start:end].strip() or None
+
+
+def parse_sql_response(response_text: str) -> Dict[str, any]:
+    """Parse Claude's NL2SQL response in linear time
+
+    Tries strict JSON first, then a tolerant single-pass field scanner, then
+    plain SQL extraction. The returned dict always carries `sql`,
+    `explanation`, `confidence` and the `strategy` that succeeded.
+
+    Raises:
+        ValueError: If no SQL could be found in the response
+    """
+    content = strip_code_fence(response_text.strip())
+    brace = content.find("{")
+
+    if brace != -1:
+        closing = content.rfind("}")
+        if closing > brace:
+            try:
+                parsed = json.loads(content[brace:closing + 1], strict=False)
+                if isinstance(parsed, dict) and isinstance(parsed.get("sql"), str):
+                    parsed["strategy"] = "json"
+                    return parsed
+            except json.JSONDecodeError:
+                pass
+
+        fields = scan_json_object(content, brace)
+        if isinstance(fields.get("sql"), str) and fields["sql"].strip():
+            confidence = fields.get("confidence", 0.8)
+            fields["confidence"] = confidence if isinstance(confidence, (int, float)) else 0.8
+            fields.setdefault("explanation", "SQL query generated for complex business analysis")
+            fields["strategy"] = "tolerant_json"
+            return fields
+
+    sql = extract_sql_from_text(content)
+    if sql:
+        return {
+            "sql": sql,
+            "explanation": "Complex query extracted from response",
+            "confidence": 0.7,
+            "strategy": "sql_text"
+        }
+
+    raise ValueError("No JSON or SQL found in response")
+
+
+def extract_tool_input(message, tool_name: str) -> Optional[Dict[str, any]]:
+    """Return the input of the named tool_use block in a Claude message, if any"""
+    for block in getattr(message, "content", None) or []:
+        if getattr(block, "type", None) == "tool_use" and getattr(block, "name", None) == tool_name:
+            return dict(block.input)
+    return None
+
+
+def message_text(message) -> str:
+    """Concatenate the text blocks of a Claude message"""
+    return "".join(
+        block.text for block in getattr(message, "content", None) or []
+        if getattr(block, "type", None) == "text"
+    ).strip()
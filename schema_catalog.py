@@ -0,0 +1,287 @@
+"""
+Persistent schema catalog for Firebolt databases
+Discovered schemas are cached on disk per account/database together with a
+cheap fingerprint (table count, column count and a hash of column names and
+types). A reconnect runs only the fingerprint probe and reuses the cached
+schema - and the prompt context formatted from it - unless the fingerprint
+has changed. When it has, table-level metadata (last-altered timestamps or
+DDL hashes) is compared against the cache and columns are re-fetched only
+for new and changed tables. Column statistics (see column_profiler) are
+kept on the entry with per-table profiling times and survive incremental
+refreshes for unchanged tables.
+"""
+
+import hashlib
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from json_files import load_json, path_lock, write_json_atomic
+
+DEFAULT_CATALOG_PATH = "nl2sql_schema_catalog.json"
+
+_SCHEMA_DISCOVERY_FROM = """FROM information_schema.tables t
+LEFT JOIN information_schema.columns c
+  ON c.table_schema = t.table_schema AND c.table_name = t.table_name
+WHERE t.table_schema = 'public'
+ORDER BY t.table_name, c.ordinal_position"""
+SCHEMA_DISCOVERY_QUERIES = [
+    "SELECT t.table_name, t.table_type, t.ddl, t.primary_index, c.column_name, c.data_type\n" + _SCHEMA_DISCOVERY_FROM,
+    "SELECT t.table_name, t.table_type, c.column_name, c.data_type\n" + _SCHEMA_DISCOVERY_FROM,
+]
+
+# One aggregate row computed server-side; the fallback returns just names and types
+# (no ddl) and is hashed locally
+FINGERPRINT_QUERY = """SELECT
+  (SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = 'public') AS table_count,
+  COUNT(*) AS column_count,
+  HASH_AGG(table_name, column_name, data_type) AS columns_hash
+FROM information_schema.columns
+WHERE table_schema = 'public'"""
+FINGERPRINT_FALLBACK_QUERY = """SELECT t.table_name, c.column_name, c.data_type
+FROM information_schema.tables t
+LEFT JOIN information_schema.columns c
+  ON c.table_schema = t.table_schema AND c.table_name = t.table_name
+WHERE t.table_schema = 'public'"""
+
+# Table-level metadata for incremental refresh, richest first
+_TABLE_METADATA_FROM = "\nFROM information_schema.tables\nWHERE table_schema = 'public'"
+TABLE_METADATA_QUERIES = [
+    "SELECT table_name, table_type, ddl, primary_index, last_altered" + _TABLE_METADATA_FROM,
+    "SELECT table_name, table_type, ddl, primary_index" + _TABLE_METADATA_FROM,
+]
+CHANGED_COLUMNS_QUERY = """SELECT table_name, column_name, data_type
+FROM information_schema.columns
+WHERE table_schema = 'public' AND table_name IN ({tables})
+ORDER BY table_name, ordinal_position"""
+
+# Tables per CHANGED_COLUMNS_QUERY, to keep the IN list reasonable
+COLUMN_FETCH_CHUNK = 200
+
+
+def schema_from_rows(rows: List[Dict[str, any]]) -> Dict[str, Dict]:
+    """Group discovery rows (one per column, or per table without columns) by table"""
+    schema_info = {}
+    for row in rows:
+        table_name = row['table_name']
+        if table_name not in schema_info:
+            schema_info[table_name] = {
+                'type': row.get('table_type', 'TABLE'),
+                'ddl': row.get('ddl') or 'Not available',
+                'primary_index': row.get('primary_index') or 'Not available',
+                'columns': []
+            }
+        if row.get('column_name'):
+            schema_info[table_name]['columns'].append({
+                'name': row['column_name'],
+                'type': row['data_type']
+            })
+    return schema_info
+
+
+def fingerprint_from_rows(rows: List[Dict[str, any]]) -> str:
+    """Fingerprint from FINGERPRINT_FALLBACK_QUERY rows, independent of row order"""
+    columns = sorted(
+        f"{row['table_name']}.{row.get('column_name') or ''}:{row.get('data_type') or ''}" for row in rows
+    )
+    tables = {row['table_name'] for row in rows}
+    column_count = sum(1 for row in rows if row.get('column_name'))
+    digest = hashlib.sha256('\n'.join(columns).encode('utf-8')).hexdigest()[:16]
+    return f"{len(tables)}:{column_count}:{digest}"
+
+
+def table_signature(row: Dict[str, any]) -> Optional[str]:
+    """Last-altered timestamp, else a DDL hash; None when the table cannot be compared"""
+    if row.get('last_altered'):
+        return f"altered:{row['last_altered']}"
+    if row.get('ddl'):
+        return "ddl:" + hashlib.sha256(row['ddl'].encode('utf-8')).hexdigest()[:16]
+    return None
+
+
+def _fingerprint_counts(fingerprint: str) -> Tuple[int, int]:
+    table_count, column_count, _ = fingerprint.split(':', 2)
+    return int(table_count), int(column_count)
+
+
+async def probe_fingerprint(firebolt) -> str:
+    """Cheap schema fingerprint over an open FireboltMCPSession"""
+    try:
+        row = (await firebolt.query(FINGERPRINT_QUERY))[0]
+        return f"{row['table_count']}:{row['column_count']}:{row['columns_hash']}"
+    except Exception:
+        # Engines without HASH_AGG: names and types only, hashed here
+        return fingerprint_from_rows(await firebolt.query(FINGERPRINT_FALLBACK_QUERY))
+
+
+async def discover_schema(firebolt) -> Dict[str, Dict]:
+    """Full schema over an open FireboltMCPSession, falling back to the query without ddl/primary_index"""
+    rows = None
+    for query in SCHEMA_DISCOVERY_QUERIES:
+        try:
+            rows = await firebolt.query(query)
+            break
+        except Exception as e:
+            last_error = e
+    if rows is None:
+        raise last_error
+    return schema_from_rows(rows)
+
+
+async def fetch_table_metadata(firebolt) -> Optional[List[Dict[str, any]]]:
+    """One row per table with whatever change metadata this engine exposes, or None"""
+    for query in TABLE_METADATA_QUERIES:
+        try:
+            return await firebolt.query(query)
+        except Exception:
+            continue
+    return None
+
+
+async def fetch_columns(firebolt, tables: List[str]) -> List[Dict[str, any]]:
+    """Column rows for just `tables`"""
+    rows = []
+    for start in range(0, len(tables), COLUMN_FETCH_CHUNK):
+        names = ", ".join("'" + table.replace("'", "''") + "'" for table in tables[start:start + COLUMN_FETCH_CHUNK])
+        rows.extend(await firebolt.query(CHANGED_COLUMNS_QUERY.format(tables=names)))
+    return rows
+
+
+class SchemaCatalog:
+    """Cached schemas keyed by "account/database", persisted in `path` (NL2SQL_SCHEMA_CATALOG)
+
+    Each entry holds the fingerprint, the discovered schema_info, per-table
+    change signatures, column statistics and, once formatted, the prompt
+    context built from it.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('NL2SQL_SCHEMA_CATALOG', DEFAULT_CATALOG_PATH)
+
+    @staticmethod
+    def key(account: str, database: str) -> str:
+        return f"{account}/{database}"
+
+    def get(self, account: str, database: str) -> Optional[Dict[str, any]]:
+        return self._load().get(self.key(account, database))
+
+    def put(self, account: str, database: str, fingerprint: str, schema_info: Dict[str, Dict],
+            table_signatures: Optional[Dict[str, Optional[str]]] = None,
+            changes: Optional[Dict[str, List[str]]] = None,
+            column_stats: Optional[Dict[str, Dict]] = None) -> Dict[str, any]:
+        """Store a freshly discovered schema, dropping any context formatted from the old one"""
+        entry = {"fingerprint": fingerprint, "schema_info": schema_info, "table_signatures": table_signatures,
+                 "changes": changes, "column_stats": column_stats or {}, "discovered_at": time.time()}
+
+        def update(old):
+            profiled_at = (old or {}).get("profiled_at") or {}
+            entry["profiled_at"] = {table: at for table, at in profiled_at.items() if table in entry["column_stats"]}
+            return entry
+        self._update(account, database, update)
+        return entry
+
+    def schema_context(self, account: str, database: str, version: str) -> Optional[str]:
+        """Memoized prompt context, if it was formatted by formatter `version` from the cached schema"""
+        entry = self.get(account, database) or {}
+        if entry.get("context_version") != version:
+            return None
+        return entry.get("schema_context")
+
+    def set_schema_context(self, account: str, database: str, fingerprint: str, version: str, context: str):
+        """Memoize `context` on the entry, unless the schema was rediscovered in the meantime"""
+        def update(entry):
+            if entry and entry["fingerprint"] == fingerprint:
+                entry.update({"schema_context": context, "context_version": version})
+            return entry
+        self._update(account, database, update)
+
+    def set_column_stats(self, account: str, database: str, fingerprint: str,
+                         column_stats: Dict[str, Dict]) -> Optional[Dict[str, any]]:
+        """Merge per-table column stats into the entry, unless the schema was rediscovered meanwhile"""
+        profiled_at = time.time()
+
+        def update(entry):
+            if entry and entry["fingerprint"] == fingerprint:
+                entry["column_stats"] = {**(entry.get("column_stats") or {}), **column_stats}
+                entry["profiled_at"] = {**(entry.get("profiled_at") or {}),
+                                        **dict.fromkeys(column_stats, profiled_at)}
+            return entry
+        self._update(account, database, update)
+        return self.get(account, database)
+
+    async def load(self, firebolt, account: str, database: str) -> Tuple[Dict[str, any], str]:
+        """Cached entry when the probe fingerprint matches, else refresh incrementally or rediscover
+
+        Returns the entry and where it came from: "cache", "incremental" or "discovery".
+        """
+        fingerprint = await probe_fingerprint(firebolt)
+        entry = self.get(account, database)
+        if entry and entry["fingerprint"] == fingerprint:
+            return entry, "cache"
+
+        metadata = await fetch_table_metadata(firebolt)
+        if entry and entry.get("table_signatures") is not None and metadata is not None:
+            refreshed = await self._refresh_incremental(firebolt, entry, metadata, fingerprint)
+            if refreshed is not None:
+                return self.put(account, database, fingerprint, *refreshed), "incremental"
+
+        schema_info = await discover_schema(firebolt)
+        signatures = {row['table_name']: table_signature(row) for row in metadata or []} if metadata else None
+        return self.put(account, database, fingerprint, schema_info, signatures), "discovery"
+
+    async def _refresh_incremental(self, firebolt, entry: Dict[str, any], metadata: List[Dict[str, any]],
+                                   fingerprint: str) -> Optional[Tuple[Dict[str, Dict], Dict, Dict, Dict]]:
+        """(schema_info, signatures, changes, column_stats) with columns re-fetched for new/changed tables only
+
+        None when the signatures cannot explain the fingerprint change (e.g. no
+        table-level metadata changed), so the caller falls back to full discovery.
+        """
+        cached, old_signatures = entry["schema_info"], entry["table_signatures"]
+        signatures = {row['table_name']: table_signature(row) for row in metadata}
+        added = [name for name in signatures if name not in cached]
+        changed = [name for name, signature in signatures.items()
+                   if name in cached and (signature is None or signature != old_signatures.get(name))]
+        removed = [name for name in cached if name not in signatures]
+        if not (added or changed or removed):
+            return None
+
+        fetched = schema_from_rows(await fetch_columns(firebolt, added + changed))
+        schema_info = {}
+        for row in metadata:
+            name = row['table_name']
+            if name in added or name in changed:
+                schema_info[name] = {
+                    'type': row.get('table_type', 'TABLE'),
+                    'ddl': row.get('ddl') or 'Not available',
+                    'primary_index': row.get('primary_index') or 'Not available',
+                    'columns': fetched.get(name, {}).get('columns', [])
+                }
+            else:
+                schema_info[name] = cached[name]
+
+        # The probe counts must match what we assembled, or a change slipped past the signatures
+        table_count, column_count = _fingerprint_counts(fingerprint)
+        if (table_count, column_count) != (len(schema_info), sum(len(t['columns']) for t in schema_info.values())):
+            return None
+        column_stats = {name: stats for name, stats in (entry.get("column_stats") or {}).items()
+                        if name in schema_info and name not in added and name not in changed}
+        return schema_info, signatures, {"added": added, "changed": changed, "removed": removed}, column_stats
+
+    def _load(self) -> Dict[str, Dict]:
+        # Rewrites swap in a complete file, so reads need no lock
+        return load_json(self.path) or {}
+
+    def _update(self, account: str, database: str, update):
+        """Rewrite one entry atomically, keeping other databases' entries
+
+        The lock is shared by every catalog on this path in the process - the app
+        builds a new SchemaCatalog per rerun and refreshes from a background thread.
+        """
+        key = self.key(account, database)
+        with path_lock(self.path):
+            data = self._load()
+            entry = update(data.get(key))
+            if entry is None:
+                return
+            data[key] = entry
+            write_json_atomic(self.path, data)
@@ -0,0 +1,45 @@
+"""
+Schema serialization formats for NL2SQL prompts
+"verbose" is the caller's narrative schema context (emoji headers,
+descriptions, guidance). "compact" is built from the discovered schema: one
+line per table, columns as `name:type`, `*` for primary index columns and
+`>table` for keys that reference another table. Select the format per
+converter (NL2SQL_SCHEMA_FORMAT) or per call.
+"""
+
+import os
+from typing import Dict, Optional
+
+from join_graph import JoinGraph, primary_index_columns
+
+SCHEMA_FORMATS = ("verbose", "compact")
+DEFAULT_SCHEMA_FORMAT = "verbose"
+
+COMPACT_LEGEND = "Tables as table(column:type); * = primary index, >t = joins table t"
+
+
+def default_schema_format() -> str:
+    schema_format = os.getenv('NL2SQL_SCHEMA_FORMAT', DEFAULT_SCHEMA_FORMAT).lower()
+    if schema_format not in SCHEMA_FORMATS:
+        raise ValueError(f"NL2SQL_SCHEMA_FORMAT must be one of {', '.join(SCHEMA_FORMATS)}, got {schema_format}")
+    return schema_format
+
+
+def compact_schema(schema_info: Dict[str, Dict], join_graph: Optional[JoinGraph] = None) -> str:
+    """One line per table, e.g. `ad_events(event_id:text*, campaign_id:text>campaigns, ...)`"""
+    join_graph = join_graph or JoinGraph(schema_info)
+    lines = [COMPACT_LEGEND]
+    for table_name, info in schema_info.items():
+        primary = primary_index_columns(info)
+        references = join_graph.references.get(table_name.lower(), {})
+        columns = []
+        for col in info.get('columns', []):
+            name = col['name']
+            entry = f"{name}:{col.get('type', '').lower()}"
+            if name.lower() in primary:
+                entry += "*"
+            if name.lower() in references:
+                entry += f">{references[name.lower()]}"
+            columns.append(entry)
+        lines.append(f"{table_name}({', '.join(columns)})")
+    return "\n".join(lines)
@@ -0,0 +1,189 @@
+"""
+Bounded self-repair loop for SQL rejected by the validator or by Firebolt
+Feeds the failed SQL, the classified error and only the relevant schema slice
+back to Claude, within an attempt cap and a wall-clock budget
+"""
+
+import re
+import time
+from typing import Callable, Dict, List, Optional
+
+from llm_scheduler import request_deadline
+from sql_validator import SQLValidator
+
+
+# (category, pattern, hint for the model) - first match wins
+ERROR_CATEGORIES = [
+    ("decimal_overflow", re.compile(r'decimal math overflow|numeric overflow', re.IGNORECASE),
+     "Cast operands to DOUBLE or a wider DECIMAL before multiplying, dividing or summing"),
+    ("unknown_column", re.compile(r'column\b.*\b(?:does not exist|not found)|unknown column', re.IGNORECASE),
+     "Use only column names listed in the schema below"),
+    ("unknown_table", re.compile(r'(?:table|relation)\b.*\b(?:does not exist|not found)|unknown table', re.IGNORECASE),
+     "Use only table names listed in the schema below"),
+    ("division_by_zero", re.compile(r'division by zero', re.IGNORECASE),
+     "Wrap divisors in NULLIF(divisor, 0)"),
+    ("type_mismatch", re.compile(r'cannot be cast|type mismatch|cannot convert|no matching (?:function|signature)', re.IGNORECASE),
+     "Add explicit casts (e.g. col::DOUBLE) so argument types match"),
+    ("syntax_error", re.compile(r'syntax error|parse error|unexpected token', re.IGNORECASE),
+     "Fix the Firebolt SQL syntax without changing the query's intent"),
+    ("group_by", re.compile(r'group by|aggregate', re.IGNORECASE),
+     "Every non-aggregated column in SELECT must appear in GROUP BY"),
+]
+
+ERROR_LABELS = {
+    "decimal_overflow": "Decimal overflow - need to increase precision",
+    "unknown_column": "Schema mismatch - wrong column name",
+    "unknown_table": "Schema mismatch - wrong table name",
+    "syntax_error": "SQL syntax error",
+}
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_TIME_BUDGET_S = 60.0
+
+
+def classify_sql_error(error_message: str) -> Dict[str, str]:
+    """Classify an engine or validator error into a category with a repair hint"""
+    for category, pattern, hint in ERROR_CATEGORIES:
+        if pattern.search(error_message):
+            return {"category": category, "hint": hint, "message": error_message}
+    return {"category": "other", "hint": "Fix the error without changing the query's intent", "message": error_message}
+
+
+def format_sql_error(error_message: str) -> str:
+    """Human-readable error with its classification prefix, as reported by the stress test"""
+    category = classify_sql_error(error_message)["category"]
+    label = ERROR_LABELS.get(category)
+    return f"{label}: {error_message}" if label else error_message
+
+
+def schema_slice(schema_info: Dict[str, Dict], sql: str, error_message: str = "") -> str:
+    """Render only the tables the failed SQL touches (or that the error points at)"""
+    validation = SQLValidator(schema_info).validate(sql)
+    tables = set(validation["tables"])
+
+    # Tables named in the error or suggested for an unknown table reference
+    error_text = error_message.lower()
+    for table_name in schema_info:
+        if re.search(rf'\b{re.escape(table_name.lower())}\b', error_text):
+            tables.add(table_name)
+    for candidates in validation["suggestions"].values():
+        tables.update(name for name in candidates if name in schema_info)
+
+    # Nothing resolvable: the model needs the table list to pick from
+    if not tables:
+        tables = set(schema_info)
+
+    lines = []
+    for table_name in sorted(tables):
+        columns = ", ".join(f"{col['name']} {col.get('type', '')}".strip()
+                            for col in schema_info[table_name].get('columns', []))
+        lines.append(f"{table_name}({columns})")
+    return "\n".join(lines)
+
+
+class SQLRepairLoop:
+    """Generate, validate and execute SQL, repairing failures with cheap targeted calls"""
+
+    def __init__(self, converter, execute: Callable[[str], List[Dict]],
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, time_budget_s: float = DEFAULT_TIME_BUDGET_S):
+        self.converter = converter
+        self.execute = execute
+        self.max_attempts = max_attempts
+        self.time_budget_s = time_budget_s
+
+    def run(self, question: str, sql: Optional[str] = None, known_error: Optional[str] = None,
+            model: Optional[str] = None) -> Dict[str, any]:
+        """Run until the SQL executes, attempts run out, or the time budget is spent
+
+        Args:
+            question: The user's natural language question
+            sql: SQL to start from; generated from the question when omitted
+            known_error: Engine error already observed for `sql`, skipping its re-execution
+            model: Model tier that produced `sql`, so repairs escalate from it
+
+        Returns:
+            Dictionary with success, final sql, rows, and per-attempt latency records
+        """
+        start_time = time.perf_counter()
+        attempts = []
+        generation_ms = 0.0
+
+        if sql is None:
+            generation = self.converter.generate_sql(question)
+            generation_ms = (time.perf_counter() - start_time) * 1000
+            if not generation["success"]:
+                return self._result(False, None, None, attempts, start_time, generation["error"])
+            sql = generation["sql"]
+            model = generation.get("model")
+
+        error = None
+        for attempt_number in range(1, self.max_attempts + 1):
+            attempt = {"attempt": attempt_number, "sql": sql, "model": model,
+                       "generation_ms": generation_ms, "execution_ms": 0.0}
+            attempts.append(attempt)
+
+            error, stage = self._check(sql, attempt, known_error)
+            known_error = None
+            if error is None:
+                self.converter.remember_example(question, sql)
+                return self._result(True, sql, attempt.pop("rows"), attempts, start_time)
+
+            classification = classify_sql_error(error)
+            attempt.update({"stage": stage, "error": error, "category": classification["category"]})
+            if model and stage == "execution":
+                self.converter.tier_ladder.record_escalation(model, "execution_error")
+
+            remaining_s = self.time_budget_s - (time.perf_counter() - start_time)
+            if attempt_number == self.max_attempts or remaining_s <= 0:
+                break
+
+            # Failed SQL escalates to the next model tier for the repair; queueing and
+            # rate-limit retries in the scheduler stop at the budget too
+            repair_start = time.perf_counter()
+            with request_deadline(remaining_s):
+                repair = self.converter.repair_sql(
+                    question, sql, classification,
+                    schema_slice(self.converter.validator.schema_info, sql, error),
+                    timeout=remaining_s,
+                    model=self.converter.tier_ladder.next_model(model)
+                )
+            generation_ms = (time.perf_counter() - repair_start) * 1000
+            if not repair["success"]:
+                attempt["repair_error"] = repair["error"]
+                break
+            sql = repair["sql"]
+            model = repair.get("model")
+
+        return self._result(False, sql, None, attempts, start_time, error)
+
+    def _check(self, sql: str, attempt: Dict[str, any], known_error: Optional[str]):
+        """Validate offline, then execute; returns (error, stage) with error None on success"""
+        if known_error:
+            return known_error, "execution"
+
+        validation = self.converter.validate_sql(sql)
+        if not validation["valid"]:
+            return "; ".join(validation["errors"]), "validation"
+
+        execution_start = time.perf_counter()
+        try:
+            rows = self.execute(sql)
+        except Exception as e:
+            return str(e), "execution"
+        finally:
+            attempt["execution_ms"] = (time.perf_counter() - execution_start) * 1000
+
+        attempt.update({"stage": "execution", "rows": rows, "row_count": len(rows) if rows else 0})
+        return None, "execution"
+
+    def _result(self, success: bool, sql: Optional[str], rows, attempts: List[Dict],
+                start_time: float, error: Optional[str] = None) -> Dict[str, any]:
+        return {
+            "success": success,
+            "sql": sql,
+            "rows": rows,
+            "error": error,
+            "attempts": attempts,
+            "repaired": success and len(attempts) > 1,
+            "total_time_ms": (time.perf_counter() - start_time) * 1000
+        }
@@ -0,0 +1,253 @@
+"""
+Deterministic template engine for well-known NL2SQL questions
+Resolves simple parameterized questions against the discovered schema locally,
+so only questions that no template can answer are sent to Claude
+"""
+
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+NUMERIC_TYPES = ('INT', 'BIGINT', 'DECIMAL', 'NUMERIC', 'DOUBLE', 'FLOAT', 'REAL')
+
+# Words that mean "count the rows" when used as a metric
+COUNT_METRICS = {'count', 'rows', 'records', 'entries'}
+
+AGGREGATES = {
+    'total': 'SUM',
+    'sum of': 'SUM',
+    'average': 'AVG',
+    'avg': 'AVG',
+    'mean': 'AVG',
+    'max': 'MAX',
+    'maximum': 'MAX',
+    'min': 'MIN',
+    'minimum': 'MIN',
+}
+
+_AGGREGATE_PATTERN = '|'.join(sorted(AGGREGATES, key=len, reverse=True))
+
+# Leading politeness / question words stripped before matching
+_PREFIX = r'^(?:please\s+)?(?:(?:show|give|get|list|find|tell)(?:\s+me)?\s+)?(?:(?:what|which)(?:\'s|\s+is|\s+are)\s+)?(?:the\s+)?'
+
+TEMPLATES: List[Tuple[str, re.Pattern]] = [
+    ("top_n_by_metric", re.compile(
+        _PREFIX + r'top\s+(?:(?P<n>\d+)\s+)?(?P<dimension>[a-z_ ]+?)\s+by\s+'
+        r'(?:(?:the\s+)?(?:number|count)\s+of\s+|(?P<agg>' + _AGGREGATE_PATTERN + r')\s+)?(?P<metric>[a-z_ ]+)$')),
+    ("count_by_column", re.compile(
+        _PREFIX + r'(?:count|number)\s+of\s+(?P<entity>[a-z_ ]+?)\s+(?:by|per)\s+(?P<column>[a-z_ ]+)$')),
+    ("count_by_column", re.compile(
+        r'^how\s+many\s+(?P<entity>[a-z_ ]+?)\s+(?:are\s+there\s+|do\s+we\s+have\s+)?(?:by|per|in\s+each)\s+(?P<column>[a-z_ ]+)$')),
+    ("total_count", re.compile(
+        r'^how\s+many\s+(?:total\s+)?(?P<entity>[a-z_ ]+?)(?:\s+(?:do\s+we\s+have|are\s+there|exist|in\s+total))?$')),
+    ("total_count", re.compile(
+        _PREFIX + r'(?:total\s+)?(?:count|number)\s+of\s+(?P<entity>[a-z_ ]+)$')),
+    ("metric_by_dimension", re.compile(
+        _PREFIX + r'(?:(?P<agg>' + _AGGREGATE_PATTERN + r')\s+)?(?P<metric>[a-z_ ]+?)\s+(?:by|per)\s+(?P<dimension>[a-z_ ]+)$')),
+]
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase the question and drop trailing punctuation and demo annotations"""
+    text = question.split(" (")[0].strip().lower()
+    text = text.rstrip('?.! ')
+    return re.sub(r'\s+', ' ', text)
+
+
+def singular_forms(word: str) -> List[str]:
+    """Return the word plus its likely singular forms"""
+    forms = [word]
+    if word.endswith('ies'):
+        forms.append(word[:-3] + 'y')
+    if word.endswith('es'):
+        forms.append(word[:-2])
+    if word.endswith('s'):
+        forms.append(word[:-1])
+    return forms
+
+
+class SQLTemplateEngine:
+    """Match questions against parameterized templates and render SQL from the schema"""
+
+    def __init__(self, schema_info: Optional[Dict[str, Dict]] = None, stats: Optional[Dict[str, any]] = None):
+        self.schema_info = {}
+        # Callers may pass a long-lived stats dict to accumulate hit rates across engines
+        self.stats = stats if stats is not None else self.new_stats()
+        self.update_schema(schema_info or {})
+
+    @staticmethod
+    def new_stats() -> Dict[str, any]:
+        return {"hits": 0, "misses": 0, "template_hits": {}, "total_match_us": 0.0}
+
+    def update_schema(self, schema_info: Dict[str, Dict]):
+        """Index the discovered schema for identifier resolution"""
+        self.schema_info = schema_info
+        self._columns = {
+            table_name: {col['name'].lower(): col.get('type', '') for col in info.get('columns', [])}
+            for table_name, info in schema_info.items()
+        }
+
+    def match(self, question: str) -> Optional[Dict[str, any]]:
+        """Resolve a question to SQL locally, returning None when no template applies"""
+        start_time = time.perf_counter()
+        text = normalize_question(question)
+        result = None
+
+        if self._columns:
+            for template_name, pattern in TEMPLATES:
+                match = pattern.match(text)
+                if not match:
+                    continue
+                result = getattr(self, f"_render_{template_name}")(match)
+                if result:
+                    result["template"] = template_name
+                    break
+
+        elapsed_us = (time.perf_counter() - start_time) * 1_000_000
+        self.stats["total_match_us"] += elapsed_us
+        if result:
+            self.stats["hits"] += 1
+            self.stats["template_hits"][result["template"]] = self.stats["template_hits"].get(result["template"], 0) + 1
+            result["match_time_us"] = elapsed_us
+        else:
+            self.stats["misses"] += 1
+        return result
+
+    def get_stats(self) -> Dict[str, any]:
+        """Hit-rate metrics for the template fast path"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "lookups": lookups,
+            "hits": self.stats["hits"],
+            "misses": self.stats["misses"],
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            "avg_match_us": self.stats["total_match_us"] / lookups if lookups else 0.0,
+            "template_hits": dict(self.stats["template_hits"]),
+        }
+
+    # Template renderers
+
+    def _render_total_count(self, match: re.Match) -> Optional[Dict[str, any]]:
+        table = self._resolve_table(match.group('entity'))
+        if not table:
+            return None
+        alias = f"total_{self._identifier(match.group('entity'))}"
+        return self._result(
+            f"SELECT COUNT(*) AS {alias} FROM {table}",
+            f"Counts all rows in {table}"
+        )
+
+    def _render_count_by_column(self, match: re.Match) -> Optional[Dict[str, any]]:
+        entity = match.group('entity')
+        table = self._resolve_table(entity)
+        column = self._resolve_column(match.group('column'), table) if table else None
+        if not column:
+            return None
+        alias = f"{singular_forms(self._identifier(entity))[-1]}_count"
+        return self._result(
+            f"SELECT {column}, COUNT(*) AS {alias} FROM {table} GROUP BY {column} ORDER BY {alias} DESC",
+            f"Counts {table} rows per {column}"
+        )
+
+    def _render_top_n_by_metric(self, match: re.Match) -> Optional[Dict[str, any]]:
+        limit = int(match.group('n') or 10)
+        return self._render_grouped_metric(match, order_limit=limit)
+
+    def _render_metric_by_dimension(self, match: re.Match) -> Optional[Dict[str, any]]:
+        return self._render_grouped_metric(match)
+
+    def _render_grouped_metric(self, match: re.Match, order_limit: Optional[int] = None) -> Optional[Dict[str, any]]:
+        dimension_phrase = match.group('dimension')
+        metric_phrase = match.group('metric')
+        aggregate = AGGREGATES.get(match.group('agg') or '', 'SUM')
+
+        # Metric is either "number of <entity/rows>" or a numeric column
+        metric_table = self._resolve_table(metric_phrase)
+        if metric_table or self._identifier(metric_phrase) in COUNT_METRICS:
+            if metric_table:
+                table, dimension = metric_table, self._resolve_column(dimension_phrase, metric_table)
+            else:
+                dimension, table = self._locate_column(dimension_phrase) or (None, None)
+            if not dimension:
+                return None
+            alias = self._identifier(metric_phrase)
+            select = f"COUNT(*) AS {alias}"
+            description = f"Counts {table} rows per {dimension}"
+        else:
+            resolved = self._resolve_columns([dimension_phrase, metric_phrase])
+            if not resolved:
+                return None
+            table, (dimension, metric) = resolved
+            if not self._is_numeric(table, metric):
+                return None
+            alias = f"{'total' if aggregate == 'SUM' else aggregate.lower()}_{metric}"
+            select = f"{aggregate}({metric}) AS {alias}"
+            description = f"{aggregate} of {metric} per {dimension} from {table}"
+
+        sql = f"SELECT {dimension}, {select} FROM {table} GROUP BY {dimension} ORDER BY {alias} DESC"
+        if order_limit:
+            sql += f" LIMIT {order_limit}"
+        return self._result(sql, description)
+
+    # Identifier resolution
+
+    def _identifier(self, phrase: str) -> str:
+        return re.sub(r'\s+', '_', phrase.strip())
+
+    def _candidates(self, phrase: str) -> List[str]:
+        return singular_forms(self._identifier(phrase))
+
+    def _resolve_table(self, phrase: str) -> Optional[str]:
+        """Map an entity phrase that is exactly a table name (or its singular/plural) to that table
+
+        Any other words in the phrase ("users clicked on an ad last week") are
+        filters no template can express, so the question is left to Claude.
+        """
+        candidates = self._candidates(phrase)
+        names = set(candidates) | {f"{candidate}s" for candidate in candidates}
+        for table_name in self._columns:
+            if table_name.lower() in names:
+                return table_name
+        return None
+
+    def _find_column(self, table_name: str, candidates: List[str]) -> Optional[str]:
+        columns = self._columns.get(table_name, {})
+        for candidate in candidates:
+            if candidate in columns:
+                return candidate
+        return None
+
+    def _resolve_column(self, phrase: str, table_name: str) -> Optional[str]:
+        """Resolve a column phrase within a known table"""
+        return self._find_column(table_name, self._candidates(phrase))
+
+    def _locate_column(self, phrase: str) -> Optional[Tuple[str, str]]:
+        """Find the single table holding a column phrase, returning (column, table)"""
+        candidates = self._candidates(phrase)
+        matches = [(column, table) for table in self._columns
+                   for column in [self._find_column(table, candidates)] if column]
+        return self._pick_table(matches)
+
+    def _resolve_columns(self, phrases: List[str]) -> Optional[Tuple[str, List[str]]]:
+        """Find a single table containing all of the phrases as columns"""
+        matches = []
+        for table in self._columns:
+            columns = [self._find_column(table, self._candidates(phrase)) for phrase in phrases]
+            if all(columns):
+                matches.append((columns, table))
+        picked = self._pick_table(matches)
+        return (picked[1], picked[0]) if picked else None
+
+    def _pick_table(self, matches: List[Tuple]) -> Optional[Tuple]:
+        """Prefer managed tables over external ones; give up when still ambiguous"""
+        if len(matches) > 1:
+            matches = [m for m in matches if not m[1].startswith('ext_')]
+        return matches[0] if len(matches) == 1 else None
+
+    def _is_numeric(self, table_name: str, column: str) -> bool:
+        column_type = self._columns[table_name].get(column, '').upper()
+        return column_type.startswith(NUMERIC_TYPES)
+
+    def _result(self, sql: str, explanation: str) -> Dict[str, any]:
+        return {"sql": sql, "explanation": explanation}
@@ -0,0 +1,390 @@
+"""
+Offline, schema-aware validation of generated SQL
+Resolves table and column references against the discovered schema and
+enforces read-only statements, so invalid SQL is rejected before it costs
+a round-trip to the Firebolt engine
+"""
+
+import difflib
+from typing import Dict, List, Optional, Set, Tuple
+
+import sqlparse
+from sqlparse import tokens as T
+from sqlparse.sql import Function, Identifier, IdentifierList, Parenthesis, TokenList
+
+from join_graph import JoinGraph
+
+
+# Statements allowed to reach the engine (read-only / analytical)
+READ_ONLY_STATEMENTS = {'SELECT', 'WITH', 'EXPLAIN', 'DESCRIBE', 'DESC', 'SHOW', 'VALUES'}
+
+# Keywords that modify data, schema or permissions anywhere in a statement
+WRITE_KEYWORDS = {
+    'INSERT', 'UPDATE', 'DELETE', 'MERGE', 'UPSERT', 'REPLACE',
+    'DROP', 'CREATE', 'ALTER', 'TRUNCATE', 'RENAME',
+    'GRANT', 'REVOKE', 'COPY', 'VACUUM'
+}
+
+# Schemas whose tables are not part of the discovered schema but are always readable
+SYSTEM_SCHEMAS = {'information_schema'}
+
+_NAME_TYPES = (T.Name, T.Literal.String.Symbol)
+
+SUGGESTION_CUTOFF = 0.6
+
+
+# Keywords allowed between FROM / JOIN and the table reference
+_SOURCE_MODIFIERS = {'LATERAL', 'ONLY'}
+
+
+def _is_source_keyword(token) -> bool:
+    """FROM / JOIN variants introduce a table reference"""
+    return token.is_keyword and (token.normalized == 'FROM' or token.normalized.endswith('JOIN'))
+
+
+def _is_subquery(token) -> bool:
+    """A parenthesis holding a statement, as opposed to function arguments like `(YEAR FROM d)`"""
+    if not isinstance(token, Parenthesis):
+        return False
+    first = next((t for t in token.tokens[1:] if not t.is_whitespace and t.ttype not in T.Comment), None)
+    return first is not None and first.ttype in (T.DML, T.Keyword.CTE)
+
+
+def _unquote(name: str) -> str:
+    """Identifiers are compared case-insensitively, with or without quotes"""
+    if len(name) > 1 and name[0] == name[-1] == '"':
+        name = name[1:-1]
+    return name.lower()
+
+
+class SQLValidator:
+    """Validate SQL against the discovered schema without contacting the engine"""
+
+    def __init__(self, schema_info: Optional[Dict[str, Dict]] = None,
+                 column_stats: Optional[Dict[str, Dict[str, Dict]]] = None):
+        self.update_schema(schema_info or {})
+        self.update_column_stats(column_stats or {})
+
+    def update_schema(self, schema_info: Dict[str, Dict]):
+        """Index tables and columns for case-insensitive lookups, and their join keys"""
+        self.schema_info = schema_info
+        self._tables = {
+            table_name.lower(): {col['name'].lower() for col in info.get('columns', [])}
+            for table_name, info in schema_info.items()
+        }
+        self.join_graph = JoinGraph(schema_info)
+
+    def update_column_stats(self, column_stats: Dict[str, Dict[str, Dict]]):
+        """Index profiled columns whose complete value list is known (see column_profiler)"""
+        self._known_values = {
+            table_name.lower(): {
+                column.lower(): stats['top_values'] for column, stats in columns.items() if stats.get('complete')
+            }
+            for table_name, columns in column_stats.items()
+        }
+
+    def validate(self, sql_query: str) -> Dict[str, any]:
+        """Validate a statement, returning errors, warnings and identifier suggestions
+
+        `valid` is False when the statement is not read-only or references a
+        table or column that does not exist in the discovered schema.
+        """
+        errors = self.check_read_only(sql_query)
+        warnings = []
+        suggestions = {}
+        tables = []
+
+        if not errors and self._tables:
+            statement = self._parse(sql_query)[0]
+            scope = self._collect_sources(statement)
+            tables = sorted(set(scope['tables'].values()))
+            for name in scope['unknown_tables']:
+                errors.append(self._unknown("table", name, self._tables.keys(), suggestions))
+            errors.extend(self._check_columns(statement, scope, suggestions))
+            warnings.extend(self._check_values(statement, scope))
+            warnings.extend(self._check_joins(statement, scope))
+            if scope['opaque'] and not scope['unknown_tables']:
+                warnings.append("Columns of subqueries, CTEs and table functions were not checked")
+
+        return {
+            "valid": not errors,
+            "issues": errors + warnings,
+            "errors": errors,
+            "warnings": warnings,
+            "suggestions": suggestions,
+            "tables": tables,
+            "sql": sql_query
+        }
+
+    def check_read_only(self, sql_query: str) -> List[str]:
+        """Reject empty input, multiple statements and anything that writes"""
+        statements = self._parse(sql_query)
+        if not statements:
+            return ["Empty SQL query"]
+        if len(statements) > 1:
+            return [f"Only a single statement is allowed, got {len(statements)}"]
+
+        statement = statements[0]
+        # Leading keyword, looking through any opening parentheses
+        leading = next((token.normalized for token in statement.flatten()
+                        if not token.is_whitespace and token.ttype not in T.Comment
+                        and not token.match(T.Punctuation, '(')), '')
+        errors = []
+        if leading not in READ_ONLY_STATEMENTS:
+            errors.append(
+                f"SQL must be an analytical query (SELECT, WITH, EXPLAIN, DESCRIBE, SHOW, VALUES). Got: {str(statement).strip()[:50]}..."
+            )
+
+        write_keywords = sorted({
+            token.normalized for token in statement.flatten()
+            if token.is_keyword and token.normalized in WRITE_KEYWORDS
+        })
+        if write_keywords:
+            errors.append(f"Statement is not read-only: {', '.join(write_keywords)}")
+        return errors
+
+    # Source (table) resolution
+
+    def _parse(self, sql_query: str) -> List:
+        return [statement for statement in sqlparse.parse(sql_query or '')
+                if statement.token_first(skip_cm=True) is not None]
+
+    def _collect_sources(self, statement: TokenList) -> Dict[str, any]:
+        """Find every table, alias and CTE referenced anywhere in the statement"""
+        scope = {
+            'tables': {},           # reference name (table or alias) -> schema table
+            'opaque': set(),        # aliases/CTEs whose columns are not known
+            'unknown_tables': []
+        }
+        self._walk(statement, scope)
+        return scope
+
+    def _walk(self, token_list: TokenList, scope: Dict[str, any], in_query: bool = True):
+        """Collect sources from `token_list`; FROM outside a query (`EXTRACT(YEAR FROM d)`) is not a source"""
+        expect_source = False
+        expect_cte = False
+        tokens = [t for t in token_list.tokens if not t.is_whitespace and t.ttype not in T.Comment]
+        skip = 0
+        for i, token in enumerate(tokens):
+            if skip:
+                skip -= 1
+                continue
+
+            if expect_cte and isinstance(token, (Identifier, IdentifierList)):
+                for cte in self._identifiers(token):
+                    scope['opaque'].add(_unquote(cte.get_name()))
+                    self._walk(cte, scope)
+                expect_cte = False
+                continue
+
+            if expect_source and isinstance(token, (Identifier, IdentifierList, Function)):
+                for source in self._identifiers(token):
+                    self._add_source(source, scope)
+                expect_source = False
+                continue
+
+            if expect_source and token.is_keyword and token.normalized in _SOURCE_MODIFIERS:
+                continue
+
+            # Table names sqlparse lexes as keywords (e.g. `events`), with an optional alias
+            if expect_source and token.is_keyword and not _is_source_keyword(token):
+                skip = self._add_keyword_source(token, tokens[i + 1:], scope)
+                expect_source = False
+                continue
+
+            expect_source = in_query and _is_source_keyword(token)
+            expect_cte = token.ttype is T.Keyword.CTE
+            if token.is_group:
+                if isinstance(token, (Function, Parenthesis)):
+                    self._walk(token, scope, _is_subquery(token))
+                else:
+                    self._walk(token, scope, in_query)
+
+    def _add_keyword_source(self, token, following: List, scope: Dict[str, any]) -> int:
+        """Resolve a keyword-lexed table reference; returns how many following tokens its alias used"""
+        name = _unquote(token.value)
+        used, alias = 0, None
+        if following and following[0].is_keyword and following[0].normalized == 'AS':
+            used = 1
+        if len(following) > used and isinstance(following[used], Identifier) \
+                and len(following[used].tokens) == 1 and following[used].tokens[0].ttype in _NAME_TYPES:
+            alias = _unquote(following[used].value)
+            used += 1
+        else:
+            used = 0
+
+        if name in scope['opaque']:
+            if alias:
+                scope['opaque'].add(alias)
+        elif name in self._tables:
+            scope['tables'][alias or name] = name
+            scope['tables'].setdefault(name, name)
+        elif name not in scope['unknown_tables']:
+            scope['unknown_tables'].append(name)
+        return used
+
+    def _identifiers(self, token) -> List:
+        if isinstance(token, IdentifierList):
+            return [t for t in token.get_identifiers() if isinstance(t, (Identifier, Function))]
+        return [token]
+
+    def _add_source(self, source, scope: Dict[str, any]):
+        alias = source.get_alias() if isinstance(source, Identifier) else None
+
+        # Subqueries and table functions: recurse, but their columns stay unknown
+        if isinstance(source, Function) or any(isinstance(t, (Parenthesis, Function)) for t in source.tokens):
+            if alias:
+                scope['opaque'].add(_unquote(alias))
+            self._walk(source, scope)
+            return
+
+        name = _unquote(source.get_real_name() or '')
+        schema = source.get_parent_name()
+        reference = _unquote(alias) if alias else name
+        if name in scope['opaque']:
+            # Reference to a CTE defined earlier in the statement
+            if alias:
+                scope['opaque'].add(reference)
+        elif schema and _unquote(schema) in SYSTEM_SCHEMAS:
+            scope['opaque'].add(reference)
+        elif name in self._tables:
+            scope['tables'][reference] = name
+            scope['tables'].setdefault(name, name)
+        elif name not in scope['unknown_tables']:
+            scope['unknown_tables'].append(name)
+
+    # Column resolution
+
+    def _check_columns(self, statement: TokenList, scope: Dict[str, any], suggestions: Dict[str, List[str]]) -> List[str]:
+        tokens = [t for t in statement.flatten() if not t.is_whitespace and t.ttype not in T.Comment]
+        known_names = set(scope['tables']) | scope['opaque'] | set(scope['unknown_tables'])
+        referenced = set(scope['tables'].values())
+        in_scope_columns = set().union(*(self._tables[table] for table in referenced)) if referenced else set()
+
+        # First pass: output aliases (`AS total`, `COUNT(*) cnt`) may be referenced anywhere
+        for i, token in enumerate(tokens):
+            if token.ttype in _NAME_TYPES and self._is_alias_definition(tokens, i):
+                known_names.add(_unquote(token.value))
+
+        errors = []
+        reported: Set[str] = set()
+        for i, token in enumerate(tokens):
+            if token.ttype not in _NAME_TYPES:
+                continue
+            previous = tokens[i - 1] if i > 0 else None
+            following = tokens[i + 1] if i + 1 < len(tokens) else None
+            if following is not None and (following.match(T.Punctuation, '.') or following.match(T.Punctuation, '(')):
+                continue  # qualifier or function name
+            if self._is_alias_definition(tokens, i):
+                continue
+
+            column = _unquote(token.value)
+            if previous is not None and previous.match(T.Punctuation, '.'):
+                qualifier = _unquote(tokens[i - 2].value)
+                table = scope['tables'].get(qualifier)
+                if table and column not in self._tables[table] and f"{qualifier}.{column}" not in reported:
+                    reported.add(f"{qualifier}.{column}")
+                    errors.append(self._unknown(f"column in {table}", f"{qualifier}.{column}",
+                                                self._tables[table], suggestions, lookup=column))
+                continue
+
+            if column in known_names or column in in_scope_columns or column in reported:
+                continue
+            # Columns could come from a subquery or CTE we cannot see into
+            if scope['opaque'] or scope['unknown_tables'] or not referenced:
+                continue
+            reported.add(column)
+            errors.append(self._unknown("column", column, in_scope_columns, suggestions))
+        return errors
+
+    def _check_values(self, statement: TokenList, scope: Dict[str, any]) -> List[str]:
+        """Warn about `column = 'literal'` / `column IN (...)` literals the column never holds"""
+        if not any(self._known_values.values()):
+            return []
+        tokens = [t for t in statement.flatten() if not t.is_whitespace and t.ttype not in T.Comment]
+        warnings = []
+        for i, token in enumerate(tokens[:-2]):
+            if token.ttype not in _NAME_TYPES:
+                continue
+            following = tokens[i + 1]
+            if following.match(T.Operator.Comparison, ('=', '!=', '<>')):
+                literals = tokens[i + 2:i + 3]
+            elif following.is_keyword and following.normalized == 'IN' and tokens[i + 2].match(T.Punctuation, '('):
+                literals = []
+                for literal in tokens[i + 3:]:
+                    if literal.match(T.Punctuation, ')'):
+                        break
+                    literals.append(literal)
+            else:
+                continue
+
+            column = _unquote(token.value)
+            if i > 1 and tokens[i - 1].match(T.Punctuation, '.'):
+                tables = [scope['tables'].get(_unquote(tokens[i - 2].value))]
+            else:
+                tables = [table for table in set(scope['tables'].values()) if column in self._tables[table]]
+            if len(tables) != 1 or column not in self._known_values.get(tables[0], {}):
+                continue
+            known = self._known_values[tables[0]][column]
+            for literal in literals:
+                if literal.ttype not in T.Literal.String.Single:
+                    continue
+                value = literal.value[1:-1].replace("''", "'")
+                if value in known:
+                    continue
+                matches = [v for v in known if v.lower() == value.lower()] or \
+                    difflib.get_close_matches(value, known, n=3, cutoff=SUGGESTION_CUTOFF)
+                message = f"Value '{value}' does not occur in {tables[0]}.{column}"
+                if matches:
+                    message += f" (did you mean {', '.join(repr(m) for m in matches)}?)"
+                warnings.append(message)
+        return warnings
+
+    def _check_joins(self, statement: TokenList, scope: Dict[str, any]) -> List[str]:
+        """Warn about joinable tables compared only on non-key columns (`a.x = b.y`)
+
+        Conditions are grouped per table pair, so a composite join that also
+        compares other columns is not flagged as long as one condition uses a key.
+        """
+        tokens = [t for t in statement.flatten() if not t.is_whitespace and t.ttype not in T.Comment]
+        conditions: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+        for i in range(len(tokens) - 6):
+            left_alias, dot, left_column, operator, right_alias, dot2, right_column = tokens[i:i + 7]
+            if not (operator.match(T.Operator.Comparison, '=') and dot.match(T.Punctuation, '.')
+                    and dot2.match(T.Punctuation, '.')):
+                continue
+            left = scope['tables'].get(_unquote(left_alias.value))
+            right = scope['tables'].get(_unquote(right_alias.value))
+            if not left or not right or left == right:
+                continue
+            pair = (_unquote(left_column.value), _unquote(right_column.value))
+            if left > right:
+                left, right, pair = right, left, pair[::-1]
+            conditions.setdefault((left, right), []).append(pair)
+
+        warnings = []
+        for (left, right), pairs in conditions.items():
+            keys = self.join_graph.join_columns(left, right)
+            if keys and not any(pair in keys for pair in pairs):
+                expected = " AND ".join(f"{left}.{l} = {right}.{r}" for l, r in keys)
+                for l, r in pairs:
+                    warnings.append(f"Join {left}.{l} = {right}.{r} does not use the join key ({expected})")
+        return warnings
+
+    def _is_alias_definition(self, tokens: List, index: int) -> bool:
+        """`expr AS name` or an implicit alias directly after an expression"""
+        if index == 0:
+            return False
+        previous = tokens[index - 1]
+        if previous.is_keyword:
+            return previous.normalized == 'AS'
+        return previous.ttype in _NAME_TYPES or previous.match(T.Punctuation, ')')
+
+    def _unknown(self, kind: str, name: str, candidates, suggestions: Dict[str, List[str]],
+                 lookup: Optional[str] = None) -> str:
+        matches = difflib.get_close_matches(lookup or name, sorted(candidates), n=3, cutoff=SUGGESTION_CUTOFF)
+        message = f"Unknown {kind}: {name}"
+        if matches:
+            suggestions[name] = matches
+            message += f" (did you mean {', '.join(matches)}?)"
+        return message
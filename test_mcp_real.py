@@ -8,6 +8,8 @@ import os
 import time
 import json
 import asyncio
+import re
+from contextlib import asynccontextmanager
 from typing import Dict, Any, List
 from dotenv import load_dotenv
 from mcp import ClientSession, StdioServerParameters
@@ -689,8 +691,46 @@ class RealFireboltMCPTest:
         except Exception as e:
             print(f"  ❌ Docs error: {str(e)}")
 
-async def execute_query_via_mcp(query: str) -> List[Dict[str, Any]]:
-    """Execute a single query via MCP - for use by other modules"""
+class FireboltMCPSession:
+    """Connected Firebolt MCP session that can run any number of queries"""
+    
+    def __init__(self, session: ClientSession, account: str, database: str, engine: str):
+        self.session = session
+        self.account = account
+        self.database = database
+        self.engine = engine
+    
+    async def query(self, query: str) -> List[Dict[str, Any]]:
+        """Run one query in this session and return its rows"""
+        query_result = await self.session.call_tool(
+            "firebolt_query",
+            {
+                "account": self.account,
+                "database": self.database,
+                "engine": self.engine,
+                "query": query
+            }
+        )
+        
+        if query_result.isError:
+            error_content = query_result.content[0].text if hasattr(query_result.content[0], 'text') else str(query_result.content)
+            raise Exception(f"Query failed: {error_content}")
+        
+        # Parse result
+        result_text = query_result.content[0].text if hasattr(query_result.content[0], 'text') else str(query_result.content[0])
+        
+        try:
+            # Try to parse as JSON
+            result_data = json.loads(result_text)
+            return result_data if isinstance(result_data, list) else [result_data]
+        except json.JSONDecodeError:
+            # Return as simple result
+            return [{"result": result_text}]
+
+
+@asynccontextmanager
+async def firebolt_mcp_session():
+    """Start the MCP server container, connect to Firebolt once and yield a FireboltMCPSession"""
     # Get credentials from environment
     service_account_id = os.getenv('FIREBOLT_MCP_CLIENT_ID')
     service_account_secret = os.getenv('FIREBOLT_MCP_CLIENT_SECRET')
@@ -712,69 +752,68 @@ async def execute_query_via_mcp(query: str) -> List[Dict[str, Any]]:
         ]
     )
     
-    try:
-        async with stdio_client(server_params) as (read, write):
-            async with ClientSession(read, write) as session:
-                await session.initialize()
-                
-                # Get documentation proof
-                docs_result = await session.call_tool("firebolt_docs", {})
-                if docs_result.isError:
-                    raise Exception(f"Failed to get docs proof: {docs_result.content}")
-                
-                # Extract docs proof
-                docs_content_str = str(docs_result.content)
-                import re
-                
-                # Try hardcoded proof first
-                proof_match = re.search(r'72J6hoVspktgpHtZXe1bSHurglRKhrTm', docs_content_str)
-                if proof_match:
-                    docs_proof = "72J6hoVspktgpHtZXe1bSHurglRKhrTm"
+    async with stdio_client(server_params) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            
+            # Get documentation proof
+            docs_result = await session.call_tool("firebolt_docs", {})
+            if docs_result.isError:
+                raise Exception(f"Failed to get docs proof: {docs_result.content}")
+            
+            # Extract docs proof
+            docs_content_str = str(docs_result.content)
+            
+            # Try hardcoded proof first
+            proof_match = re.search(r'72J6hoVspktgpHtZXe1bSHurglRKhrTm', docs_content_str)
+            if proof_match:
+                docs_proof = "72J6hoVspktgpHtZXe1bSHurglRKhrTm"
+            else:
+                # Try alternative pattern
+                proof_pattern = re.search(r'([A-Za-z0-9]{32})', docs_content_str)
+                if proof_pattern:
+                    docs_proof = proof_pattern.group(1)
                 else:
-                    # Try alternative pattern
-                    proof_pattern = re.search(r'([A-Za-z0-9]{32})', docs_content_str)
-                    if proof_pattern:
-                        docs_proof = proof_pattern.group(1)
-                    else:
-                        raise Exception("No valid docs_proof found")
-                
-                # Connect to Firebolt
-                connect_result = await session.call_tool(
-                    "firebolt_connect",
-                    {"docs_proof": docs_proof}
-                )
-                
-                if connect_result.isError:
-                    raise Exception(f"Firebolt connection failed: {connect_result.content}")
-                
-                # Execute the query
-                query_result = await session.call_tool(
-                    "firebolt_query",
-                    {
-                        "account": account,
-                        "database": database,
-                        "engine": engine,
-                        "query": query
-                    }
-                )
-                
-                if query_result.isError:
-                    error_content = query_result.content[0].text if hasattr(query_result.content[0], 'text') else str(query_result.content)
-                    raise Exception(f"Query failed: {error_content}")
-                
-                # Parse result
-                result_text = query_result.content[0].text if hasattr(query_result.content[0], 'text') else str(query_result.content[0])
-                
+                    raise Exception("No valid docs_proof found")
+            
+            # Connect to Firebolt
+            connect_result = await session.call_tool(
+                "firebolt_connect",
+                {"docs_proof": docs_proof}
+            )
+            
+            if connect_result.isError:
+                raise Exception(f"Firebolt connection failed: {connect_result.content}")
+            
+            yield FireboltMCPSession(session, account, database, engine)
+
+
+async def execute_query_via_mcp(query: str) -> List[Dict[str, Any]]:
+    """Execute a single query via MCP - for use by other modules"""
+    try:
+        async with firebolt_mcp_session() as firebolt:
+            return await firebolt.query(query)
+    except Exception as e:
+        raise Exception(f"MCP query execution failed: {str(e)}")
+
+
+async def execute_queries_via_mcp(queries: List[str]) -> List[Any]:
+    """Execute several queries in one MCP session (one container start and connect)
+    
+    Returns one entry per query: its rows, or the Exception it raised, so one
+    failing query does not discard the others.
+    """
+    results = []
+    try:
+        async with firebolt_mcp_session() as firebolt:
+            for query in queries:
                 try:
-                    # Try to parse as JSON
-                    result_data = json.loads(result_text)
-                    return result_data if isinstance(result_data, list) else [result_data]
-                except json.JSONDecodeError:
-                    # Return as simple result
-                    return [{"result": result_text}]
-                
+                    results.append(await firebolt.query(query))
+                except Exception as e:
+                    results.append(Exception(f"MCP query execution failed: {str(e)}"))
     except Exception as e:
         raise Exception(f"MCP query execution failed: {str(e)}")
+    return results
 
 async def main():
     """Main test runner"""
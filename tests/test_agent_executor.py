@@ -0,0 +1,96 @@
+from contextlib import asynccontextmanager
+
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("mcp")
+
+from agent_executor import AgentStep, AgentStepExecutor, resolve_dependencies
+
+
+def dependency_types(plan):
+    dependencies = resolve_dependencies(plan)
+    return {step.step_type: [dep.step_type for dep in dependencies[step.id]] for step in plan}
+
+
+def test_forward_unknown_and_self_references_are_dropped():
+    plan = [
+        AgentStep("discovery", "a", depends_on=[2]),
+        AgentStep("analysis", "b", depends_on=[1, 9, 2]),
+        AgentStep("comparison", "c", depends_on=[1, 1, 2]),
+    ]
+    assert dependency_types(plan) == {"discovery": [], "analysis": ["discovery"],
+                                      "comparison": ["discovery", "analysis"]}
+
+
+def test_missing_depends_on_is_inferred_from_step_type():
+    plan = [AgentStep("discovery", "a"), AgentStep("analysis", "b"), AgentStep("conclusion", "c")]
+    assert dependency_types(plan) == {"discovery": [], "analysis": [], "conclusion": ["discovery", "analysis"]}
+
+
+def test_step_numbers_from_the_planner_are_respected():
+    plan = [AgentStep("discovery", "a", depends_on=[], step_number=10),
+            AgentStep("conclusion", "b", depends_on=[10], step_number=20)]
+    assert dependency_types(plan) == {"discovery": [], "conclusion": ["discovery"]}
+
+
+class FakeFirebolt:
+    async def query(self, sql):
+        if "fail" in sql:
+            raise Exception("engine error")
+        return [{"value": 1}]
+
+
+@asynccontextmanager
+async def fake_session():
+    yield FakeFirebolt()
+
+
+class FakeConverter:
+    """Step SQL is `SELECT 'fail'` for the step types in `failing`"""
+
+    def __init__(self, failing):
+        self.failing = failing
+        self.contexts = {}
+
+    def generate_step_query(self, description, step_type, business_context, previous_results):
+        self.contexts[step_type] = previous_results
+        return {"success": True, "sql": "SELECT 'fail'" if step_type in self.failing else "SELECT 1"}
+
+    def analyze_query_results(self, results, description, business_question):
+        return {"key_insights": [description], "confidence_level": 0.9}
+
+
+def run_plan(plan, failing):
+    converter = FakeConverter(failing)
+    AgentStepExecutor(converter, "question", session_factory=fake_session).execute_steps(plan)
+    return converter, {step.step_type: step for step in plan}
+
+
+def test_step_whose_dependencies_all_failed_is_skipped():
+    plan = [
+        AgentStep("discovery", "a", depends_on=[]),
+        AgentStep("analysis", "b", depends_on=[]),
+        AgentStep("hypothesis", "c", depends_on=[1, 2]),
+        AgentStep("conclusion", "d", depends_on=[3]),
+        AgentStep("comparison", "e", depends_on=[]),
+    ]
+    converter, steps = run_plan(plan, failing={"discovery", "analysis"})
+
+    assert steps["hypothesis"].status == "failed"
+    assert steps["hypothesis"].error == "Skipped: the steps it depends on (1, 2) failed"
+    assert steps["conclusion"].error == "Skipped: the steps it depends on (3) failed"
+    assert "hypothesis" not in converter.contexts and "conclusion" not in converter.contexts
+    assert steps["comparison"].status == "completed"
+
+
+def test_step_with_a_surviving_dependency_runs_with_its_context():
+    plan = [
+        AgentStep("discovery", "a", depends_on=[]),
+        AgentStep("analysis", "b", depends_on=[]),
+        AgentStep("hypothesis", "c", depends_on=[1, 2]),
+    ]
+    converter, steps = run_plan(plan, failing={"discovery"})
+
+    assert steps["hypothesis"].status == "completed"
+    assert [context["insights"] for context in converter.contexts["hypothesis"]] == [["b"]]
@@ -0,0 +1,100 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("anthropic")
+
+from batch_convert import BatchConverter, load_completed
+from llm_calls import LLMUsageTracker
+
+
+class FakeBatches:
+    """messages.batches that succeeds every request with `SELECT <custom_id>`"""
+
+    def __init__(self):
+        self.created = []
+        self.submitted = {}
+
+    def create(self, requests):
+        batch_id = f"batch-{len(self.created)}"
+        self.created.append(requests)
+        self.submitted[batch_id] = [request["custom_id"] for request in requests]
+        return SimpleNamespace(id=batch_id)
+
+    def retrieve(self, batch_id):
+        return SimpleNamespace(processing_status="ended")
+
+    def results(self, batch_id):
+        for custom_id in self.submitted[batch_id]:
+            message = SimpleNamespace(sql=f"SELECT '{custom_id}'", usage=None)
+            yield SimpleNamespace(custom_id=custom_id, result=SimpleNamespace(type="succeeded", message=message))
+
+
+class FakeConverter:
+    def __init__(self):
+        self.client = SimpleNamespace(messages=SimpleNamespace(batches=FakeBatches()))
+        self.tier_ladder = SimpleNamespace(top_model="claude-3-5-sonnet-20241022")
+        self.llm = SimpleNamespace(tracker=LLMUsageTracker())
+        self.local = []
+
+    def _match_template(self, question):
+        return None
+
+    def _build_prompt(self, question, call_site):
+        return question, {}
+
+    def _build_request(self, prompt, model):
+        return {"model": model, "messages": [{"role": "user", "content": prompt}]}
+
+    def _response_to_result(self, message, question):
+        return {"success": True, "sql": message.sql}
+
+    def generate_sql(self, question):
+        self.local.append(question)
+        return {"success": True, "sql": "SELECT 'local'"}
+
+
+def questions(*ids):
+    return [{"id": i, "question": f"question {i}"} for i in ids]
+
+
+def read_output(path):
+    return [json.loads(line) for line in open(path, encoding='utf-8')]
+
+
+def test_load_completed_truncates_a_partial_last_line(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_text('{"id": "1"}\nnot json\n{"id": "2"}\n{"id": "3", "sq')
+    assert load_completed(str(path)) == {"1", "2"}
+    assert path.read_text() == '{"id": "1"}\nnot json\n{"id": "2"}\n'
+
+
+def test_batch_run_skips_ids_already_written(tmp_path):
+    output = tmp_path / "out.jsonl"
+    output.write_text(json.dumps({"id": "a", "success": True}) + "\n")
+    converter = FakeConverter()
+    summary = BatchConverter(converter, str(output)).run(questions("a", "b", "c"), mode="batch")
+
+    assert summary["converted"] == 2 and summary["skipped"] == 1
+    assert [r["id"] for r in read_output(output)] == ["a", "b", "c"]
+    assert len(converter.client.messages.batches.created[0]) == 2
+    assert converter.llm.tracker.summary()["totals"]["calls"] == 2
+    assert not (tmp_path / "out.jsonl.batch.json").exists()
+
+
+def test_resume_uses_the_checkpointed_batch_and_converts_new_questions_locally(tmp_path):
+    output = tmp_path / "out.jsonl"
+    converter = FakeConverter()
+    batches = converter.client.messages.batches
+    batches.submitted["batch-old"] = ["q-0", "q-1"]
+    checkpoint = {"batch_id": "batch-old", "model": "claude-3-5-sonnet-20241022",
+                  "questions": {"q-0": questions("a")[0], "q-1": questions("b")[0]}}
+    (tmp_path / "out.jsonl.batch.json").write_text(json.dumps(checkpoint))
+
+    BatchConverter(converter, str(output)).run(questions("a", "b", "c"), mode="batch")
+
+    records = {r["id"]: r for r in read_output(output)}
+    assert batches.created == []
+    assert records["a"]["sql"] == "SELECT 'q-0'" and records["b"]["mode"] == "batch"
+    assert records["c"]["mode"] == "local" and converter.local == ["question c"]
@@ -0,0 +1,28 @@
+from join_graph import JoinGraph
+
+
+def columns(*names):
+    return [{"name": name, "type": "BIGINT"} for name in names]
+
+
+SCHEMA = {
+    "players": {"columns": columns("player_id", "country"), "primary_index": "player_id"},
+    "player_events": {"columns": columns("event_id", "player_id", "session_id", "event_type"),
+                      "primary_index": "event_id"},
+    "player_events_big": {"columns": columns("event_id", "player_id", "session_id", "event_type"),
+                          "primary_index": "event_id"},
+    "transactions": {"columns": columns("transaction_id", "player_id", "amount_usd", "payment_method")},
+}
+
+
+def test_variants_and_unowned_keys_are_not_linked():
+    graph = JoinGraph(SCHEMA)
+    assert graph.join_columns("player_events", "player_events_big") == []
+    assert graph.join_columns("player_events", "players") == [("player_id", "player_id")]
+    assert graph.join_path("player_events_big", "player_events") == ["player_events_big", "players", "player_events"]
+
+
+def test_mentioned_tables_ranks_by_columns_when_tables_are_not_named():
+    graph = JoinGraph(SCHEMA)
+    assert graph.mentioned_tables("player events and transactions") == ["players", "player_events", "transactions"]
+    assert graph.mentioned_tables("total amount_usd by payment method per player") == ["players", "transactions"]
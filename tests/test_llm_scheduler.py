@@ -0,0 +1,87 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from llm_scheduler import BATCH, INTERACTIVE, LLMScheduler
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after: str):
+        super().__init__("rate limited")
+        self.response = SimpleNamespace(headers={"retry-after": retry_after})
+
+
+def start_waiter(scheduler, priority, order):
+    def wait():
+        with scheduler.slot(priority):
+            order.append(priority)
+    thread = threading.Thread(target=wait)
+    thread.start()
+    return thread
+
+
+def wait_for_queue(scheduler, depth):
+    deadline = time.time() + 2
+    while scheduler.stats()["queued"] < depth:
+        assert time.time() < deadline, "waiter never queued"
+        time.sleep(0.01)
+
+
+def test_interactive_requests_jump_queued_batch_requests():
+    scheduler = LLMScheduler(max_concurrent=1)
+    order = []
+    scheduler.acquire(INTERACTIVE)
+    batch = start_waiter(scheduler, BATCH, order)
+    wait_for_queue(scheduler, 1)
+    interactive = start_waiter(scheduler, INTERACTIVE, order)
+    wait_for_queue(scheduler, 2)
+
+    scheduler.release()
+    batch.join(2)
+    interactive.join(2)
+    assert order == [INTERACTIVE, BATCH]
+
+
+def test_reserved_slot_is_held_back_from_batch_work():
+    scheduler = LLMScheduler(max_concurrent=2)
+    scheduler.acquire(BATCH)
+    order = []
+    batch = start_waiter(scheduler, BATCH, order)
+    wait_for_queue(scheduler, 1)
+    time.sleep(0.1)
+    assert order == [] and scheduler.active == 1
+
+    scheduler.acquire(INTERACTIVE)
+    assert scheduler.active == 2
+    scheduler.release()
+    scheduler.release()
+    batch.join(2)
+    assert order == [BATCH]
+
+
+def test_rate_limit_pauses_every_caller():
+    scheduler = LLMScheduler(max_concurrent=4)
+    assert scheduler.retry_delay(RateLimited("0.3"), attempt=0) == 0.3
+    assert scheduler.stats()["paused_s"] > 0
+
+    start_time = time.perf_counter()
+    with scheduler.slot(INTERACTIVE):
+        waited_s = time.perf_counter() - start_time
+    assert waited_s >= 0.25
+    assert scheduler.counters["rate_limited"] == 1
+
+
+def test_run_retries_rate_limited_calls():
+    scheduler = LLMScheduler(max_concurrent=2)
+    calls = []
+
+    def call():
+        calls.append(time.perf_counter())
+        if len(calls) == 1:
+            raise RateLimited("0.05")
+        return "ok"
+
+    assert scheduler.run(INTERACTIVE, call) == "ok"
+    assert len(calls) == 2 and scheduler.counters["retries"] == 1
@@ -0,0 +1,48 @@
+from prompt_budget import PromptBudget, split_schema
+
+# Layout produced by app.py FireboltNL2SQLApp.format_schema_for_claude
+APP_SCHEMA = "\n".join([
+    "Database: gaming_demo",
+    "\n=== GAMING ANALYTICS DATABASE SCHEMA ===\n",
+    "💡 SCHEMA DESIGN: Player-centric star schema - all tables join through player_id\n",
+    "📋 DETAILED TABLE SCHEMA:\n",
+    "## 📊 Table: players (FACT)",
+    "🔑 Primary Index: player_id",
+    "🎯 Purpose: Player profiles, demographics, and account information",
+    "📋 All Columns:",
+    "   • player_id (BIGINT)",
+    "   • country (TEXT)",
+    "",
+    "## 📊 Table: transactions (FACT)",
+    "🔑 Primary Index: transaction_id",
+    "🎯 Purpose: Financial transactions including purchases and in-game spending",
+    "📋 All Columns:",
+    "   • transaction_id (BIGINT)",
+    "   • player_id (BIGINT)",
+    "   • amount_usd (DOUBLE)",
+    "",
+    "## 📊 Table: leaderboards (FACT)",
+    "🔑 Primary Index: leaderboard_id",
+    "📋 All Columns:",
+    "   • leaderboard_id (BIGINT)",
+    "   • rank_position (INT)",
+    "",
+    "💡 QUERY GUIDANCE:",
+    "- For revenue analysis: Use 'transactions' table joined with 'players' for demographics",
+])
+
+
+def test_app_schema_splits_into_tables():
+    _, tables, trailer = split_schema(APP_SCHEMA)
+    assert [name for name, _ in tables] == ["players", "transactions", "leaderboards"]
+    assert "💡 QUERY GUIDANCE:" in trailer
+
+
+def test_app_schema_is_trimmed_to_relevant_tables():
+    budget = PromptBudget({"nl2sql.generate": 120})
+    prompt, report = budget.fit("nl2sql.generate", lambda examples, schema: schema,
+                                schema=APP_SCHEMA, question="Total amount_usd of transactions by player")
+    assert "descriptions" in report["trimmed"]
+    assert report["trimmed"][-1] == "tables: leaderboards"
+    assert "Table: transactions" in prompt and "Table: players" in prompt
+    assert "Table: leaderboards" not in prompt
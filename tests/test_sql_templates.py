@@ -0,0 +1,26 @@
+from sql_templates import SQLTemplateEngine
+
+AD_SCHEMA = {
+    "ad_performance": {
+        "columns": [
+            {"name": "ad_id", "type": "TEXT"},
+            {"name": "country", "type": "TEXT"},
+            {"name": "clicks", "type": "BIGINT"},
+            {"name": "conversions", "type": "BIGINT"},
+        ]
+    }
+}
+
+
+def test_bare_table_count_uses_template():
+    result = SQLTemplateEngine(AD_SCHEMA).match("How many ad_performance are there?")
+    assert result["sql"] == "SELECT COUNT(*) AS total_ad_performance FROM ad_performance"
+
+
+def test_filtered_count_questions_fall_through_to_claude():
+    engine = SQLTemplateEngine(AD_SCHEMA)
+    for question in ("How many users clicked on an ad last week?",
+                     "How many conversions happened in Germany?",
+                     "How many ads?"):
+        assert engine.match(question) is None, question
+    assert engine.get_stats()["hits"] == 0
@@ -0,0 +1,58 @@
+import pytest
+
+from sql_validator import SQLValidator
+
+SCHEMA = {
+    "games": {"columns": [{"name": "game_id", "type": "TEXT"}, {"name": "name", "type": "TEXT"},
+                          {"name": "event_date", "type": "DATE"}]},
+    "events": {"columns": [{"name": "event_id", "type": "TEXT"}, {"name": "game_id", "type": "TEXT"},
+                           {"name": "event_type", "type": "TEXT"}]},
+}
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT EXTRACT(YEAR FROM event_date) AS year FROM games",
+    "SELECT TRIM(BOTH ' ' FROM name) FROM games",
+    "SELECT SUBSTRING(name FROM 2) FROM games",
+])
+def test_from_inside_function_arguments_is_not_a_table(sql):
+    result = SQLValidator(SCHEMA).validate(sql)
+    assert result["valid"], result["errors"]
+    assert result["tables"] == ["games"]
+
+
+def test_subquery_inside_function_is_still_resolved():
+    result = SQLValidator(SCHEMA).validate("SELECT COALESCE((SELECT MAX(name) FROM bogus), '')")
+    assert result["errors"] == ["Unknown table: bogus"]
+
+
+def test_keyword_table_names_are_resolved_and_checked():
+    validator = SQLValidator(SCHEMA)
+    result = validator.validate("SELECT e.event_type FROM events AS e JOIN games g ON g.game_id = e.game_id")
+    assert result["valid"], result["errors"]
+    assert result["tables"] == ["events", "games"]
+
+    result = validator.validate("SELECT e.nope FROM events e")
+    assert result["errors"] == ["Unknown column in events: e.nope"]
+
+
+JOIN_SCHEMA = {
+    "games": {"columns": [{"name": "game_id", "type": "INT"}, {"name": "player_id", "type": "INT"},
+                          {"name": "score", "type": "INT"}], "primary_index": "game_id, player_id"},
+    "events": {"columns": [{"name": "game_id", "type": "INT"}, {"name": "player_id", "type": "INT"},
+                           {"name": "score", "type": "INT"}]},
+}
+
+
+def test_composite_join_using_a_key_is_not_flagged():
+    result = SQLValidator(JOIN_SCHEMA).validate(
+        "SELECT g.score FROM games g JOIN events e "
+        "ON g.game_id = e.game_id AND g.player_id = e.player_id AND g.score = e.score"
+    )
+    assert result["warnings"] == []
+
+
+def test_join_on_non_key_columns_only_is_flagged():
+    result = SQLValidator(JOIN_SCHEMA).validate("SELECT g.score FROM games g JOIN events e ON g.score = e.score")
+    assert len(result["warnings"]) == 1
+    assert result["warnings"][0].startswith("Join events.score = games.score does not use the join key")